@@ -0,0 +1,201 @@
+# pds - Persistent data structure framework, Copyright (c) 2022 Ulrik Lindahl
+# Licensed under the MIT license https://github.com/Cooolrik/pds/blob/main/LICENSE
+
+# benchmark of the code generators, using a synthetic package of configurable size.
+# the generators are run in a temporary tree, and the wall time, peak memory, files written and lines emitted are reported per phase
+# example: python BenchmarkGenerators.py --versions=20 --items=1500 --variables=8 --templates=2 --modified=0.1 --jobs=0
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import CodeGeneratorHelpers as hlp
+from EntitiesHelpers import *
+
+try:
+	import resource
+except ImportError:
+	resource = None # not available on Windows, peak process memory is not reported
+
+core_generators = [
+	'EntityWriter',
+	'EntityReader',
+	'ElementTypes',
+	'ValueTypes',
+	'DynamicTypes',
+	]
+
+# the types and container flags (optional, vector, indexed) which the synthetic variables cycle through
+variable_types = ['u32','i64','float','dvec3','fmat4','uuid','hash','string','item_ref','entity_ref']
+variable_flags = [(False,False,False),(True,False,False),(False,True,False),(True,True,False),(False,True,True),(True,True,True)]
+
+def CreateVariable( index:int, name:str ):
+	optional,vector,indexed = variable_flags[index % len(variable_flags)]
+	return Variable( variable_types[index % len(variable_types)], name, optional = optional, vector = vector, indexed = indexed )
+
+class SyntheticItem:
+	"""the current definition of a synthetic item, which is updated as the item is modified in later versions"""
+	def __init__(self, index:int, variableCount:int, templateCount:int ):
+		self.IsEntity = (index % 2) == 1
+		self.Name = f'BenchEntity{index}' if self.IsEntity else f'BenchItem{index}'
+		self.Variables = [CreateVariable( index+v , f'Value{v}' ) for v in range(variableCount)]
+		self.Dependencies = []
+		self.Templates = []
+
+		# entities hold tables of an earlier item
+		if self.IsEntity and templateCount > 0:
+			tableItemName = f'BenchItem{(index//4)*2}'
+			self.Dependencies = [ Dependency( 'ItemTable', include_in_header = True ), Dependency( tableItemName, include_in_header = True ) ]
+			for t in range(templateCount):
+				self.Templates.append( Template( f'table{t}', template = 'ItemTable', types = ['item_ref',tableItemName] ) )
+				self.Variables.append( Variable( f'table{t}', f'Table{t}', optional = True ) )
+
+	def New(self) -> Item:
+		itemType = NewEntity if self.IsEntity else NewItem
+		return itemType( self.Name, variables = self.Variables, dependencies = self.Dependencies, templates = self.Templates )
+
+	def Identical(self) -> Item:
+		itemType = IdenticalEntity if self.IsEntity else IdenticalItem
+		return itemType( self.Name )
+
+	# rename the first variable and add a new variable, and map the rest as the same
+	def Modified(self, versionName:str) -> Item:
+		renamed = self.Variables[0]
+		variables = [CreateVariable( len(self.Variables) , f'Added_{versionName}' ), Variable( renamed.Type, f'{renamed.Name}_{versionName}', renamed.Optional, renamed.Vector, renamed.IndexedVector )]
+		mappings = [NewVariable( variables[0].Name ), RenamedVariable( variables[1].Name, renamed.Name )]
+		for var in self.Variables[1:]:
+			variables.append( var )
+			mappings.append( SameVariable( var.Name ) )
+		self.Variables = variables
+		itemType = ModifiedEntity if self.IsEntity else ModifiedItem
+		return itemType( self.Name, variables = self.Variables, dependencies = self.Dependencies, templates = self.Templates, mappings = mappings )
+
+# create a package with the first version defining all items, and each later version modifying a fraction of them
+def CreateSyntheticPackage( path:str, versionCount:int, itemCount:int, variableCount:int, templateCount:int, modifiedFraction:float ) -> Package:
+	syntheticItems = [SyntheticItem( i , variableCount , templateCount ) for i in range(itemCount)]
+	modifiedPeriod = max( 1 , round( 1.0 / modifiedFraction ) ) if modifiedFraction > 0 else None
+
+	versions = []
+	previousVersion = None
+	for v in range(versionCount):
+		versionName = f'v{v}'
+		items = []
+		for i,syntheticItem in enumerate(syntheticItems):
+			if previousVersion == None:
+				items.append( syntheticItem.New() )
+			elif modifiedPeriod != None and (i + v) % modifiedPeriod == 0:
+				items.append( syntheticItem.Modified( versionName ) )
+			else:
+				items.append( syntheticItem.Identical() )
+		previousVersion = Version( versionName, previousVersion = previousVersion, items = items )
+		versions.append( previousVersion )
+
+	return Package( 'BenchPack', path = path, versions = versions )
+
+# peak resident memory of this process and its worker processes in MB, or None if not available
+def PeakProcessMemory():
+	if resource == None:
+		return None
+	unit = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in bytes on macOS, and kB elsewhere
+	peak = max( resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss , resource.getrusage( resource.RUSAGE_CHILDREN ).ru_maxrss )
+	return peak * unit / (1024*1024)
+
+class Benchmark:
+	"""runs and measures the phases of the benchmark"""
+	def __init__(self, traceMemory:bool, verbose:bool ):
+		self.TraceMemory = traceMemory
+		self.Verbose = verbose
+		self.Results = []
+
+	def RunPhase( self, name:str, function, *args ):
+		totalsBefore = dict( hlp.emit_totals )
+		if self.TraceMemory:
+			tracemalloc.start()
+		startTime = time.perf_counter()
+		if self.Verbose:
+			result = function( *args )
+		else:
+			with open( os.devnull, 'w' ) as devnull, contextlib.redirect_stdout( devnull ):
+				result = function( *args )
+		wallTime = time.perf_counter() - startTime
+		tracedPeak = None
+		if self.TraceMemory:
+			tracedPeak = tracemalloc.get_traced_memory()[1] / (1024*1024)
+			tracemalloc.stop()
+
+		phase = { 'phase': name, 'seconds': wallTime, 'traced_peak_mb': tracedPeak, 'process_peak_mb': PeakProcessMemory() }
+		for key,value in hlp.emit_totals.items():
+			phase[key] = value - totalsBefore[key]
+		self.Results.append( phase )
+		return result
+
+	def PrintResults(self):
+		def mb( value ):
+			return '-' if value == None else f'{value:.1f}'
+		print( f'{"phase":<34}{"time (s)":>10}{"written":>9}{"identical":>11}{"lines":>11}{"traced MB":>11}{"peak MB":>10}' )
+		for phase in self.Results:
+			print( f'{phase["phase"]:<34}{phase["seconds"]:>10.3f}{phase["files_written"]:>9}{phase["files_identical"]:>11}{phase["lines"]:>11}{mb(phase["traced_peak_mb"]):>11}{mb(phase["process_peak_mb"]):>10}' )
+
+# reset the manifest, so the next run regenerates and compares all files
+def ClearManifest():
+	if os.path.exists( hlp.manifest_path ):
+		os.remove( hlp.manifest_path )
+	hlp._manifest = None
+
+def main():
+	parser = argparse.ArgumentParser( description = 'Benchmark the pds code generators on a synthetic package.' )
+	parser.add_argument( '--versions', type = int, default = 10, help = 'number of versions in the package' )
+	parser.add_argument( '--items', type = int, default = 200, help = 'number of items in each version, every other item is an entity' )
+	parser.add_argument( '--variables', type = int, default = 6, help = 'number of variables in each item' )
+	parser.add_argument( '--templates', type = int, default = 1, help = 'number of ItemTable templates (and table variables) in each entity' )
+	parser.add_argument( '--modified', type = float, default = 0.1, help = 'fraction of the items which are modified in each later version, the rest are identical' )
+	parser.add_argument( '--jobs', type = int, default = hlp.worker_count, help = 'number of worker processes, 0 uses one per core' )
+	parser.add_argument( '--trace-memory', action = 'store_true', help = 'also report the peak python allocations of each phase (slows the generators down)' )
+	parser.add_argument( '--json', help = 'write the results to a json file' )
+	parser.add_argument( '--keep', action = 'store_true', help = 'keep the generated tree, and print its path' )
+	parser.add_argument( '--verbose', action = 'store_true', help = 'print the generator output' )
+	parser.add_argument( '--force', action = 'store_true', help = argparse.SUPPRESS )
+	args = parser.parse_args()
+
+	hlp.worker_count = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+	codeGenDir = os.path.dirname( os.path.abspath(__file__) )
+	jsonPath = os.path.abspath( args.json ) if args.json else None
+
+	# set up a tree mirroring the repo, so the generators can write to their usual relative paths
+	rootDir = tempfile.mkdtemp( prefix = 'pds_benchmark_' )
+	workDir = os.path.join( rootDir, 'CodeGen' )
+	shutil.copytree( os.path.join( codeGenDir, 'InlinedCode' ), os.path.join( workDir, 'InlinedCode' ) )
+	os.makedirs( os.path.join( rootDir, 'Include', 'pds' ) )
+	os.makedirs( os.path.join( rootDir, 'Tests' ) )
+	previousDir = os.getcwd()
+	os.chdir( workDir )
+
+	try:
+		benchmark = Benchmark( args.trace_memory, args.verbose )
+		package = benchmark.RunPhase( 'build and check package', CreateSyntheticPackage, '../Tests/BenchPack', args.versions, args.items, args.variables, args.templates, args.modified )
+		benchmark.RunPhase( 'core generators', hlp.run_modules, core_generators )
+		benchmark.RunPhase( 'package generator', hlp.run_module, 'PackageGenerator', package, 'Latest' )
+		benchmark.RunPhase( 'package generator, unchanged', hlp.run_module, 'PackageGenerator', package, 'Latest' )
+		ClearManifest()
+		benchmark.RunPhase( 'package generator, no manifest', hlp.run_module, 'PackageGenerator', package, 'Latest' )
+
+		print( f'Package: {args.versions} versions, {args.items} items, {args.variables} variables, {args.templates} templates, {args.modified} modified, {hlp.worker_count} jobs' )
+		benchmark.PrintResults()
+		if jsonPath:
+			with open( jsonPath, 'w' ) as f:
+				json.dump( { 'arguments': vars(args), 'jobs': hlp.worker_count, 'phases': benchmark.Results }, f, indent = 1 )
+	finally:
+		os.chdir( previousDir )
+		if args.keep:
+			print( f'Generated tree: {rootDir}' )
+		else:
+			shutil.rmtree( rootDir, onerror = lambda function, path, info: (os.chmod( path, 0o700 ), function( path )) )
+
+if __name__ == '__main__':
+	main()
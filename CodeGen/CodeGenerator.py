@@ -3,9 +3,13 @@
 
 import CodeGeneratorHelpers as hlp
 
-hlp.run_module('EntityWriter')
-hlp.run_module('EntityReader')
-hlp.run_module('ElementTypes')
-hlp.run_module('ValueTypes')
-hlp.run_module('DynamicTypes')
+# run with --jobs=N to spread the generators over N worker processes
+if __name__ == '__main__':
+	hlp.run_modules( [
+		'EntityWriter',
+		'EntityReader',
+		'ElementTypes',
+		'ValueTypes',
+		'DynamicTypes',
+		] )
 
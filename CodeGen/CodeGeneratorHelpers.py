@@ -3,8 +3,15 @@
 
 import copy
 import os
+import sys
+import json
+import hashlib
+import io
+import contextlib
+import concurrent.futures
 from stat import S_IRUSR, S_IRGRP, S_IROTH, S_IWUSR
 import importlib
+import time
 
 class BaseType:
 	def __init__(self,name,variants):
@@ -73,17 +80,15 @@ container_types = [ContainerType(0x00,'none',False),
 				   ContainerType(0x20,'idx_vector'),
 				   ContainerType(0x21,'optional_idx_vector')]
 
+# lookup of base_type and base_type_variant, from the name of the implementing type
+base_type_variants_by_name = { var.implementing_type : (typ,var) for typ in base_types for var in typ.variants }
+
 # find a base type based on name, and return base_type and base_type_variant info
 def get_base_type_variant( name ):
-	for typ in base_types:
-		for var in typ.variants:
-			if name == var.implementing_type:
-				return typ, var
-	return None,None
+	return base_type_variants_by_name.get( name , (None,None) )
 
 # print all lines using all items in list, with all base types and all variants (including optional variants), as well as all vector versions of base types
 def generate_lines_for_all_basetype_combos( line_list ):
-	lines = []
 	for basetype in base_types:
 		for var in basetype.variants:
 			for cont in container_types:
@@ -92,8 +97,7 @@ def generate_lines_for_all_basetype_combos( line_list ):
 						base_type_container_combo = f'{cont.implementing_type}<{var.implementing_type}>'
 					else:
 						base_type_container_combo = var.implementing_type
-					lines.append( 
-						line.format( 
+					yield line.format( 
 							base_type_name = basetype.name , 
 							implementing_type = var.implementing_type , 
 							container_type = cont.implementing_type , 
@@ -101,12 +105,9 @@ def generate_lines_for_all_basetype_combos( line_list ):
 							num_items_per_object = var.num_items_per_object , 
 							base_type_combo = base_type_container_combo 
 							) 
-						)
-	return lines
 
 # call function with all base types and all variants (including optional variants), as well as all vector versions of base types
 def function_for_all_basetype_combos( line_function ):
-	lines = []
 	for basetype in base_types:
 		for var in basetype.variants:
 			for cont in container_types:
@@ -114,8 +115,7 @@ def function_for_all_basetype_combos( line_function ):
 					base_type_container_combo = f'{cont.implementing_type}<{var.implementing_type}>'
 				else:
 					base_type_container_combo = var.implementing_type
-				lines.extend( 
-					line_function( 
+				yield from line_function( 
 						base_type_name = basetype.name , 
 						implementing_type = var.implementing_type , 
 						container_type = cont.implementing_type , 
@@ -123,8 +123,6 @@ def function_for_all_basetype_combos( line_function ):
 						num_items_per_object = var.num_items_per_object , 
 						base_type_combo = base_type_container_combo 
 						) 
-					)
-	return lines
 
 # reads a file and output lines
 def inline_file( path ):
@@ -169,38 +167,432 @@ def generate_pop_warnings( comment = 're-enable warnings again' ):
 	lines.append('#endif')
 	return lines
 
+# the manifest of generated files is stored in the current working directory, and is ignored if --force is passed on the command line
+manifest_path = 'pds_manifest.json'
+force_regeneration = '--force' in sys.argv
+
+# number of worker processes used to run generators, set with --jobs=N on the command line, or the PDS_CODEGEN_JOBS environment variable. 
+# 1 (the default) runs all generators in the calling process, 0 uses one worker per core
+def _parse_worker_count():
+	value = os.environ.get('PDS_CODEGEN_JOBS','1')
+	source = 'PDS_CODEGEN_JOBS'
+	for inx,arg in enumerate(sys.argv):
+		if arg.startswith('--jobs='):
+			value = arg[len('--jobs='):]
+			source = '--jobs'
+		elif arg == '--jobs':
+			if inx+1 >= len(sys.argv):
+				sys.exit('--jobs requires a number of worker processes, e.g. --jobs=4')
+			value = sys.argv[inx+1]
+			source = '--jobs'
+	try:
+		count = int(value)
+	except ValueError:
+		sys.exit(f'Invalid {source} value "{value}", expected a number of worker processes (0 uses one worker per core)')
+	if count <= 0:
+		count = os.cpu_count() or 1
+	return count
+worker_count = _parse_worker_count()
+
+# opt-in profiling of the generators, enabled with --profile (or --profile=path) on the command line, or by setting the
+# PDS_CODEGEN_PROFILE environment variable to the report path. the report is a json file with the run time of each generator, 
+# and the build time, compare/write time, size and line count of each emitted file. each script run is stored under its own name
+def _parse_profile_path():
+	path = os.environ.get('PDS_CODEGEN_PROFILE')
+	for arg in sys.argv:
+		if arg == '--profile':
+			path = 'pds_profile.json'
+		elif arg.startswith('--profile='):
+			path = arg[len('--profile='):]
+	return path if path else None
+profile_path = _parse_profile_path()
+
+# sha256 hex digest of a text string
+def hash_text( text ):
+	return hashlib.sha256( text.encode('utf-8') ).hexdigest()
+
+# hash of all the generator code (the helpers, generators and inlined code), so that any change to the generators invalidates the manifest
+_generator_code_hash = None
+def generator_code_hash():
+	global _generator_code_hash
+	if _generator_code_hash is None:
+		code_dir = os.path.dirname( os.path.abspath(__file__) )
+		paths = ['CodeGeneratorHelpers.py','EntitiesHelpers.py']
+		for sub_dir in ['Generators','InlinedCode']:
+			for file in sorted( os.listdir( os.path.join(code_dir,sub_dir) ) ):
+				if file.endswith('.py') or file.endswith('.inl'):
+					paths.append( f'{sub_dir}/{file}' )
+		digest = hashlib.sha256()
+		for path in paths:
+			digest.update( path.encode('utf-8') )
+			with open( os.path.join(code_dir,path) ,'rb') as f:
+				digest.update( f.read() )
+		_generator_code_hash = digest.hexdigest()
+	return _generator_code_hash
+
+class Manifest:
+	"""persistent record of the input hash of each generator (or generated item), and of the files it wrote, 
+	so that generators whose inputs have not changed since the last run can be skipped entirely"""
+
+	def __init__(self, path):
+		self.path = path
+		self.entries = {}
+		if os.path.exists(path):
+			try:
+				with open(path,'r') as f:
+					self.entries = json.load(f).get('entries',{})
+			except (OSError,ValueError):
+				print( '\tIgnoring unreadable manifest: ' + path )
+				self.entries = {}
+
+	# returns True if the named entry was generated from the same inputs, and all its output files are unmodified since then
+	def is_up_to_date( self , key , input_hash ):
+		if force_regeneration:
+			return False
+		entry = self.entries.get(key)
+		if entry is None or entry['inputs'] != input_hash:
+			return False
+		for path,output in entry['outputs'].items():
+			try:
+				st = os.stat(path)
+			except OSError:
+				return False
+			if st.st_size != output['size'] or st.st_mtime_ns != output['mtime']:
+				return False
+		return True
+
+	# record the input hash and the output files of a generator
+	def record( self , key , input_hash , outputs ):
+		self.entries[key] = { 'inputs': input_hash , 'outputs': outputs }
+
+	def save(self):
+		with open(self.path,'w') as f:
+			json.dump( { 'version': 1 , 'entries': self.entries } , f , indent = 1 , sort_keys = True )
+
+_manifest = None
+def get_manifest():
+	global _manifest
+	if _manifest is None:
+		_manifest = Manifest( manifest_path )
+	return _manifest
+
+# the output files written (or found identical) while recording, as a dict of path -> {hash,size,mtime}
+_recorded_outputs = None
+
+def begin_recording_outputs():
+	global _recorded_outputs
+	_recorded_outputs = {}
+
+def end_recording_outputs():
+	global _recorded_outputs
+	outputs = _recorded_outputs
+	_recorded_outputs = None
+	return outputs
+
+def _record_output( path , text_hash ):
+	if _recorded_outputs is not None:
+		st = os.stat(path)
+		_recorded_outputs[os.path.normpath(path)] = { 'hash': text_hash , 'size': st.st_size , 'mtime': st.st_mtime_ns }
+
+# profile records of the generators and emitted files of this process (and of worker processes on its behalf), if profiling
+_profile_generators = []
+_profile_files = []
+_profiled_generator = None # key of the currently running generator
+
+# run a generator function, and record its run time if profiling
+def _run_profiled( key , function , *args ):
+	global _profiled_generator
+	if profile_path is None:
+		return function( *args )
+	parent = _profiled_generator
+	_profiled_generator = key
+	start_time = time.perf_counter()
+	try:
+		return function( *args )
+	finally:
+		_profile_generators.append( { 'generator': key , 'parent': parent , 'seconds': time.perf_counter() - start_time , 'skipped': False } )
+		_profiled_generator = parent
+
+def _profile_skipped( key ):
+	if profile_path is not None:
+		_profile_generators.append( { 'generator': key , 'parent': _profiled_generator , 'seconds': 0.0 , 'skipped': True } )
+
+# write the profile report, if profiling. the report of this script replaces any previous report of the same script
+def save_profile():
+	if profile_path is None:
+		return
+	runs = {}
+	if os.path.exists(profile_path):
+		try:
+			with open(profile_path,'r') as f:
+				runs = json.load(f).get('runs',{})
+		except (OSError,ValueError):
+			runs = {}
+	runs[os.path.basename(sys.argv[0])] = { 
+		'jobs': worker_count , 
+		'totals': emit_totals , 
+		'generators': _profile_generators , 
+		'files': _profile_files 
+		}
+	with open(profile_path,'w') as f:
+		json.dump( { 'version': 1 , 'runs': runs } , f , indent = 1 )
+
+# run a generator function. if the generator raises, the files it has not closed yet are aborted, 
+# so no temporary files are left next to the generated files
+def _run_generator( key , function , *args ):
+	try:
+		return _run_profiled( key , function , *args )
+	except BaseException:
+		_abort_open_emitters()
+		raise
+
+# run a generator function, unless the manifest says that the outputs of key are already generated from input_hash
+# returns True if the generator was run, False if it was skipped
+def run_if_changed( key , input_hash , generator_function , *args ):
+	manifest = get_manifest()
+	if manifest.is_up_to_date( key , input_hash ):
+		_profile_skipped( key )
+		return False
+	begin_recording_outputs()
+	_run_generator( key , generator_function , *args )
+	manifest.record( key , input_hash , end_recording_outputs() )
+	return True
+
+# runs a generator job in a worker process, captures the console output so the caller can print it in job order
+def _run_job_in_worker( job ):
+	global _profiled_generator
+	parent,key,function,args = job
+	_profiled_generator = parent
+	output = io.StringIO()
+	totals_before = dict(emit_totals)
+	generators_before = len(_profile_generators)
+	files_before = len(_profile_files)
+	with contextlib.redirect_stdout(output):
+		begin_recording_outputs()
+		_run_generator( key , function , *args )
+		outputs = end_recording_outputs()
+	totals = { name: value - totals_before[name] for name,value in emit_totals.items() }
+	profile = ( _profile_generators[generators_before:] , _profile_files[files_before:] )
+	return output.getvalue(), outputs, totals, profile
+
+# run a list of (key, input_hash, function, args) jobs, skipping the jobs which are up to date in the manifest.
+# if worker_count > 1, the jobs are spread over a pool of worker processes, where initializer(*initargs) is called 
+# once in each worker before any job. the console output and manifest records are handled in job order, so 
+# the result is the same regardless of the number of workers. returns the number of skipped jobs.
+def run_jobs( jobs , initializer = None , initargs = () ):
+	manifest = get_manifest()
+	changed_jobs = []
+	for job in jobs:
+		if manifest.is_up_to_date( job[0] , job[1] ):
+			_profile_skipped( job[0] )
+		else:
+			changed_jobs.append( job )
+	if worker_count > 1 and len(changed_jobs) > 1:
+		pool_size = min( worker_count , len(changed_jobs) )
+		chunk_size = max( 1 , len(changed_jobs) // (pool_size*4) )
+		with concurrent.futures.ProcessPoolExecutor( max_workers = pool_size , initializer = initializer , initargs = initargs ) as executor:
+			results = executor.map( _run_job_in_worker , [(_profiled_generator,job[0],job[2],job[3]) for job in changed_jobs] , chunksize = chunk_size )
+			for job,(output,outputs,totals,profile) in zip(changed_jobs,results):
+				sys.stdout.write( output )
+				manifest.record( job[0] , job[1] , outputs )
+				_add_emit_totals( totals )
+				_profile_generators.extend( profile[0] )
+				_profile_files.extend( profile[1] )
+	else:
+		if initializer is not None:
+			initializer( *initargs )
+		for job in changed_jobs:
+			begin_recording_outputs()
+			_run_generator( job[0] , job[2] , *job[3] )
+			manifest.record( job[0] , job[1] , end_recording_outputs() )
+	return len(jobs) - len(changed_jobs)
+
+def _run_module_job( name ):
+	print('Running: ' + name )
+	importlib.import_module('Generators.' + name ).run()
+	print('')
+
+# run core generators (which only depend on the generator code), skipping generators which are unchanged
+def run_modules( names ):
+	skipped = run_jobs( [('Generators.' + name , generator_code_hash() , _run_module_job , (name,)) for name in names] )
+	if skipped > 0:
+		print( f'Skipping: {skipped} generators, (inputs are unchanged)...')
+		print('')
+	get_manifest().save()
+	save_profile()
+
 def run_module( name , *args ):
+	if len(args) == 0:
+		run_modules( [name] )
+		return
+	# generators with arguments do their own finer grained manifest checks
 	print('Running: ' + name )
-	importlib.import_module('Generators.' + name ).run( *args )
+	_run_generator( 'Generators.' + name , importlib.import_module('Generators.' + name ).run , *args )
+	get_manifest().save()
+	save_profile()
 	print('')
 
-def write_lines_to_file( path , lines ):
-	# make into one long string
-	new_text = ''
-	for line in lines:
-		new_text += line + '\n'
-
-	# if the file already exists, check if we have an update
-	if os.path.exists(path):
-		# try reading in the current file if one exists
-		with open(path,'r') as f:
-			existing_text = f.read()
-			f.close()
-
-		#if no difference was found, return
-		if new_text == existing_text:
-			print( '\tSkipping: ' + path + ', (it is identical)...')
+# totals of all files emitted by this process, including the files emitted by worker processes on its behalf
+emit_totals = { 'files_written': 0 , 'files_identical': 0 , 'lines': 0 , 'bytes': 0 }
+
+def _add_emit_totals( totals ):
+	for key,value in totals.items():
+		emit_totals[key] += value
+
+# the emitters of this process which are not closed yet
+_open_emitters = []
+
+# abort all emitters which are not closed, called when a generator fails
+def _abort_open_emitters():
+	for emitter in list(_open_emitters):
+		emitter.abort()
+
+class FileEmitter:
+	"""streams generated lines to a file. the lines are buffered in chunks, and each chunk is compared against the 
+	existing file as it is emitted. the new file is only written (to a temporary file, which replaces the existing 
+	file on close) from the first chunk which differs, so memory use is flat and an identical file is never rewritten. 
+	supports append() and extend() like a list of lines, so generators can emit into it directly. can be used as a 
+	context manager, which closes the emitter, or aborts it if the block raises"""
+	
+	chunk_size = 64 * 1024
+
+	def __init__(self, path):
+		self.path = path
+		self.temp_path = path + '.tmp'
+		self.chunk = []
+		self.chunk_length = 0
+		self.line_count = 0
+		self.byte_count = 0
+		self.start_time = time.perf_counter()
+		self.write_seconds = 0.0 # time spent hashing, comparing and writing, the rest is spent building the lines
+		self.digest = hashlib.sha256()
+		self.existing_file = open(path,'r') if os.path.exists(path) else None
+		self.matched_length = 0 # number of characters identical to the start of the existing file
+		self.temp_file = None # opened when the first difference is found
+		_open_emitters.append( self )
+
+	def __enter__(self):
+		return self
+
+	def __exit__( self , exc_type , exc_value , traceback ):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+		return False
+
+	# close the files without replacing the existing file, and remove the temporary file
+	def abort(self):
+		if self in _open_emitters:
+			_open_emitters.remove( self )
+		if self.existing_file is not None:
+			self.existing_file.close()
+			self.existing_file = None
+		if self.temp_file is not None:
+			self.temp_file.close()
+			self.temp_file = None
+			if os.path.exists( self.temp_path ):
+				os.remove( self.temp_path )
+
+	def append( self , line ):
+		self.chunk.append( line )
+		self.chunk_length += len(line) + 1
+		self.line_count += 1
+		if self.chunk_length >= self.chunk_size:
+			self._flush_chunk()
+
+	def extend( self , lines ):
+		for line in lines:
+			self.append( line )
+
+	def _open_temp_file(self):
+		self.temp_file = open(self.temp_path,'w')
+		
+		# copy over the part of the existing file which was identical
+		if self.matched_length > 0:
+			self.existing_file.seek(0)
+			remaining = self.matched_length
+			while remaining > 0:
+				text = self.existing_file.read( min(remaining,self.chunk_size) )
+				self.temp_file.write( text )
+				remaining -= len(text)
+
+	def _flush_chunk(self):
+		if len(self.chunk) == 0:
 			return
+		self.chunk.append('')
+		text = '\n'.join( self.chunk )
+		self.chunk = []
+		self.chunk_length = 0
+		start_time = time.perf_counter()
+		data = text.encode('utf-8')
+		self.byte_count += len(data)
+		self.digest.update( data )
+
+		# while the new text is identical to the existing file, just keep comparing
+		if self.temp_file is None and self.existing_file is not None:
+			if self.existing_file.read( len(text) ) == text:
+				self.matched_length += len(text)
+				self.write_seconds += time.perf_counter() - start_time
+				return
+		if self.temp_file is None:
+			self._open_temp_file()
+		self.temp_file.write( text )
+		self.write_seconds += time.perf_counter() - start_time
+
+	def _finish( self , text_hash , skipped ):
+		_record_output( self.path , text_hash )
+		if skipped:
+			_add_emit_totals( { 'files_identical': 1 , 'lines': self.line_count , 'bytes': self.byte_count } )
+		else:
+			_add_emit_totals( { 'files_written': 1 , 'lines': self.line_count , 'bytes': self.byte_count } )
+		if profile_path is not None:
+			_profile_files.append( {
+				'path': os.path.normpath(self.path) ,
+				'generator': _profiled_generator ,
+				'build_seconds': self.build_seconds ,
+				'write_seconds': self.write_seconds ,
+				'bytes': self.byte_count ,
+				'lines': self.line_count ,
+				'skipped': skipped 
+				} )
+
+	# flush the remaining lines, and replace the existing file if the text differs
+	def close(self):
+		self.build_seconds = time.perf_counter() - self.start_time - self.write_seconds
+		self._flush_chunk()
+		close_time = time.perf_counter()
+		text_hash = self.digest.hexdigest()
+
+		# if all text matched, and the existing file has no more data, the file is identical
+		if self.temp_file is None and self.existing_file is not None:
+			if self.existing_file.read(1) == '':
+				self.existing_file.close()
+				print( '\tSkipping: ' + self.path + ', (it is identical)...')
+				self.write_seconds += time.perf_counter() - close_time
+				_open_emitters.remove( self )
+				self._finish( text_hash , True )
+				return
+		if self.temp_file is None:
+			self._open_temp_file()
+		self.temp_file.close()
 
 		# if a difference was found, remove the old file
-		os.chmod(path, S_IWUSR)
-		os.remove( path ) 
+		if self.existing_file is not None:
+			self.existing_file.close()
+			os.chmod(self.path, S_IWUSR)
+			os.remove( self.path ) 
+
+		# move the new file in place
+		print( '\tWriting: ' + self.path + '...')
+		os.replace( self.temp_path , self.path )
 
-	# we should write to the new file
-	print( '\tWriting: ' + path + '...')
-	with open(path,'w') as f:
-		f.write(new_text)
-		f.close()
+		# change mode of file to readonly
+		os.chmod(self.path, S_IRUSR|S_IRGRP|S_IROTH)
+		self.write_seconds += time.perf_counter() - close_time
+		_open_emitters.remove( self )
+		self._finish( text_hash , False )
 
-	# change mode of file to readonly
-	os.chmod(path, S_IRUSR|S_IRGRP|S_IROTH)
\ No newline at end of file
+def write_lines_to_file( path , lines ):
+	with FileEmitter( path ) as emitter:
+		emitter.extend( lines )
@@ -11,9 +11,17 @@ pds_built_in_item_types = {
 	'DirectedGraph',
 	'IndexedVector',
 	'ItemTable',
+	'LazyItem',
 	'Varying'
 }
 
+# build a name-keyed lookup of a list of named definitions. if a name is defined more than once, the first definition is used
+def _index_by_name( values ) -> dict:
+	index = {}
+	for value in values:
+		index.setdefault( value.Name , value )
+	return index
+
 class Dependency:
 	"""definition of a dependency item/entity in the package or a built-in type from pds"""	
 	def __init__(self, name, include_in_header = False ):
@@ -152,6 +160,7 @@ class Item:
 		self.IsDeleted = False
 		self.IsDeprecated = False
 		self.IsModifiedFromPreviousVersion = False
+		self.PreviousVersion = None
 
 class NewItem(Item):
 	"""definition of a new item, which does not exist in the previous version"""
@@ -162,14 +171,19 @@ class NewItem(Item):
 		self.Variables = variables
 		self.Validations = validations
 
+		# name lookups of the definitions
+		self.DependenciesByName = _index_by_name( self.Dependencies )
+		self.TemplatesByName = _index_by_name( self.Templates )
+		self.VariablesByName = _index_by_name( self.Variables )
+
 	def FindDependency( self, name ):
-		return next(val for val in self.Dependencies if val.Name == name )
+		return self.DependenciesByName[name]
 
 	def FindTemplate( self, name ):
-		return next(val for val in self.Templates if val.Name == name )
+		return self.TemplatesByName[name]
 
 	def FindVariable( self, name ):
-		return next(val for val in self.Variables if val.Name == name )
+		return self.VariablesByName[name]
 
 class NewEntity(NewItem):
 	"""entity which has no entity in an earlier version which it is derived from"""
@@ -224,11 +238,15 @@ class Version:
 		self.Name = name
 		self.Items = items
 		self.PreviousVersion = previousVersion
+		self.ItemsByName = _index_by_name( self.Items )
 
 		# set the version reference in each item
 		for item in self.Items:
 			item.Version = self
 
+	def FindItem( self, name ):
+		return self.ItemsByName.get( name )
+
 class Package:
 	"""The package of a project using pds"""
 
@@ -238,6 +256,7 @@ class Package:
 		self.Name = name
 		self.Versions = versions
 		self.Path = path
+		self.VersionsByName = _index_by_name( self.Versions )
 		self.SetupReferences()
 		self.SetupPreviousVersionsOfItems()
 		self.MakeSureAllItemsAreDefined()
@@ -250,6 +269,9 @@ class Package:
 			for item in version.Items:
 				item.Package = self
 
+	def FindVersion( self, name ):
+		return self.VersionsByName.get( name )
+
 	# for each version of the package, if it has a previous version
 	# make sure all items in the previous version exists in this
 	# version, unless it was deleted in the previous version
@@ -259,26 +281,38 @@ class Package:
 			if prevVersion != None:
 				for prevItem in prevVersion.Items:
 					if not prevItem.IsDeleted:
-						itmFnd = next( (itm for itm in version.Items if itm.Name == prevItem.Name ) , None )
+						itmFnd = version.FindItem( prevItem.Name )
 						if itmFnd == None:
 							raise Exception(f"Invalid setup in package {self.Name}, the item {prevItem.Name} in version {prevVersion.Name} is not defined in subsequent version {version.Name}")
 						if itmFnd.IsEntity != prevItem.IsEntity:
 							raise Exception(f"Invalid setup in package {self.Name}, the item {prevItem.Name} in version {prevVersion.Name} is not of the same Item/Entity type in subsequent version {version.Name}")
 
+	# find the item of the name in the version or the closest earlier version, which is not identical to its previous version.
+	# the lookups are cached per version and name, so that long chains of identical items are only walked once
+	def FindActualItem(self, version:Version, name:str, cache:dict) -> Item:
+		key = (version,name)
+		if key not in cache:
+			itmFnd = version.FindItem( name )
+			if itmFnd != None and not itmFnd.IdenticalToPreviousVersion:
+				cache[key] = itmFnd
+			elif version.PreviousVersion != None:
+				cache[key] = self.FindActualItem( version.PreviousVersion, name, cache )
+			else:
+				cache[key] = None
+		return cache[key]
+
 	# find all previous versions of items				
 	def SetupPreviousVersionsOfItems(self) -> None:
+		cache = {}
 		for version in self.Versions:
 			for item in version.Items:
 				if item.IdenticalToPreviousVersion or item.IsModifiedFromPreviousVersion:
-					version = item.Version
-					while version.PreviousVersion != None:
-						version = version.PreviousVersion
-						itmFnd = next( (itm for itm in version.Items if itm.Name == item.Name and not itm.IdenticalToPreviousVersion) , None )
+					if version.PreviousVersion != None:
+						itmFnd = self.FindActualItem( version.PreviousVersion, item.Name, cache )
 						if itmFnd != None:
 							if itmFnd.IsEntity != item.IsEntity:
-								raise Exception(f"FindActualItem: In Package: {self.Name}, Version: {item.Version.Name} Found previous a item of the name '{item.Name}', but that item has IsEntity={itmFnd.IsEntity()} which does not match this item's IsEntity={itmFnd.IsEntity()}")
+								raise Exception(f"FindActualItem: In Package: {self.Name}, Version: {item.Version.Name} Found previous a item of the name '{item.Name}', but that item has IsEntity={itmFnd.IsEntity} which does not match this item's IsEntity={item.IsEntity}")
 							item.PreviousVersion = itmFnd
-							break
 					if item.PreviousVersion == None:
 						raise Exception(f"Invalid setup, the item {item.Name} in Package: {self.Name}, Version: {item.Version.Name} is not correctly setup, no previous version of the item is found in any package") 
 
@@ -298,4 +332,38 @@ class Package:
 					for variable in item.Variables:
 						if variable.Name not in coveredVariables:
 							raise Exception(f'Variable {variable.Name} is not handled by a mapping in version {version.Name} of item {item.Name}')
-	
\ No newline at end of file
+	
+	# fingerprint of the package layout (versions and the names and kinds of their items), which is
+	# what the package-wide files (package header, source, handler and default version headers) are generated from
+	def GetLayoutFingerprint(self) -> str:
+		desc = f'{self.Name}|{self.Path}'
+		for version in self.Versions:
+			previousName = version.PreviousVersion.Name if version.PreviousVersion != None else ''
+			desc += f'|{version.Name}<{previousName}:'
+			for item in version.Items:
+				desc += f'{type(item).__name__}:{item.Name},'
+		return hlp.hash_text( desc )
+
+	# fingerprint of the definition of a single item, which is what the item header and source are generated from
+	def GetItemFingerprint(self, item:Item) -> str:
+		return hlp.hash_text( _describe_definition( item , top_level = True ) )
+
+# describe a schema object as a deterministic string, for fingerprinting. references to other
+# items, versions and packages are described by name only, as they are fingerprinted separately
+def _describe_definition( value , top_level = False ) -> str:
+	if value is None or isinstance(value,(str,int,float,bool)):
+		return repr(value)
+	if isinstance(value,(list,tuple)):
+		return '[' + ','.join( _describe_definition(v) for v in value ) + ']'
+	if isinstance(value,(set,frozenset)):
+		return '{' + ','.join( sorted( _describe_definition(v) for v in value ) ) + '}'
+	if isinstance(value,dict):
+		return '{' + ','.join( f'{_describe_definition(k)}:{_describe_definition(v)}' for k,v in sorted(value.items()) ) + '}'
+	if not top_level:
+		if isinstance(value,Item):
+			return f'<item {value.Version.Name}.{value.Name}>'
+		if isinstance(value,Version):
+			return f'<version {value.Name}>'
+		if isinstance(value,Package):
+			return f'<package {value.Name}>'
+	return type(value).__name__ + '(' + ','.join( f'{k}={_describe_definition(v)}' for k,v in sorted(vars(value).items()) ) + ')'
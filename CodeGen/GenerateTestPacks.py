@@ -12,11 +12,14 @@ v1_0 = Version( "v1_0",
 			),
 		NewEntity( "TestEntityA", 
 			dependencies = [ Dependency( "ItemTable", include_in_header = True),
+							 Dependency( "LazyItem", include_in_header = True),
 							 Dependency( "TestItemA", include_in_header = True ) ],
-			templates = [ Template("test_table", template = "ItemTable", types = ["item_ref","TestItemA"] , flags=['ZeroKeys'] ) ],
+			templates = [ Template("test_table", template = "ItemTable", types = ["item_ref","TestItemA"] , flags=['ZeroKeys'] ),
+						  Template("lazy_item", template = "LazyItem", types = ["TestItemA"] ) ],
 			variables = [ Variable( type="test_table" , name="TestVariableA", optional=True) ,
 						  Variable("string", "Name"),
-						  Variable("string", "OptionalText", optional = True ) ] 
+						  Variable("string", "OptionalText", optional = True ),
+						  Variable( type="lazy_item" , name="LazyItemA", optional=True) ] 
 			)
 		]
 	) 
@@ -55,6 +58,9 @@ TestPackA = Package( "TestPackA",
 		] 
 	)
 
-hlp.run_module('PackageGenerator', TestPackA, "Latest" )
+# run with --jobs=N to spread the item generation over N worker processes
+# the package is compiled as one source file per version, listed in TestPackA/TestPackASources.cmake
+if __name__ == '__main__':
+	hlp.run_module('PackageGenerator', TestPackA, "Latest", "Version" )
 
 
@@ -3,40 +3,35 @@
 
 import CodeGeneratorHelpers as hlp
 
-# hash table for allocation lookup, must be larger than the number of items to add
-class AllocatorHashTable:
-	def hash_function( self , data_type , container_type ):
-		return ((data_type * self.hash_data_type_mult) + (container_type * self.hash_container_type_mult)) % self.hash_table_size
-
-	def insert_into_table( self , data_type_combo_string , data_type_id , container_type_id ):
-		# use hash function to generate a good starting point
-		hash_val = self.hash_function( data_type_id , container_type_id )
-		# find first empty slot
-		while( self.hash_table[hash_val] != None ):
-			hash_val = hash_val+1
-			if( hash_val >= self.hash_table_size ):
-				hash_val = 0
-		# fill it
-		self.hash_table[hash_val] = data_type_combo_string
-
+# directly indexed table for allocation lookup. the data type ids are dense by construction, and are used directly as
+# the row of the table. the few container type ids are mapped to a column through a small lookup array.
+class AllocatorTable:
 	def __init__(self):
-		self.hash_table_size = 577 
-		self.hash_data_type_mult = 109
-		self.hash_container_type_mult = 991
-		self.hash_table = [None] * self.hash_table_size
+		# map container type ids to columns, invalid ids map to the invalid column
+		self.column_count = len(hlp.container_types)
+		self.invalid_column = 0xff
+		self.container_column_count = max( cont.container_id for cont in hlp.container_types ) + 1
+		self.container_columns = [self.invalid_column] * self.container_column_count
+		for column,cont in enumerate(hlp.container_types):
+			self.container_columns[cont.container_id] = column
 
-		# fill up hash table 
+		self.row_count = (len(hlp.base_types)+1) << 4
+		self.table = [[None] * self.column_count for _ in range(self.row_count)]
+
+		# fill up table, and make sure no two types share a slot
 		for basetype_inx in range(len(hlp.base_types)):
 			basetype = hlp.base_types[basetype_inx]
 			for variant_inx in range(len(basetype.variants)):
 				variant_name = basetype.variants[variant_inx].implementing_type
 				variant_id = ( (basetype_inx+1) << 4) + (variant_inx + 1)
 				for cont in hlp.container_types:
-					self.insert_into_table( f'&_dt_{variant_name}_ct_{cont.implementing_type}_DynamicTypeObject' , variant_id , cont.container_id )
-
+					column = self.container_columns[cont.container_id]
+					if self.table[variant_id][column] != None:
+						raise Exception(f'AllocatorTable: {variant_name} in {cont.implementing_type} collides with {self.table[variant_id][column]}')
+					self.table[variant_id][column] = f'&_dt_{variant_name}_ct_{cont.implementing_type}_DynamicTypeObject'
 
 def DynamicTypes_inl():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/DynamicTypes.inl")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#include <pds/pds.h>')
@@ -95,32 +90,33 @@ def DynamicTypes_inl():
 		return lines
 	lines.extend( hlp.function_for_all_basetype_combos( generate_dynamic_object_function ))
 
-	# allocate and print hash table
-	hash_table = AllocatorHashTable()
+	# allocate and print the table
+	table = AllocatorTable()
 
 	# print it 
-	lines.append('    // Hash table with the type allocator objects')
-	lines.append(f'    static const _dynamicTypeClass *_dynamicTypeClassHashTable[{hash_table.hash_table_size}] = ')
+	lines.append('    // Column of each container type in the type allocator table, 0xff for invalid container types')
+	lines.append(f'    static const u8 _containerTypeColumn[{table.container_column_count}] = ')
 	lines.append('        {')
-	for idx in range(hash_table.hash_table_size):
-		if hash_table.hash_table[idx] == None:
-			lines.append('        nullptr,')
-		else:
-			lines.append(f'        {hash_table.hash_table[idx]},')
+	lines.append('        ' + ''.join( f'0x{column:02x},' for column in table.container_columns ) )
+	lines.append('        };')
+	lines.append('')
+	lines.append('    // Table with the type allocator objects, indexed directly by data type and container type column')
+	lines.append(f'    static const _dynamicTypeClass *_dynamicTypeClassTable[{table.row_count}][{table.column_count}] = ')
+	lines.append('        {')
+	for row in table.table:
+		lines.append('        { ' + ' '.join( ('nullptr,' if slot == None else f'{slot},') for slot in row ) + ' },')
 	lines.append('        };')
 	lines.append('')
-	lines.append('    // hash table lookup of typeCombo')
+	lines.append('    // direct lookup of typeCombo')
 	lines.append('    static const _dynamicTypeClass *_findTypeClass( type_combo typeCombo )')
 	lines.append('        {')
-	lines.append(f'        size_t hashValue = ((((size_t)typeCombo.data_type) * {hash_table.hash_data_type_mult}) + (((size_t)typeCombo.container_type) * {hash_table.hash_container_type_mult})) % {hash_table.hash_table_size};')
-	lines.append('        while( _dynamicTypeClassHashTable[hashValue] != nullptr )')
+	lines.append('        const size_t dataType = (size_t)typeCombo.data_type;')
+	lines.append('        const size_t containerType = (size_t)typeCombo.container_type;')
+	lines.append(f'        if( dataType < {table.row_count} && containerType < {table.container_column_count} )')
 	lines.append('            {')
-	lines.append('            type_combo type = _dynamicTypeClassHashTable[hashValue]->Type();')
-	lines.append(f'            if( type == typeCombo )')
-	lines.append('                return _dynamicTypeClassHashTable[hashValue];')
-	lines.append('            ++hashValue;')
-	lines.append(f'            if(hashValue >= {hash_table.hash_table_size})')
-	lines.append('                hashValue = 0;')
+	lines.append('            const u8 column = _containerTypeColumn[containerType];')
+	lines.append(f'            if( column != 0x{table.invalid_column:02x} && _dynamicTypeClassTable[dataType][column] != nullptr )')
+	lines.append('                return _dynamicTypeClassTable[dataType][column];')
 	lines.append('            }')
 	lines.append('        ctLogError << "Invalid typeCombo parameter { " << (int)typeCombo.data_type << " , " << (int)typeCombo.container_type << " } " << ctLogEnd;')
 	lines.append('        return nullptr;')
@@ -224,12 +220,12 @@ def DynamicTypes_inl():
 	lines.append('#include "_pds_undef_macros.inl"')
 	lines.append('}')
 	lines.append('// namespace pds')
-	hlp.write_lines_to_file("../Include/pds/DynamicTypes.inl",lines)
+	lines.close()
 	
 
 
 def DynamicTypesTests_cpp():
-	lines = []
+	lines = hlp.FileEmitter("../Tests/DynamicTypesTests.cpp")
 	lines.extend( hlp.generate_header() )
 	lines.append('#include "Tests.h"')
 	lines.append('#include <pds/DynamicTypes.h>')
@@ -300,7 +296,7 @@ def DynamicTypesTests_cpp():
 	lines.append('        }')
 	lines.append('    }')
 
-	hlp.write_lines_to_file("../Tests/DynamicTypesTests.cpp",lines)	
+	lines.close()
 	
 def run():
 	DynamicTypes_inl()
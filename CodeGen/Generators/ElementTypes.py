@@ -26,7 +26,7 @@ def print_type_information_header( type , value , value_count ):
 	return lines
 
 def ElementTypes_h():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/ElementTypes.h")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('// ElementTypes.h - All basic types which are used by pds')
@@ -235,7 +235,7 @@ def ElementTypes_h():
 	lines.append('    };')
 
 	# end of file
-	hlp.write_lines_to_file("../Include/pds/ElementTypes.h",lines)
+	lines.close()
 
 def print_type_information_source( type , value , value_count ):
 	lines = []
@@ -288,7 +288,7 @@ def print_matrix_type_information_source( type , subtype , value , value_count )
 	return lines
 
 def ElementTypes_inl():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/ElementTypes.inl")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	#lines.append('#include <glm/glm.hpp>')
@@ -338,10 +338,10 @@ def ElementTypes_inl():
 		lines.extend(print_type_information_source(type,type,1))
 	lines.append('};')
 
-	hlp.write_lines_to_file("../Include/pds/ElementTypes.inl",lines)
+	lines.close()
 
 def ElementValuePointers_h():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/ElementValuePointers.h")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#pragma once')
@@ -421,7 +421,7 @@ def ElementValuePointers_h():
 	# reenable warning
 	#lines.extend( hlp.generate_pop_warnings() )
 	
-	hlp.write_lines_to_file("../Include/pds/ElementValuePointers.h",lines)
+	lines.close()
 
 # used by CreatePackageHeader to list all needed defines in pds
 def ListPackageHeaderDefines():
@@ -506,6 +506,7 @@ def ListPackageHeaderDefines():
 	lines.append('\t// data classes')
 	lines.append('\tusing pds::IndexedVector;')
 	lines.append('\tusing pds::ItemTable;')
+	lines.append('\tusing pds::LazyItem;')
 	lines.append('\tusing pds::Varying;')
 	lines.append('\tusing pds::DirectedGraph;')
 	lines.append('\tusing pds::BidirectionalMap;')
@@ -2,9 +2,10 @@
 # Licensed under the MIT license https://github.com/Cooolrik/pds/blob/main/LICENSE
 
 import CodeGeneratorHelpers as hlp
+from .EntityWriter import value_types_of_variant
 
 def EntityReader_h():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/EntityReader.h")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#pragma once')
@@ -20,20 +21,34 @@ def EntityReader_h():
 	lines.append('        private:')
 	lines.append('            MemoryReadStream &sstream;')
 	lines.append('            const u64 end_position;')
+	lines.append('            const u16 format_flags;')
 	lines.append('')
 	lines.append('            std::unique_ptr<EntityReader> active_subsection;')
 	lines.append('            size_t active_subsection_array_size = 0;')
 	lines.append('            size_t active_subsection_index = size_t(~0);')
 	lines.append('            u64 active_subsection_end_pos = 0;')
 	lines.append('')
+	lines.append('            // the table of contents of the section (if the stream has sf_section_toc), which is loaded on the first seek')
+	lines.append('            u64 section_data_position = 0;')
+	lines.append('            u64 section_end_position = 0;')
+	lines.append('            bool table_of_contents_is_loaded = false;')
+	lines.append('            std::vector<std::pair<std::string,u64>> table_of_contents;')
+	lines.append('            void BeginSectionData( const u64 _section_data_position, const u64 _section_end_position );')
+	lines.append('            bool LoadTableOfContents();')
+	lines.append('')
 	lines.append('        public:')
 	lines.append('            EntityReader( MemoryReadStream &_sstream );')
 	lines.append('            EntityReader( MemoryReadStream &_sstream , const u64 _end_position );')
+	lines.append('            EntityReader( MemoryReadStream &_sstream , const u64 _end_position , const u16 _format_flags );')
+	lines.append('')
+	lines.append('            // The stream_format_flags of the stream, which must be the flags the stream was written with')
+	lines.append('            u16 GetFormatFlags() const { return this->format_flags; }')
 	lines.append('')
 	lines.append('            // Read a section. ')
 	lines.append('            // If the section is null, the section is directly closed, nullptr+success is returned ')
 	lines.append('            // from BeginReadSection, and EndReadSection shall not be called.')
 	lines.append('            std::tuple<EntityReader *, bool> BeginReadSection( const char *key, const u8 key_length, const bool null_object_is_allowed );')
+	lines.append('            std::tuple<EntityReader *, bool> BeginReadSection( const char *key, const u8 key_length, const u8 field_id, const bool null_object_is_allowed );')
 	lines.append('            bool EndReadSection( const EntityReader *section_reader );')
 	lines.append('')
 	lines.append('            // Build a sections array. ')
@@ -44,45 +59,55 @@ def EntityReader_h():
 	lines.append('            bool EndReadSectionInArray( const EntityReader *sections_array_reader , const size_t section_index );')
 	lines.append('            bool EndReadSectionsArray( const EntityReader *sections_array_reader );')
 	lines.append('')
+	lines.append('            // Seek to a value or subsection of the section, using the table of contents of the section, which requires the ')
+	lines.append('            // stream to be written with sf_section_toc. The value is then read with the next Read or BeginReadSection call, ')
+	lines.append('            // and reading continues sequentially after it. Returns false if the key is not in the section.')
+	lines.append('            bool SeekToValue( const char *key, const u8 key_length );')
+	lines.append('            bool SeekToValue( const char *key, const u8 key_length, const u8 field_id );')
+	lines.append('')
+	lines.append('            // Skip over the next value or subsection, of any value type, using the size of its block. The value is not decoded, only its key is checked.')
+	lines.append('            bool SkipValue( const char *key, const u8 key_length );')
+	lines.append('            bool SkipValue( const char *key, const u8 key_length, const u8 field_id );')
+	lines.append('')
+	lines.append('            // Copy the remaining raw data of the section (from the current position to the end of the section) without decoding it, ')
+	lines.append('            // and move to the end of the section. The data can be read later with a reader using the same format flags and byte order.')
+	lines.append('            bool ReadRawData( std::vector<u8> &dest );')
+	lines.append('')
+	lines.append('            // FlipByteOrder is set if the stream flips byte order of multibyte values')
+	lines.append('            bool GetFlipByteOrder() const;')
+	lines.append('')
 	lines.append('            // The Read function template, specifically implemented below for all supported value types.')
 	lines.append('            template <class T> bool Read( const char *key, const u8 key_length, T &value );')
 	lines.append('')
-
-	## print the base types
-	#for basetype in hlp.base_types:
-	#	type_name = 'VT_' + basetype.name
-	#	lines.append('            // ' + type_name )
-	#	for type_impl in basetype.variants:
-	#		type_impl_name = type_impl.implementing_type
-	#		lines.append('            //template <> bool Read<' + type_impl_name + '>( const char *key, const u8 key_length, ' + type_impl_name + ' &value );')
-	#		lines.append('            //template <> bool Read<optional_value<' + type_impl_name + '>>( const char *key, const u8 key_length, optional_value<' + type_impl_name + '> &value );')
-	#	lines.append('')
-#
-	## print the array types
-	#for basetype in hlp.base_types:
-	#	type_name = 'VT_Array_' + basetype.name
-	#	lines.append('            // ' + type_name )
-	#	for type_impl in basetype.variants:
-	#		type_impl_name = type_impl.implementing_type
-	#		lines.append('            //template <> bool Read<std::vector<' + type_impl_name + '>>( const char *key, const u8 key_length, std::vector<' + type_impl_name + '> &value );')
-	#		lines.append('            //template <> bool Read<optional_vector<' + type_impl_name + '>>( const char *key, const u8 key_length, optional_vector<' + type_impl_name + '> &value );')
-	#		lines.append('            //template <> bool Read<idx_vector<' + type_impl_name + '>>( const char *key, const u8 key_length, idx_vector<' + type_impl_name + '> &value );')
-	#		lines.append('            //template <> bool Read<optional_idx_vector<' + type_impl_name + '>>( const char *key, const u8 key_length, optional_idx_vector<' + type_impl_name + '> &value );')
-	#	lines.append('')
+	lines.append('            // Read a field of a generated item, keyed by the field id if the stream has compact keys, else by the name of the field.')
+	lines.append('            template <class T> bool Read( const char *key, const u8 key_length, const u8 field_id, T &value );')
+	lines.append('')
 
 	lines.append('	};')
 	lines.append('')
-	#lines.append('	// Read method. Specialized for all supported value types.')
-	#lines.append('	template <class T> bool EntityReader::Read( const char *key, const u8 key_length, T &value )')
-	#lines.append('		{')
-	#lines.append('		static_assert(false, "Error: EntityReader::Read template: The value type T cannot be serialized.");')
-	#lines.append('		}')
+	lines.append('	// The Read function is specialized for all supported value types, and implemented once in EntityReader.inl')
+	for basetype in hlp.base_types:
+		lines.append(f'	// VT_{basetype.name}, VT_Array_{basetype.name}')
+		for type_impl in basetype.variants:
+			for value_type in value_types_of_variant( type_impl ):
+				lines.append(f'	template <> bool EntityReader::Read<{value_type}>( const char *key, const u8 key_length, {value_type} &value );')
+		lines.append('')
+	lines.append('	// The field Read function selects the key of the field, and calls the specialized Read function')
+	lines.append('	template <class T> inline bool EntityReader::Read( const char *key, const u8 key_length, const u8 field_id, T &value )')
+	lines.append('	{')
+	lines.append('		if( this->format_flags & sf_compact_keys )')
+	lines.append('		{')
+	lines.append('			const char field_key[2] = { (char)field_id, 0 }; // zero terminated, as keys are logged as strings')
+	lines.append('			return this->Read<T>( field_key, 1, value );')
+	lines.append('		}')
+	lines.append('		return this->Read<T>( key, key_length, value );')
+	lines.append('	}')
 	lines.append('}')
 	lines.append('// namespace pds')
-	hlp.write_lines_to_file("../Include/pds/EntityReader.h",lines)
+	lines.close()
 
 def EntityReader_inl():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/EntityReader.inl")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#include "EntityReader.h"')
@@ -106,7 +131,7 @@ def EntityReader_inl():
 			if type_impl.overrides_type:
 
 				lines.append(f'	// {implementing_type}: using {item_type} to read')
-				lines.append(f'	template <> inline bool EntityReader::Read<{implementing_type}>( const char *key, const u8 key_length, {implementing_type} &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<{implementing_type}>( const char *key, const u8 key_length, {implementing_type} &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		{item_type} tmp_variable;')
 				lines.append(f'		if( !this->Read<{item_type}>( key, key_length , tmp_variable ) )')
@@ -119,7 +144,7 @@ def EntityReader_inl():
 				lines.append(f'')
 
 				lines.append(f'	// {implementing_type}: using optional_value<{item_type}> to read' )
-				lines.append(f'	template <> inline bool EntityReader::Read<optional_value<{implementing_type}>>( const char *key, const u8 key_length, optional_value<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<optional_value<{implementing_type}>>( const char *key, const u8 key_length, optional_value<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		optional_value<{item_type}> tmp_variable;')
 				lines.append(f'		if( !this->Read<optional_value<{item_type}>>( key, key_length , tmp_variable ) )')
@@ -135,7 +160,7 @@ def EntityReader_inl():
 				lines.append(f'')
 				
 				lines.append(f'	// {implementing_type}: using std::vector<{item_type}> to read' )
-				lines.append(f'	template <> inline bool EntityReader::Read<std::vector<{implementing_type}>>( const char *key, const u8 key_length, std::vector<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<std::vector<{implementing_type}>>( const char *key, const u8 key_length, std::vector<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		std::vector<{item_type}> tmp_variable;')
 				lines.append(f'		if( !this->Read<std::vector<{item_type}>>( key, key_length , tmp_variable ) )')
@@ -151,7 +176,7 @@ def EntityReader_inl():
 				lines.append(f'')
 				
 				lines.append(f'	//  {implementing_type}: optional_vector<{item_type}> to read' )
-				lines.append(f'	template <> inline bool EntityReader::Read<optional_vector<{implementing_type}>>( const char *key, const u8 key_length, optional_vector<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<optional_vector<{implementing_type}>>( const char *key, const u8 key_length, optional_vector<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		optional_vector<{item_type}> tmp_variable;')
 				lines.append(f'		if( !this->Read<optional_vector<{item_type}>>( key, key_length , tmp_variable ) )')
@@ -176,7 +201,7 @@ def EntityReader_inl():
 				lines.append(f'')
 				
 				lines.append(f'	// {implementing_type}: using idx_vector<{item_type}> to read' )
-				lines.append(f'	template <> inline bool EntityReader::Read<idx_vector<{implementing_type}>>( const char *key, const u8 key_length, idx_vector<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<idx_vector<{implementing_type}>>( const char *key, const u8 key_length, idx_vector<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		idx_vector<{item_type}> tmp_variable;')
 				lines.append(f'		if( !this->Read<idx_vector<{item_type}>>( key, key_length , tmp_variable ) )')
@@ -195,7 +220,7 @@ def EntityReader_inl():
 				lines.append(f'')
 				
 				lines.append(f'	//  {implementing_type}: optional_idx_vector<{item_type}> to read' )
-				lines.append(f'	template <> inline bool EntityReader::Read<optional_idx_vector<{implementing_type}>>( const char *key, const u8 key_length, optional_idx_vector<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<optional_idx_vector<{implementing_type}>>( const char *key, const u8 key_length, optional_idx_vector<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		optional_idx_vector<{item_type}> tmp_variable;')
 				lines.append(f'		if( !this->Read<optional_idx_vector<{item_type}>>( key, key_length , tmp_variable ) )')
@@ -224,18 +249,18 @@ def EntityReader_inl():
 
 			else:
 				lines.append(f'	// {type_name}: {implementing_type}')
-				lines.append(f'	template <> inline bool EntityReader::Read<{implementing_type}>( const char *key, const u8 key_length, {implementing_type} &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<{implementing_type}>( const char *key, const u8 key_length, {implementing_type} &dest_variable )')
 				lines.append(f'	{{')
-				lines.append(f'		reader_status status = read_single_item<ValueType::{type_name},{implementing_type}>(this->sstream, key, key_length, false, &(dest_variable) );')
+				lines.append(f'		reader_status status = read_single_item<ValueType::{type_name},{implementing_type}>(this->sstream, this->format_flags, key, key_length, false, &(dest_variable) );')
 				lines.append(f'		return status != reader_status::fail;')
 				lines.append(f'	}}')
 				lines.append(f'')
 
 				lines.append(f'	// {type_name}: optional_value<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityReader::Read<optional_value<{implementing_type}>>( const char *key, const u8 key_length, optional_value<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<optional_value<{implementing_type}>>( const char *key, const u8 key_length, optional_value<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		dest_variable.set();')
-				lines.append(f'		reader_status status = read_single_item<ValueType::{type_name},{implementing_type}>(this->sstream, key, key_length, true, &(dest_variable.value()) );')
+				lines.append(f'		reader_status status = read_single_item<ValueType::{type_name},{implementing_type}>(this->sstream, this->format_flags, key, key_length, true, &(dest_variable.value()) );')
 				lines.append(f'		if( status == reader_status::success_empty )')
 				lines.append(f'			dest_variable.reset();')
 				lines.append(f'		return status != reader_status::fail;')
@@ -243,18 +268,18 @@ def EntityReader_inl():
 				lines.append(f'')
 
 				lines.append(f'	// {type_name}: std::vector<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityReader::Read<std::vector<{implementing_type}>>( const char *key, const u8 key_length, std::vector<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<std::vector<{implementing_type}>>( const char *key, const u8 key_length, std::vector<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
-				lines.append(f'		reader_status status = read_array<ValueType::{array_type_name},{implementing_type}>(this->sstream, key, key_length, false, &(dest_variable), nullptr );')
+				lines.append(f'		reader_status status = read_array<ValueType::{array_type_name},{implementing_type}>(this->sstream, this->format_flags, key, key_length, false, &(dest_variable), nullptr );')
 				lines.append(f'		return status != reader_status::fail;')
 				lines.append(f'	}}')
 				lines.append(f'')
 
 				lines.append(f'	// {type_name}: optional_vector<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityReader::Read<optional_vector<{implementing_type}>>( const char *key, const u8 key_length, optional_vector<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<optional_vector<{implementing_type}>>( const char *key, const u8 key_length, optional_vector<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		dest_variable.set();')
-				lines.append(f'		reader_status status = read_array<ValueType::{array_type_name},{implementing_type}>(this->sstream, key, key_length, true, &(dest_variable.values()), nullptr );')
+				lines.append(f'		reader_status status = read_array<ValueType::{array_type_name},{implementing_type}>(this->sstream, this->format_flags, key, key_length, true, &(dest_variable.values()), nullptr );')
 				lines.append(f'		if( status == reader_status::success_empty )')
 				lines.append(f'			dest_variable.reset();')
 				lines.append(f'		return status != reader_status::fail;')
@@ -262,18 +287,18 @@ def EntityReader_inl():
 				lines.append(f'')
 
 				lines.append(f'	// {type_name}: idx_vector<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityReader::Read<idx_vector<{implementing_type}>>( const char *key, const u8 key_length, idx_vector<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<idx_vector<{implementing_type}>>( const char *key, const u8 key_length, idx_vector<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
-				lines.append(f'		reader_status status = read_array<ValueType::{array_type_name},{implementing_type}>(this->sstream, key, key_length, false, &(dest_variable.values()), &(dest_variable.index()) );')
+				lines.append(f'		reader_status status = read_array<ValueType::{array_type_name},{implementing_type}>(this->sstream, this->format_flags, key, key_length, false, &(dest_variable.values()), &(dest_variable.index()) );')
 				lines.append(f'		return status != reader_status::fail;')
 				lines.append(f'	}}')
 				lines.append(f'')
 
 				lines.append(f'	// {type_name}: optional_idx_vector<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityReader::Read<optional_idx_vector<{implementing_type}>>( const char *key, const u8 key_length, optional_idx_vector<{implementing_type}> &dest_variable )')
+				lines.append(f'	template <> bool EntityReader::Read<optional_idx_vector<{implementing_type}>>( const char *key, const u8 key_length, optional_idx_vector<{implementing_type}> &dest_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		dest_variable.set();')
-				lines.append(f'		reader_status status = read_array<ValueType::{array_type_name},{implementing_type}>(this->sstream, key, key_length, true, &(dest_variable.values()), &(dest_variable.index()) );')
+				lines.append(f'		reader_status status = read_array<ValueType::{array_type_name},{implementing_type}>(this->sstream, this->format_flags, key, key_length, true, &(dest_variable.values()), &(dest_variable.index()) );')
 				lines.append(f'		if( status == reader_status::success_empty )')
 				lines.append(f'			dest_variable.reset();')
 				lines.append(f'		return status != reader_status::fail;')
@@ -282,7 +307,7 @@ def EntityReader_inl():
 				
 	lines.append('}')
 	lines.append('// namespace pds')
-	hlp.write_lines_to_file("../Include/pds/EntityReader.inl",lines)
+	lines.close()
 
 def run():
 	EntityReader_h()
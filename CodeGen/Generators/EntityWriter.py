@@ -3,8 +3,20 @@
 
 import CodeGeneratorHelpers as hlp
 
+# all the value types of a base type variant, which are specialized for reading and writing
+def value_types_of_variant( type_impl ):
+	implementing_type = type_impl.implementing_type
+	return [
+		implementing_type,
+		f'optional_value<{implementing_type}>',
+		f'std::vector<{implementing_type}>',
+		f'optional_vector<{implementing_type}>',
+		f'idx_vector<{implementing_type}>',
+		f'optional_idx_vector<{implementing_type}>',
+		]
+
 def EntityWriter_h():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/EntityWriter.h")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#pragma once')
@@ -20,6 +32,7 @@ def EntityWriter_h():
 	lines.append('        private:')
 	lines.append('            MemoryWriteStream &dstream;')
 	lines.append('            const u64 start_position;')
+	lines.append('            const u16 format_flags;')
 	lines.append('')
 	lines.append('            std::unique_ptr<EntityWriter> active_subsection;')
 	lines.append('')
@@ -27,11 +40,22 @@ def EntityWriter_h():
 	lines.append('            size_t active_array_index = size_t(~0);')
 	lines.append('            u64 active_array_index_start_position = 0;')
 	lines.append('')
+	lines.append('            // the table of contents of the section (if the stream has sf_section_toc), with the offset of each value from the section_data_position')
+	lines.append('            u64 section_data_position = 0;')
+	lines.append('            std::vector<std::pair<std::string,u64>> table_of_contents;')
+	lines.append('            void AddTableOfContentsEntry( const char *key, const u8 key_length );')
+	lines.append('            void WriteTableOfContents();')
+	lines.append('')
 	lines.append('        public:')
 	lines.append('            EntityWriter( MemoryWriteStream &_dstream );')
+	lines.append('            EntityWriter( MemoryWriteStream &_dstream , const u16 _format_flags );')
+	lines.append('')
+	lines.append('            // The stream_format_flags of the stream')
+	lines.append('            u16 GetFormatFlags() const { return this->format_flags; }')
 	lines.append('')
 	lines.append('            // Build a section. ')
 	lines.append('            EntityWriter *BeginWriteSection( const char *key, const u8 key_length );')
+	lines.append('            EntityWriter *BeginWriteSection( const char *key, const u8 key_length, const u8 field_id );')
 	lines.append('            bool EndWriteSection( const EntityWriter *section_writer );')
 	lines.append('            bool WriteNullSection( const char *key, const u8 key_length );')
 	lines.append('')
@@ -45,42 +69,35 @@ def EntityWriter_h():
 	lines.append('            // The Write function template, specifically implemented below for all supported value types.')
 	lines.append('            template <class T> bool Write( const char *key, const u8 key_length, const T &value );')
 	lines.append('')
+	lines.append('            // Write a field of a generated item, keyed by the field id if the stream has compact keys, else by the name of the field.')
+	lines.append('            template <class T> bool Write( const char *key, const u8 key_length, const u8 field_id, const T &value );')
+	lines.append('')
 	
-	# print the base types
-	#for basetype in hlp.base_types:
-	#	type_name = 'VT_' + basetype.name
-	#	lines.append('            // ' + type_name )
-	#	for type_impl in basetype.variants:
-	#		type_impl_name = type_impl.implementing_type
-	#		lines.append('            //template <> bool Write<' + type_impl_name + '>( const char *key, const u8 key_length, const ' + type_impl_name + ' &value );')
-	#		lines.append('            //template <> bool Write<optional_value<' + type_impl_name + '>>( const char *key, const u8 key_length, const optional_value<' + type_impl_name + '> &value );')
-	#	lines.append('')
-	#
-	## print the array types
-	#for basetype in hlp.base_types:
-	#	type_name = 'VT_Array_' + basetype.name
-	#	lines.append('            // ' + type_name )
-	#	for type_impl in basetype.variants:
-	#		type_impl_name = type_impl.implementing_type
-	#		lines.append('            //template <> bool Write<std::vector<' + type_impl_name + '>>( const char *key, const u8 key_length, const std::vector<' + type_impl_name + '> &value );')
-	#		lines.append('            //template <> bool Write<optional_vector<' + type_impl_name + '>>( const char *key, const u8 key_length, const optional_vector<' + type_impl_name + '> &value );')
-	#		lines.append('            //template <> bool Write<idx_vector<' + type_impl_name + '>>( const char *key, const u8 key_length, const idx_vector<' + type_impl_name + '> &value );')
-	#		lines.append('            //template <> bool Write<optional_idx_vector<' + type_impl_name + '>>( const char *key, const u8 key_length, const optional_idx_vector<' + type_impl_name + '> &value );')
-	#	lines.append('')
-
 	lines.append('	};')
 	lines.append('')
-	#lines.append('	// Write function. Specialized for all supported value types.')
-	#lines.append('	template <class T> bool EntityWriter::Write( const char *key, const u8 key_length, const T &value )')
-	#lines.append('	{')
-	#lines.append('		static_assert(false, "Error: EntityWriter::Write template: The value type T cannot be serialized.");')
-	#lines.append('	}')
+	lines.append('	// The Write function is specialized for all supported value types, and implemented once in EntityWriter.inl')
+	for basetype in hlp.base_types:
+		lines.append(f'	// VT_{basetype.name}, VT_Array_{basetype.name}')
+		for type_impl in basetype.variants:
+			for value_type in value_types_of_variant( type_impl ):
+				lines.append(f'	template <> bool EntityWriter::Write<{value_type}>( const char *key, const u8 key_length, const {value_type} &value );')
+		lines.append('')
+	lines.append('	// The field Write function selects the key of the field, and calls the specialized Write function')
+	lines.append('	template <class T> inline bool EntityWriter::Write( const char *key, const u8 key_length, const u8 field_id, const T &value )')
+	lines.append('	{')
+	lines.append('		if( this->format_flags & sf_compact_keys )')
+	lines.append('		{')
+	lines.append('			const char field_key[2] = { (char)field_id, 0 }; // zero terminated, as keys are logged as strings')
+	lines.append('			return this->Write<T>( field_key, 1, value );')
+	lines.append('		}')
+	lines.append('		return this->Write<T>( key, key_length, value );')
+	lines.append('	}')
 	lines.append('}')
 	lines.append('// namespace pds')
-	hlp.write_lines_to_file("../Include/pds/EntityWriter.h",lines)
+	lines.close()
 
 def EntityWriter_inl():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/EntityWriter.inl")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#include "EntityWriter.h"')
@@ -102,7 +119,7 @@ def EntityWriter_inl():
 
 			if type_impl.overrides_type:
 				lines.append(f'	// {implementing_type}: using {item_type} to store')
-				lines.append(f'	template <> inline bool EntityWriter::Write<{implementing_type}>( const char *key, const u8 key_length, const {implementing_type} &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<{implementing_type}>( const char *key, const u8 key_length, const {implementing_type} &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		const {item_type} tmp_variable = src_variable;')
 				lines.append(f'		return this->Write<{item_type}>( key, key_length, tmp_variable );')
@@ -110,7 +127,7 @@ def EntityWriter_inl():
 				lines.append(f'')
 			
 				lines.append(f'	// {implementing_type}: using optional_value<{item_type}> to store' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<optional_value<{implementing_type}>>( const char *key, const u8 key_length, const optional_value<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<optional_value<{implementing_type}>>( const char *key, const u8 key_length, const optional_value<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		optional_value<{item_type}> tmp_variable;')
 				lines.append(f'		if( src_variable.has_value() )')
@@ -120,7 +137,7 @@ def EntityWriter_inl():
 				lines.append(f'')
 			
 				lines.append(f'	// {implementing_type}: using std::vector<{item_type}> to store' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<std::vector<{implementing_type}>>( const char *key, const u8 key_length, const std::vector<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<std::vector<{implementing_type}>>( const char *key, const u8 key_length, const std::vector<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		std::vector<{item_type}> tmp_variable;')
 				lines.append(f'		tmp_variable.reserve( src_variable.size() );')
@@ -130,7 +147,7 @@ def EntityWriter_inl():
 				lines.append(f'')
 			
 				lines.append(f'	//  {implementing_type}: optional_vector<{item_type}> to store' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<optional_vector<{implementing_type}>>( const char *key, const u8 key_length, const optional_vector<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<optional_vector<{implementing_type}>>( const char *key, const u8 key_length, const optional_vector<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		optional_vector<{item_type}> tmp_variable;')
 				lines.append(f'		if( src_variable.has_value() )')
@@ -144,7 +161,7 @@ def EntityWriter_inl():
 				lines.append(f'')
 				
 				lines.append(f'	// {implementing_type}: using idx_vector<{item_type}> to store' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<idx_vector<{implementing_type}>>( const char *key, const u8 key_length, const idx_vector<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<idx_vector<{implementing_type}>>( const char *key, const u8 key_length, const idx_vector<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		idx_vector<{item_type}> tmp_variable;')
 				lines.append(f'		tmp_variable.index().reserve( src_variable.index().size() );')
@@ -156,7 +173,7 @@ def EntityWriter_inl():
 				lines.append(f'')
 
 				lines.append(f'	//  {implementing_type}: optional_idx_vector<{item_type}> to store' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<optional_idx_vector<{implementing_type}>>( const char *key, const u8 key_length, const optional_idx_vector<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<optional_idx_vector<{implementing_type}>>( const char *key, const u8 key_length, const optional_idx_vector<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		optional_idx_vector<{item_type}> tmp_variable;')
 				lines.append(f'		if( src_variable.has_value() )')
@@ -176,48 +193,54 @@ def EntityWriter_inl():
 				array_type_name = 'VT_Array_' + basetype.name
 				
 				lines.append(f'	// {type_name}: {implementing_type}')
-				lines.append(f'	template <> inline bool EntityWriter::Write<{implementing_type}>( const char *key, const u8 key_length, const {implementing_type} &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<{implementing_type}>( const char *key, const u8 key_length, const {implementing_type} &src_variable )')
 				lines.append(f'	{{')
-				lines.append(f'		return write_single_value<ValueType::{type_name},{implementing_type}>( this->dstream, key, key_length, &src_variable );')
+				lines.append(f'		this->AddTableOfContentsEntry( key, key_length );')
+				lines.append(f'		return write_single_value<ValueType::{type_name},{implementing_type}>( this->dstream, this->format_flags, key, key_length, &src_variable );')
 				lines.append(f'	}}')
 				lines.append(f'')
 				
 				lines.append(f'	// {type_name}: optional_value<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<optional_value<{implementing_type}>>( const char *key, const u8 key_length, const optional_value<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<optional_value<{implementing_type}>>( const char *key, const u8 key_length, const optional_value<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		const {implementing_type} *p_src_variable = (src_variable.has_value()) ? &(src_variable.value()) : nullptr;')
-				lines.append(f'		return write_single_value<ValueType::{type_name},{implementing_type}>( this->dstream, key, key_length, p_src_variable );')
+				lines.append(f'		this->AddTableOfContentsEntry( key, key_length );')
+				lines.append(f'		return write_single_value<ValueType::{type_name},{implementing_type}>( this->dstream, this->format_flags, key, key_length, p_src_variable );')
 				lines.append(f'	}}')
 				lines.append(f'')
 				
 				lines.append(f'	//  {array_type_name}: std::vector<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<std::vector<{implementing_type}>>( const char *key, const u8 key_length, const std::vector<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<std::vector<{implementing_type}>>( const char *key, const u8 key_length, const std::vector<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
-				lines.append(f'		return write_array<ValueType::{array_type_name},{implementing_type}>(this->dstream, key, key_length, &src_variable , nullptr );')
+				lines.append(f'		this->AddTableOfContentsEntry( key, key_length );')
+				lines.append(f'		return write_array<ValueType::{array_type_name},{implementing_type}>(this->dstream, this->format_flags, key, key_length, &src_variable , nullptr );')
 				lines.append(f'	}}')
 				lines.append(f'')
 				
 				lines.append(f'	//  {array_type_name}: optional_vector<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<optional_vector<{implementing_type}>>( const char *key, const u8 key_length, const optional_vector<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<optional_vector<{implementing_type}>>( const char *key, const u8 key_length, const optional_vector<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		const std::vector<{implementing_type}> *p_src_variable = (src_variable.has_value()) ? &(src_variable.values()) : nullptr;')
-				lines.append(f'		return write_array<ValueType::{array_type_name},{implementing_type}>(this->dstream, key, key_length, p_src_variable , nullptr );')
+				lines.append(f'		this->AddTableOfContentsEntry( key, key_length );')
+				lines.append(f'		return write_array<ValueType::{array_type_name},{implementing_type}>(this->dstream, this->format_flags, key, key_length, p_src_variable , nullptr );')
 				lines.append(f'	}}')
 				lines.append(f'')
 				
 				lines.append(f'	//  {array_type_name}: idx_vector<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<idx_vector<{implementing_type}>>( const char *key, const u8 key_length, const idx_vector<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<idx_vector<{implementing_type}>>( const char *key, const u8 key_length, const idx_vector<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
-				lines.append(f'		return write_array<ValueType::{array_type_name},{implementing_type}>(this->dstream, key, key_length, &(src_variable.values()) , &(src_variable.index()) );')
+				lines.append(f'		this->AddTableOfContentsEntry( key, key_length );')
+				lines.append(f'		return write_array<ValueType::{array_type_name},{implementing_type}>(this->dstream, this->format_flags, key, key_length, &(src_variable.values()) , &(src_variable.index()) );')
 				lines.append(f'	}}')
 				lines.append(f'')
 				
 				lines.append(f'	//  {array_type_name}: optional_idx_vector<{implementing_type}>' )
-				lines.append(f'	template <> inline bool EntityWriter::Write<optional_idx_vector<{implementing_type}>>( const char *key, const u8 key_length, const optional_idx_vector<{implementing_type}> &src_variable )')
+				lines.append(f'	template <> bool EntityWriter::Write<optional_idx_vector<{implementing_type}>>( const char *key, const u8 key_length, const optional_idx_vector<{implementing_type}> &src_variable )')
 				lines.append(f'	{{')
 				lines.append(f'		const std::vector<{implementing_type}> *p_src_values = (src_variable.has_value()) ? &(src_variable.values()) : nullptr;')
 				lines.append(f'		const std::vector<i32> *p_src_index = (src_variable.has_value()) ? &(src_variable.index()) : nullptr;')
-				lines.append(f'		return write_array<ValueType::{array_type_name},{implementing_type}>(this->dstream, key, key_length, p_src_values , p_src_index );')
+				lines.append(f'		this->AddTableOfContentsEntry( key, key_length );')
+				lines.append(f'		return write_array<ValueType::{array_type_name},{implementing_type}>(this->dstream, this->format_flags, key, key_length, p_src_values , p_src_index );')
 				lines.append(f'	}}')
 				lines.append(f'')
 				
@@ -229,7 +252,7 @@ def EntityWriter_inl():
 
 	lines.append('}')
 	lines.append('// namespace pds')
-	hlp.write_lines_to_file("../Include/pds/EntityWriter.inl",lines)
+	lines.close()
 
 def run():
 	EntityWriter_h()
@@ -5,14 +5,11 @@ from EntitiesHelpers import *
 import os
 import CodeGeneratorHelpers as hlp
 
-from ctypes import c_ulonglong 
-from ctypes import c_ubyte
-
 def CreateItemHeader(item: Item):
 	packageName = item.Package.Name
 	versionName = item.Version.Name
 
-	lines = []
+	lines = hlp.FileEmitter(f"{item.Package.Path}/{versionName}/{versionName}_{item.Name}.h")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#pragma once')
@@ -79,10 +76,25 @@ def CreateItemHeader(item: Item):
 		lines.append('            friend MF;')
 		lines.append('')
 		lines.append(f'            static constexpr const char *ItemTypeString = "{packageName}.{versionName}.{item.Name}";')
+		if item.IsEntity:
+			lines.append(f'            static constexpr const u64 EntityTypeId = 0x{GetEntityTypeId(item):016x};')
+		lines.append('')
+
+		# list the field ids of the variables
+		lines.append('            // the field ids of the variables, which index the field_mask of MF::ReadFields')
+		lines.append('            struct Fields')
+		lines.append('                {')
+		for field_id,var in enumerate(item.Variables):
+			lines.append(f'                static constexpr const size_t {var.Name} = {field_id};')
+		lines.append('                };')
 		lines.append('')
 		
 		if item.IsEntity:
 			lines.append(f'            virtual const char *EntityTypeString() const;')
+			lines.append(f'            virtual const pds::EntityTypeRecord *GetEntityTypeRecord() const;')
+			lines.append('')
+			lines.append(f'            // the type record of {item.Name}, which identifies the entity type')
+			lines.append(f'            static const pds::EntityTypeRecord *const TypeRecord;')
 			lines.append('')
 
 		lines.append(f'            {item.Name}() = default;')
@@ -138,6 +150,10 @@ def CreateItemHeader(item: Item):
 		lines.append(f'            static status Write( const {item.Name} &obj, pds::EntityWriter &writer );')
 		lines.append(f'            static status Read( {item.Name} &obj, pds::EntityReader &reader );')
 		lines.append('')
+		lines.append('            // read only the variables selected in the fields mask, and skip over the rest without decoding them.')
+		lines.append('            // the variables which are not selected are not modified.')
+		lines.append(f'            static status ReadFields( {item.Name} &obj, pds::EntityReader &reader, const pds::field_mask &fields );')
+		lines.append('')
 		lines.append(f'            static status Validate( const {item.Name} &obj, pds::EntityValidator &validator );')
 		lines.append('')
 		if item.IsEntity:
@@ -179,7 +195,7 @@ def CreateItemHeader(item: Item):
 		lines.append('}')		
 		lines.append(f'// namespace {packageName}')
   
-	hlp.write_lines_to_file(f"{item.Package.Path}/{versionName}/{versionName}_{item.Name}.h",lines)
+	lines.close()
 
 def ImplementClearCall(item,var):
 	lines = []
@@ -255,21 +271,21 @@ def ImplementEqualsCall(item,var):
 
 	return lines
 
-def ImplementWriterCall(item,var):
+def ImplementWriterCall(item,var,field_id):
 	lines = []
 
 	# do we have a base type or item?
 	if var.IsBaseType:
 		# we have a base type, add the write code directly
 		lines.append(f'        // write variable "{var.Name}"')
-		lines.append(f'        success = writer.Write<{var.TypeString}>( pdsKeyMacro("{var.Name}") , obj.v_{var.Name} );')
+		lines.append(f'        success = writer.Write<{var.TypeString}>( pdsFieldKeyMacro("{var.Name}",{field_id}) , obj.v_{var.Name} );')
 		lines.append(f'        if( !success )')
 		lines.append(f'            return status::cant_write;')
 		lines.append('')
 	else:
 		# not a base type, so an item. add a block
 		lines.append(f'        // write section "{var.Name}"')
-		lines.append(f'        success = (section_writer = writer.BeginWriteSection( pdsKeyMacro("{var.Name}") ));')
+		lines.append(f'        success = (section_writer = writer.BeginWriteSection( pdsFieldKeyMacro("{var.Name}",{field_id}) ));')
 		lines.append('        if( !success )')
 		lines.append('            return status::cant_write;')
 		if var.Optional:
@@ -285,7 +301,7 @@ def ImplementWriterCall(item,var):
 
 	return lines
 
-def ImplementReaderCall(item,var):
+def ImplementReaderCall(item,var,field_id):
 	lines = []
 
 	if var.Optional:
@@ -297,14 +313,14 @@ def ImplementReaderCall(item,var):
 	if var.IsBaseType:
 		# we have a base type, add the read code directly
 		lines.append(f'        // read variable "{var.Name}"')
-		lines.append(f'        success = reader.Read<{var.TypeString}>( pdsKeyMacro("{var.Name}") , obj.v_{var.Name} );')
+		lines.append(f'        success = reader.Read<{var.TypeString}>( pdsFieldKeyMacro("{var.Name}",{field_id}) , obj.v_{var.Name} );')
 		lines.append(f'        if( !success )')
 		lines.append(f'            return status::cant_read;')
 		lines.append('')
 	else:
 		# not a base type, so an item. add a block
 		lines.append(f'        // read section "{var.Name}"')
-		lines.append(f'        std::tie(section_reader,success) = reader.BeginReadSection( pdsKeyMacro("{var.Name}") , {value_can_be_null} );')
+		lines.append(f'        std::tie(section_reader,success) = reader.BeginReadSection( pdsFieldKeyMacro("{var.Name}",{field_id}) , {value_can_be_null} );')
 		lines.append('        if( !success )')
 		lines.append('            return status::cant_read;')
 		lines.append('        if( section_reader )')
@@ -324,6 +340,27 @@ def ImplementReaderCall(item,var):
 
 	return lines
 
+def ImplementFieldReaderCall(item,var,field_id):
+	lines = []
+
+	# read the variable if selected, else skip over its value or section
+	lines.append(f'        if( fields.test( {field_id} ) )')
+	lines.append('            {')
+	for line in ImplementReaderCall(item,var,field_id):
+		if line != '':
+			lines.append('    ' + line)
+	lines.append('            }')
+	lines.append('        else')
+	lines.append('            {')
+	lines.append(f'            // skip variable "{var.Name}"')
+	lines.append(f'            success = reader.SkipValue( pdsFieldKeyMacro("{var.Name}",{field_id}) );')
+	lines.append('            if( !success )')
+	lines.append('                return status::cant_read;')
+	lines.append('            }')
+	lines.append('')
+
+	return lines
+
 def ImplementVariableValidatorCall(item,var):
 	lines = []
 
@@ -358,7 +395,7 @@ def ImplementToPreviousCall(item:Item , mapping:Mapping):
 	variableName = mapping.Variables[0]
 	
 	# find variable in item
-	variable = next( (var for var in item.Variables if var.Name == variableName) , None )
+	variable = item.VariablesByName.get( variableName )
 	if variable == None:
 		return []
 
@@ -392,7 +429,7 @@ def ImplementFromPreviousCall(item:Item , mapping:Mapping):
 	variableName = mapping.Variables[0]
 	
 	# find variable in item
-	variable = next( (var for var in item.Variables if var.Name == variableName) , None )
+	variable = item.VariablesByName.get( variableName )
 	if variable == None:
 		return []
 
@@ -419,7 +456,7 @@ def CreateItemSource(item):
 	if item.IdenticalToPreviousVersion:
 		return
 
-	lines = []
+	lines = hlp.FileEmitter(f"{item.Package.Path}/{versionName}/{versionName}_{item.Name}.inl")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 
@@ -504,15 +541,17 @@ def CreateItemSource(item):
 	lines.append('        }')
 	lines.append('')
 
-	# writer code
+	# writer code. the fields are keyed by their index in the item in the compact keys format, which must fit in a byte
+	if len(item.Variables) > 256:
+		raise Exception(f'The item {item.Name} in version {item.Version.Name} has more than 256 variables, which is not supported')
 	lines.append(f'    status {item.Name}::MF::Write( const {item.Name} &obj, pds::EntityWriter &writer )')
 	lines.append('        {')
 	lines.append('        bool success = true;')
 	if vars_have_item:
 		lines.append('        pds::EntityWriter *section_writer = nullptr;')
 	lines.append('')
-	for var in item.Variables:
-		lines.extend(ImplementWriterCall(item,var))
+	for field_id,var in enumerate(item.Variables):
+		lines.extend(ImplementWriterCall(item,var,field_id))
 	lines.append('        return status::ok;')
 	lines.append('        }')
 	lines.append('')
@@ -524,8 +563,21 @@ def CreateItemSource(item):
 	if vars_have_item:
 		lines.append('        pds::EntityReader *section_reader = nullptr;')
 	lines.append('')
-	for var in item.Variables:
-		lines.extend(ImplementReaderCall(item,var))
+	for field_id,var in enumerate(item.Variables):
+		lines.extend(ImplementReaderCall(item,var,field_id))
+	lines.append('        return status::ok;')
+	lines.append('        }')
+	lines.append('')
+
+	# projection reader code, which reads the selected variables and skips the rest
+	lines.append(f'    status {item.Name}::MF::ReadFields( {item.Name} &obj, pds::EntityReader &reader, const pds::field_mask &fields )')
+	lines.append('        {')
+	lines.append('        bool success = true;')
+	if vars_have_item:
+		lines.append('        pds::EntityReader *section_reader = nullptr;')
+	lines.append('')
+	for field_id,var in enumerate(item.Variables):
+		lines.extend(ImplementFieldReaderCall(item,var,field_id))
 	lines.append('        return status::ok;')
 	lines.append('        }')
 	lines.append('')
@@ -559,7 +611,7 @@ def CreateItemSource(item):
 	if item.IsEntity:
 		lines.append(f'    const {item.Name} *{item.Name}::MF::EntitySafeCast( const pds::Entity *srcEnt )')
 		lines.append('        {')
-		lines.append(f'        if( srcEnt && std::string(srcEnt->EntityTypeString()) == {item.Name}::ItemTypeString )')
+		lines.append(f'        if( srcEnt && srcEnt->GetEntityTypeRecord() == {item.Name}::TypeRecord )')
 		lines.append('            {')
 		lines.append(f'            return (const {item.Name} *)(srcEnt);')
 		lines.append('            }')
@@ -568,7 +620,7 @@ def CreateItemSource(item):
 		lines.append('')
 		lines.append(f'    std::shared_ptr<const {item.Name}> {item.Name}::MF::EntitySafeCast( std::shared_ptr<const pds::Entity> srcEnt )')
 		lines.append('        {')
-		lines.append(f'        if( srcEnt && std::string(srcEnt->EntityTypeString()) == {item.Name}::ItemTypeString )')
+		lines.append(f'        if( srcEnt && srcEnt->GetEntityTypeRecord() == {item.Name}::TypeRecord )')
 		lines.append('            {')
 		lines.append(f'            return std::static_pointer_cast<const {item.Name}>(srcEnt);')
 		lines.append('            }')
@@ -602,65 +654,111 @@ def CreateItemSource(item):
 	lines.append(f'// namespace {packageName}')
 	lines.append('')
 	lines.append('#include <pds/_pds_undef_macros.inl>')
-	hlp.write_lines_to_file(f"{item.Package.Path}/{versionName}/{versionName}_{item.Name}.inl",lines)
+	lines.close()
 
 
-# static and constant hash table for entity lookup, (must be larger than the number of entities to add)
-# Fowler–Noll–Vo FNV-1a hash function  https://en.wikipedia.org/wiki/Fowler%E2%80%93Noll%E2%80%93Vo_hash_function
+# static and constant minimal perfect hash table for entity lookup, using "hash and displace": the
+# Fowler–Noll–Vo FNV-1a hash https://en.wikipedia.org/wiki/Fowler%E2%80%93Noll%E2%80%93Vo_hash_function
+# of the entity type string selects a bucket, and the seed of the bucket is mixed into the hash to select the slot of the 
+# entity. the seeds are searched at generation time so that no two entities share a slot, and there are no empty slots.
+# the lookup is then a single hash of the string, and a single compare of the string in the selected slot.
 class EntityHashTable:
-	
-	# select the next prime number above the item count as the table size
-	def calc_table_size( self , item_count ):
-		# start with item_count*2 (but minimum 20), then count up to the next prime
-		table_size = max( item_count*2 , 20 )
-		while True:
-			is_prime = True
-			for num in range(2, int(table_size**0.5) + 1):
-				if table_size % num == 0:
-					is_prime = False
-					break
-			if is_prime:
-				return table_size
-			table_size += 1
-
-	def hash_function( self , entity_name ):
-		hash = c_ulonglong(0xcbf29ce484222325)
-		for ch in entity_name:
-			hash = c_ulonglong(hash.value ^ c_ubyte(ord(ch)).value)
-			hash = c_ulonglong(hash.value * c_ulonglong(0x00000100000001B3).value)
-		return hash.value
-
-	def insert_into_table( self , package_name , version_name , entity_name ):
-		# use hash function to generate a good starting point
-		hash_pos = self.hash_function( package_name + "." + version_name + "." + entity_name ) % self.hash_table_size
-		# find first empty slot
-		while( self.hash_table[hash_pos] != None ):
-			hash_pos = hash_pos+1
-			if( hash_pos >= self.hash_table_size ):
-				hash_pos = 0
-		# fill it
-		self.hash_table[hash_pos] = version_name + "_" + entity_name
-
-	def __init__(self, package):
-		item_count = 0
-		for version in package.Versions:
-			item_count = len(version.Items)
-		
-		self.hash_table_size = self.calc_table_size( item_count ) 
-		self.hash_data_type_mult = 109
-		self.hash_container_type_mult = 991
+	mask = 0xffffffffffffffff
+	max_seed_attempts = 1 << 16
+
+	@staticmethod
+	def hash_function( entity_type_string ):
+		hash = 0xcbf29ce484222325
+		for ch in entity_type_string.encode('utf-8'):
+			hash = ((hash ^ ch) * 0x00000100000001B3) & EntityHashTable.mask
+		return hash
+
+	# the 64 bit finalizer of MurmurHash3, applied to the hash plus the seed of the bucket
+	def mix_function( self , hash , seed ):
+		value = (hash + seed) & self.mask
+		value ^= value >> 33
+		value = (value * 0xff51afd7ed558ccd) & self.mask
+		value ^= value >> 33
+		value = (value * 0xc4ceb9fe1a85ec53) & self.mask
+		value ^= value >> 33
+		return value
+
+	def slot_of( self , hash , seed ):
+		return self.mix_function( hash , seed ) % self.hash_table_size
+
+	# find a seed for the hashes of a bucket, which places all of them in distinct empty slots. returns None if 
+	# no seed is found within max_seed_attempts
+	def find_seed( self , hashes ):
+		for seed in range( self.max_seed_attempts ):
+			slots = set( self.slot_of( hash , seed ) for hash in hashes )
+			if len(slots) == len(hashes) and all( self.hash_table[slot] == None for slot in slots ):
+				return seed
+		return None
+
+	# place the entities in the table, using bucket_count buckets. returns False if a bucket can't be placed
+	def place_entities( self , hashes , bucket_count ):
+		self.bucket_count = bucket_count
 		self.hash_table = [None] * self.hash_table_size
+		self.seeds = [0] * self.bucket_count
+
+		# place the largest buckets first, as they are the hardest to place
+		buckets = [[] for _ in range(self.bucket_count)]
+		for hash in hashes:
+			buckets[hash % self.bucket_count].append( hash )
+		for bucket_index in sorted( range(self.bucket_count) , key = lambda index: -len(buckets[index]) ):
+			if len(buckets[bucket_index]) == 0:
+				break
+			seed = self.find_seed( buckets[bucket_index] )
+			if seed is None:
+				return False
+			self.seeds[bucket_index] = seed
+			for hash in buckets[bucket_index]:
+				self.hash_table[self.slot_of( hash , seed )] = hashes[hash][1]
+		return True
 
-		# fill up hash table, only fill with entities
+	def __init__(self, package):
+		entities = []
 		for version in package.Versions:
 			for item in version.Items:
 				if item.IsEntity and not item.IdenticalToPreviousVersion and not item.IsDeleted:
-					self.insert_into_table( package.Name , version.Name , item.Name );
+					entities.append( (f'{package.Name}.{version.Name}.{item.Name}' , f'{version.Name}_{item.Name}') )
+
+		# one slot per entity (but at least one slot). the slots must all be used, as the entity types are also listed by slot index
+		self.entity_count = len(entities)
+		self.hash_table_size = max( len(entities) , 1 )
+
+		# the full hashes must be unique, or the entities can't be told apart by any seed
+		hashes = {}
+		for entity in entities:
+			hash = self.hash_function( entity[0] )
+			if hash in hashes:
+				raise Exception(f'EntityHashTable: The entity types {hashes[hash][0]} and {entity[0]} have the same hash value')
+			hashes[hash] = entity
+
+		# start with one bucket per two entities. if a bucket can't be placed, double the number of buckets (which makes the 
+		# buckets smaller and easier to place) and rebuild, up to one bucket per entity
+		max_bucket_count = max( len(entities) , 1 )
+		bucket_count = max( len(entities) // 2 , 1 )
+		while not self.place_entities( hashes , bucket_count ):
+			if bucket_count >= max_bucket_count:
+				raise Exception(f'EntityHashTable: No seeds were found to place the {len(entities)} entity types of package {package.Name}, even with one bucket per entity type')
+			bucket_count = min( bucket_count * 2 , max_bucket_count )
+
+		# verify that all entities are found in their slot
+		for hash,entity in hashes.items():
+			slot = self.slot_of( hash , self.seeds[hash % self.bucket_count] )
+			if self.hash_table[slot] != entity[1]:
+				raise Exception(f'EntityHashTable: The entity type {entity[0]} is not found in its slot')
+
+# the numeric id of an entity type, which is written to the entity file headers instead of the entity type string. the id is
+# the FNV-1a hash of the entity type string, so it is stable as long as the package, version and entity names are unchanged
+def GetEntityTypeId( item: Item ):
+	return EntityHashTable.hash_function( f'{item.Package.Name}.{item.Version.Name}.{item.Name}' )
 
 def CreatePackageHandler_inl( package: Package ):
 	packageName = package.Name
 
-	lines = []
+	lines = hlp.FileEmitter(f"{package.Path}/{packageName}PackageHandler.inl")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#include <pds/pds.h>')
@@ -681,17 +779,7 @@ def CreatePackageHandler_inl( package: Package ):
 	lines.append('{')
 	
 	lines.append('    // dynamic allocation functors for items')
-	lines.append('    class _entityTypeClass')
-	lines.append('        {')
-	lines.append('        public:')
-	lines.append('            virtual const char *EntityTypeString() const = 0;')
-	lines.append('            virtual std::shared_ptr<pds::Entity> New() const = 0;')
-	lines.append('            virtual void Clear( pds::Entity *obj ) const = 0;')
-	lines.append('            virtual bool Equals( const pds::Entity *lval , const pds::Entity *rval ) const = 0;')
-	lines.append('            virtual bool Write( const pds::Entity *obj, pds::EntityWriter &writer ) const = 0;')
-	lines.append('            virtual bool Read( pds::Entity *obj, pds::EntityReader &reader ) const = 0;')
-	lines.append('            virtual bool Validate( const pds::Entity *obj, pds::EntityValidator &validator ) const = 0;')
-	lines.append('        };')
+	lines.append('    using _entityTypeClass = pds::EntityTypeRecord;')
 	lines.append('')
 
 	# add all (unique) entities of all versions
@@ -704,6 +792,7 @@ def CreatePackageHandler_inl( package: Package ):
 				lines.append(f'        {{' )
 				lines.append(f'        public:' )
 				lines.append(f'            virtual const char *EntityTypeString() const {{ return {namespacedItemName}::ItemTypeString; }}' )
+				lines.append(f'            virtual u64 EntityTypeId() const {{ return {namespacedItemName}::EntityTypeId; }}' )
 				lines.append(f'            virtual std::shared_ptr<pds::Entity> New() const {{ return std::make_shared<{namespacedItemName}>(); }}')
 				lines.append(f'            virtual void Clear( pds::Entity *obj ) const {{ {namespacedItemName}::MF::Clear( *(({namespacedItemName}*)obj) ); }}')
 				lines.append(f'            virtual bool Equals( const pds::Entity *lval , const pds::Entity *rval ) const {{ return {namespacedItemName}::MF::Equals( (({namespacedItemName}*)lval) , (({namespacedItemName}*)rval) ); }}')
@@ -717,7 +806,7 @@ def CreatePackageHandler_inl( package: Package ):
 	hash_table = EntityHashTable( package )
 
 	# print it 
-	lines.append('    // Hash table with the type entity handler objects')
+	lines.append('    // Minimal perfect hash table with the type entity handler objects')
 	lines.append(f'    static const _entityTypeClass *_entityTypeClassHashTable[{hash_table.hash_table_size}] = ')
 	lines.append('        {')
 	for row_start in range(0,hash_table.hash_table_size,10):
@@ -731,6 +820,18 @@ def CreatePackageHandler_inl( package: Package ):
 		lines.append('        ' + row_str + f' // items {row_start} to {row_end-1}' )
 	lines.append('        };')
 	lines.append('')
+	lines.append('    // number of entity types, all slots of the hash table below the count are used')
+	lines.append(f'    static const size_t _entityTypeCount = {hash_table.entity_count};')
+	lines.append('')
+	lines.append('    // Seeds of the buckets of the hash table')
+	lines.append(f'    static const u32 _entityTypeClassHashSeeds[{hash_table.bucket_count}] = ')
+	lines.append('        {')
+	for row_start in range(0,hash_table.bucket_count,10):
+		row_end = min(row_start+10,hash_table.bucket_count)
+		row_str = ''.join( f'{hash_table.seeds[idx]},' for idx in range(row_start,row_end) )
+		lines.append('        ' + row_str + f' // buckets {row_start} to {row_end-1}' )
+	lines.append('        };')
+	lines.append('')
 	lines.append('    // hash table lookup of entityType')
 	lines.append('    static const _entityTypeClass *_findEntityTypeClass( const char *typeNameString )')
 	lines.append('        {')
@@ -742,16 +843,18 @@ def CreatePackageHandler_inl( package: Package ):
 	lines.append('            hash *= (u64)(0x00000100000001B3);')
 	lines.append('            }')
 	lines.append('')
-	lines.append('        // look for entry in table. ')
-	lines.append(f'        u64 hashValue = hash % {hash_table.hash_table_size};')
-	lines.append('        while( _entityTypeClassHashTable[hashValue] != nullptr )')
-	lines.append('            {')
-	lines.append('            if( strcmp( _entityTypeClassHashTable[hashValue]->EntityTypeString() , typeNameString ) == 0 )')
-	lines.append('                return _entityTypeClassHashTable[hashValue];')
-	lines.append('            ++hashValue;')
-	lines.append(f'            if(hashValue >= {hash_table.hash_table_size})')
-	lines.append('                hashValue = 0;')
-	lines.append('            }')
+	lines.append('        // mix in the seed of the bucket, to get the slot of the entity type')
+	lines.append(f'        u64 slot = hash + _entityTypeClassHashSeeds[hash % {hash_table.bucket_count}];')
+	lines.append('        slot ^= slot >> 33;')
+	lines.append('        slot *= (u64)(0xff51afd7ed558ccd);')
+	lines.append('        slot ^= slot >> 33;')
+	lines.append('        slot *= (u64)(0xc4ceb9fe1a85ec53);')
+	lines.append('        slot ^= slot >> 33;')
+	lines.append(f'        const _entityTypeClass *entityTypeClass = _entityTypeClassHashTable[slot % {hash_table.hash_table_size}];')
+	lines.append('')
+	lines.append('        // the slot holds the only possible match, make sure it is the entity type')
+	lines.append('        if( entityTypeClass != nullptr && strcmp( entityTypeClass->EntityTypeString() , typeNameString ) == 0 )')
+	lines.append('            return entityTypeClass;')
 	lines.append('')
 	lines.append('        // entity was not found (this should never happen unless testing)')
 	lines.append('        ctLogError << "_findEntityTypeClass: Invalid entity parameter { " << typeNameString << " } " << ctLogEnd;')
@@ -761,6 +864,15 @@ def CreatePackageHandler_inl( package: Package ):
 	
 	lines.append('}')
 	lines.append(f'// namespace entity_types')	
+	lines.append('')
+
+	# the entities return their type records directly, so no lookup is needed when the type of an entity object is known
+	lines.append('    // type records of the entities')
+	for version in package.Versions:
+		for item in version.Items:
+			if item.IsEntity and not item.IdenticalToPreviousVersion and not item.IsDeleted:
+				lines.append(f'    const pds::EntityTypeRecord *const {version.Name}::{item.Name}::TypeRecord = &entity_types::_et_{version.Name}_{item.Name}_EntityTypeObject;' )
+				lines.append(f'    const pds::EntityTypeRecord *{version.Name}::{item.Name}::GetEntityTypeRecord() const {{ return TypeRecord; }}' )
  
 	lines.append("""
 	static const class CreatePackageHandler : public pds::EntityManager::PackageRecord
@@ -817,6 +929,21 @@ def CreatePackageHandler_inl( package: Package ):
 					return false;
 				return ta->Validate( obj , validator );
 				}
+
+			virtual size_t GetEntityTypeCount() const
+				{
+				return entity_types::_entityTypeCount;
+				}
+
+			virtual const pds::EntityTypeRecord *GetEntityType( size_t index ) const
+				{
+				if( index >= entity_types::_entityTypeCount )
+					{
+					ctLogError << "Invalid parameter, index is out of range" << ctLogEnd;
+					return nullptr;
+					}
+				return entity_types::_entityTypeClassHashTable[index];
+				}
 				
 		} _createPackageHandlerObject;
 
@@ -828,7 +955,7 @@ def CreatePackageHandler_inl( package: Package ):
 	lines.append(f'// namespace {packageName}')
 	lines.append('')
 	lines.append('#include <pds/_pds_undef_macros.inl>')
-	hlp.write_lines_to_file(f"{package.Path}/{packageName}PackageHandler.inl",lines)
+	lines.close()
 
 
 from .ElementTypes import ListPackageHeaderDefines
@@ -837,7 +964,7 @@ from .ElementTypes import ListPackageHeaderDefines
 def CreatePackageHeader( package ):
 	packageName = package.Name
 
-	lines = []
+	lines = hlp.FileEmitter(f"{package.Path}/pdsImportsAndDefines.h")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#pragma once')
@@ -845,6 +972,7 @@ def CreatePackageHeader( package ):
 	lines.append(f'#include <pds/pds.h>')
 	lines.append(f'#include <pds/IndexedVector.h>')
 	lines.append(f'#include <pds/ItemTable.h>')
+	lines.append(f'#include <pds/LazyItem.h>')
 	lines.append(f'#include <pds/Varying.h>')
 	lines.append(f'#include <pds/DirectedGraph.h>')
 	lines.append(f'#include <pds/BidirectionalMap.h>')
@@ -859,16 +987,16 @@ def CreatePackageHeader( package ):
 	lines.append('\tconst pds::EntityManager::PackageRecord *GetPackageRecord();')
 	lines.append('\t};')
 
-	hlp.write_lines_to_file(f"{package.Path}/pdsImportsAndDefines.h",lines)
-
-def CreatePackageSourceFile( package: Package ):
-	packageName = package.Name
+	lines.close()
 
+# lines which include the pds imports and the stream headers, common to all package source files
+# packageFolder is the relative path from the source file to the package folder
+def PackageSourcePreamble( packageFolder:str = '' ):
 	lines = []
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('// All pds imports and typedefs')
-	lines.append(f'#include "pdsImportsAndDefines.h"')
+	lines.append(f'#include "{packageFolder}pdsImportsAndDefines.h"')
 	lines.append('')
 
 	lines.append('#include <pds/EntityWriter.h>')
@@ -877,34 +1005,140 @@ def CreatePackageSourceFile( package: Package ):
 	lines.append('#include <pds/MemoryReadStream.h>')
  
 	lines.append('')
-	
-	lines.append('// All versions of this package')
-	for version in package.Versions:
+	return lines
+
+# include lines of the headers of all items in the versions, relative to the package folder
+def ListItemHeaderIncludes( versions:list[Version] ):
+	lines = []
+	for version in versions:
 		for item in version.Items:
 			if not item.IsDeleted:
 				lines.append(f'#include "{version.Name}/{version.Name}_{item.Name}.h"')
 		lines.append('')
+	return lines
+
+# the items of a version which have an implementation (.inl file)
+def ListImplementedItems( version: Version ):
+	return [item for item in version.Items if not item.IsDeleted and not item.IdenticalToPreviousVersion]
+
+# the single (unity) source file of the package, which includes all implementations of all versions and the package handler
+def CreatePackageSourceFile( package: Package ):
+	packageName = package.Name
+
+	lines = hlp.FileEmitter(f"{package.Path}/{packageName}.cpp")
+	lines.extend( PackageSourcePreamble() )
+	
+	lines.append('// All versions of this package')
+	lines.extend( ListItemHeaderIncludes( package.Versions ) )
 	
 	lines.append('// Include all inl implementations of all versions')
 	for version in package.Versions:		
 		# include inl files for all new items in version
-		for item in version.Items:
-			if not item.IsDeleted and not item.IdenticalToPreviousVersion:
-				lines.append(f'#include "{version.Name}/{version.Name}_{item.Name}.inl"')
+		for item in ListImplementedItems( version ):
+			lines.append(f'#include "{version.Name}/{version.Name}_{item.Name}.inl"')
 	lines.append('')
 
 	lines.append('// Include the package handler for this package')
 	lines.append('')
 	lines.append(f'#include "{packageName}PackageHandler.inl"')
 
-	hlp.write_lines_to_file(f"{package.Path}/{packageName}.cpp",lines)
+	lines.close()
+
+# source file with only the package handler
+def CreatePackageHandlerSourceFile( package: Package ):
+	packageName = package.Name
+
+	lines = hlp.FileEmitter(f"{package.Path}/{packageName}PackageHandler.cpp")
+	lines.extend( PackageSourcePreamble() )
+	
+	lines.append('// All versions of this package')
+	lines.extend( ListItemHeaderIncludes( package.Versions ) )
+
+	lines.append('// Include the package handler for this package')
+	lines.append('')
+	lines.append(f'#include "{packageName}PackageHandler.inl"')
+
+	lines.close()
+
+# source files of the implementations of a version, placed in the version folder. if itemsPerSource is set, the 
+# implementations are split into multiple source files of at most that many items. returns the paths relative to the package folder
+def CreateVersionSourceFiles( version: Version, itemsPerSource:int = None ):
+	package = version.Package
+	items = ListImplementedItems( version )
+	if len(items) == 0:
+		return []
+	if itemsPerSource == None:
+		itemsPerSource = len(items)
+	sourceCount = (len(items) + itemsPerSource - 1) // itemsPerSource
+	
+	sourcePaths = []
+	for sourceIndex in range(sourceCount):
+		sourceName = f'{package.Name}_{version.Name}' if sourceCount == 1 else f'{package.Name}_{version.Name}_{sourceIndex}'
+		sourcePath = f'{version.Name}/{sourceName}.cpp'
+
+		lines = hlp.FileEmitter(f"{package.Path}/{sourcePath}")
+		lines.extend( PackageSourcePreamble( '../' ) )
+
+		lines.append(f'// All items of version {version.Name}')
+		for item in version.Items:
+			if not item.IsDeleted:
+				lines.append(f'#include "{version.Name}_{item.Name}.h"')
+		lines.append('')
+
+		lines.append(f'// Include the inl implementations of version {version.Name}')
+		for item in items[sourceIndex*itemsPerSource:(sourceIndex+1)*itemsPerSource]:
+			lines.append(f'#include "{version.Name}_{item.Name}.inl"')
+
+		lines.close()
+		sourcePaths.append( sourcePath )
+	
+	return sourcePaths
+
+# list the source files of the package for CMake, in the variable {packageName}_source_files
+def CreatePackageSourcesList( package: Package, sourcePaths:list[str] ):
+	packageName = package.Name
+
+	lines = hlp.FileEmitter(f"{package.Path}/{packageName}Sources.cmake")
+	lines.append('# WARNING! DO NOT EDIT THIS FILE! This file is generated.')
+	lines.append('')
+	lines.append(f'# source files of the {packageName} package, include this file and add ${{{packageName}_source_files}} to the target')
+	lines.append('set(')
+	lines.append(f'\t{packageName}_source_files')
+	lines.append('')
+	for sourcePath in sourcePaths:
+		lines.append(f'\t${{CMAKE_CURRENT_LIST_DIR}}/{sourcePath}')
+	lines.append(')')
+
+	lines.close()
+
+# create the source files of the package. sourceSplit selects how the implementations are split into translation units:
+# None - a single (unity) source file for the whole package
+# "Version" - one source file for each version, and one for the package handler
+# an int N - same as "Version", but with at most N items in each source file
+def CreatePackageSourceFiles( package: Package, sourceSplit = None ):
+	if sourceSplit == None:
+		CreatePackageSourceFile( package )
+		sourcePaths = [f'{package.Name}.cpp']
+	else:
+		if sourceSplit == "Version":
+			itemsPerSource = None
+		elif type(sourceSplit) is int and sourceSplit > 0:
+			itemsPerSource = sourceSplit
+		else:
+			print(f'Error: Invalid source split "{sourceSplit}" of package {package.Name}, it must be None, "Version" or a positive number of items.')
+			exit(1)
+		CreatePackageHandlerSourceFile( package )
+		sourcePaths = [f'{package.Name}PackageHandler.cpp']
+		for version in package.Versions:
+			sourcePaths.extend( CreateVersionSourceFiles( version , itemsPerSource ) )
+	CreatePackageSourcesList( package, sourcePaths )
 
 def CreateDefaultVersionReferencesAndHeaders( version: Version ):
 	package = version.Package
 
 	for item in version.Items:
 		if item.IsEntity and not item.IsDeleted:
-			lines = []
+			lines = hlp.FileEmitter(f"{package.Path}/{item.Name}.h")
 			
 			# point at the latest implemented version of the entity
 			implementVersionName = version.Name
@@ -921,7 +1155,7 @@ def CreateDefaultVersionReferencesAndHeaders( version: Version ):
 			lines.append(f'\tusing {item.Name} = {implementVersionName}::{item.Name};' )
 			lines.append('\t}')
 
-			hlp.write_lines_to_file(f"{package.Path}/{item.Name}.h",lines)
+			lines.close()
 
 def FindAndCreateDefaultVersionReferencesAndHeaders( package: Package , defaultVersion:str ):
 	# if we want default version headers and references directly in the Package
@@ -930,15 +1164,10 @@ def FindAndCreateDefaultVersionReferencesAndHeaders( package: Package , defaultV
 
 			# look for a version which does not have a later version
 			hasFoundALatest = False
+			earlierVersions = set( laterVersion.PreviousVersion for laterVersion in package.Versions if laterVersion.PreviousVersion != None )
 			for version in package.Versions:	
-				# for each version, check if any other version points at it
-				hasLater = False
-				for laterVersion in package.Versions:	
-					if laterVersion == version:
-						continue
-					if laterVersion.PreviousVersion == version:
-						hasLater = True
-						break
+				# check if any other version points at it
+				hasLater = version in earlierVersions
 				if not hasLater:
 					if hasFoundALatest:
 						print('Error: The package has "Latest" set as selected default version, but there are more than one leaf versions.')
@@ -955,11 +1184,10 @@ def FindAndCreateDefaultVersionReferencesAndHeaders( package: Package , defaultV
 		else:
 			# set a specific version as the latest
 			hasFoundVersion = False
-			for version in package.Versions:
-				if version.Name == defaultVersion:
-					CreateDefaultVersionReferencesAndHeaders( version )
-					hasFoundVersion = True
-					break
+			version = package.FindVersion( defaultVersion )
+			if version != None:
+				CreateDefaultVersionReferencesAndHeaders( version )
+				hasFoundVersion = True
 			
 			# make sure one was found
 			if not hasFoundVersion:
@@ -967,21 +1195,48 @@ def FindAndCreateDefaultVersionReferencesAndHeaders( package: Package , defaultV
 				exit(1)
 
 
-def run( package: Package, defaultVersion:str = None ):
+def CreatePackageFiles( package: Package, defaultVersion:str, sourceSplit = None ):
+	CreatePackageHeader( package )
+	CreatePackageSourceFiles( package, sourceSplit )
+	CreatePackageHandler_inl( package )
+	FindAndCreateDefaultVersionReferencesAndHeaders( package, defaultVersion )
+
+def CreateItemFiles( item: Item ):
+	CreateItemHeader( item )
+	CreateItemSource( item )
+
+# the package being generated, set in each worker process so that items can be passed as indices instead of being pickled
+_workerPackage = None
+
+def _SetWorkerPackage( package: Package ):
+	global _workerPackage
+	_workerPackage = package
+
+def _CreateItemFilesByIndex( versionIndex:int, itemIndex:int ):
+	CreateItemFiles( _workerPackage.Versions[versionIndex].Items[itemIndex] )
+
+# sourceSplit selects how the package is split into source files, see CreatePackageSourceFiles
+def run( package: Package, defaultVersion:str = None, sourceSplit = None ):
 	
 	os.makedirs(package.Path, exist_ok=True)
 	for version in package.Versions:
 		os.makedirs(package.Path + '/' + version.Name , exist_ok=True)
 
-	CreatePackageHeader( package )
-	CreatePackageSourceFile( package )
-	CreatePackageHandler_inl( package )
+	codeHash = hlp.generator_code_hash()
+
+	# generate the package-wide files, unless the layout of the package is unchanged
+	packageHash = hlp.hash_text( f'{codeHash}|{defaultVersion}|{sourceSplit}|{package.GetLayoutFingerprint()}' )
+	if not hlp.run_if_changed( f'{package.Name}', packageHash, CreatePackageFiles, package, defaultVersion, sourceSplit ):
+		print( f'\tSkipping: package files of {package.Name}, (inputs are unchanged)...')
 	
-	# generate all items
-	for version in package.Versions:
-		for item in version.Items:
+	# generate all items (in parallel if hlp.worker_count > 1), skip items which are unchanged
+	itemJobs = []
+	for versionIndex,version in enumerate(package.Versions):
+		for itemIndex,item in enumerate(version.Items):
 			if not item.IsDeleted:
-				CreateItemHeader( item )
-				CreateItemSource( item )
-	
-	FindAndCreateDefaultVersionReferencesAndHeaders( package, defaultVersion )
+				# the output path is part of the hash, so that moving the package regenerates the items in the new location
+				itemHash = hlp.hash_text( f'{codeHash}|{package.Path}|{package.GetItemFingerprint(item)}' )
+				itemJobs.append( (f'{package.Name}/{version.Name}/{item.Name}', itemHash, _CreateItemFilesByIndex, (versionIndex,itemIndex)) )
+	skippedItems = hlp.run_jobs( itemJobs, _SetWorkerPackage, (package,) )
+	if skippedItems > 0:
+		print( f'\tSkipping: {skippedItems} items of {package.Name}, (inputs are unchanged)...')
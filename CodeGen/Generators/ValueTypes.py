@@ -5,7 +5,7 @@
 import CodeGeneratorHelpers as hlp
 
 def CombinedTypes_h():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/ValueTypes.h")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#pragma once')
@@ -53,10 +53,10 @@ def CombinedTypes_h():
 
 	# end of namespaces
 	lines.append('    };')
-	hlp.write_lines_to_file("../Include/pds/ValueTypes.h",lines)
+	lines.close()
 
 def CombinedTypes_inl():
-	lines = []
+	lines = hlp.FileEmitter("../Include/pds/ValueTypes.inl")
 	lines.extend( hlp.generate_header() )
 	lines.append('')
 	lines.append('#include "ValueTypes.h"')
@@ -78,7 +78,7 @@ def CombinedTypes_inl():
 
 	# end of namespace
 	lines.append('    };')
-	hlp.write_lines_to_file("../Include/pds/ValueTypes.inl",lines)
+	lines.close()
 	
 def run():
 	CombinedTypes_h()
@@ -3,6 +3,8 @@
 
 #pragma once
 
+#include <memory>
+
 #include "pds.h"
 
 namespace pds
@@ -20,6 +22,32 @@ public:
 	virtual ~Entity() = default;
 
 	virtual const char *EntityTypeString() const = 0;
+
+	// the type record of the entity, or nullptr if the entity type does not have a record,
+	// in which case the record is looked up by the entity type string
+	virtual const EntityTypeRecord *GetEntityTypeRecord() const { return nullptr; }
+};
+
+// EntityTypeRecord implements the dynamic calls of an entity type. The records are generated per entity type in the packages
+class EntityTypeRecord
+{
+public:
+	virtual const char *EntityTypeString() const = 0;
+
+	// the stable numeric id of the entity type, which can be written to the entity files instead of the type string
+	virtual u64 EntityTypeId() const = 0;
+
+	// create a new writable entity of the type
+	virtual std::shared_ptr<Entity> New() const = 0;
+
+	// clear and compare entities of the type
+	virtual void Clear( Entity *obj ) const = 0;
+	virtual bool Equals( const Entity *lval, const Entity *rval ) const = 0;
+
+	// write, read and validate an entity of the type
+	virtual bool Write( const Entity *obj, EntityWriter &writer ) const = 0;
+	virtual bool Read( Entity *obj, EntityReader &reader ) const = 0;
+	virtual bool Validate( const Entity *obj, EntityValidator &validator ) const = 0;
 };
 
 }
@@ -4,9 +4,15 @@
 #pragma once
 
 #include <future>
+#include <list>
+#include <atomic>
+#include <mutex>
 #include <ctle/readers_writer_lock.h>
 
 #include "pds.h"
+#include "Enums.h"
+#include "MemoryWriteStream.h"
+#include "WorkerPool.h"
 
 namespace pds
 {
@@ -29,26 +35,210 @@ public:
 
 		// validate an entity
 		virtual bool Validate( const Entity *obj, EntityValidator &validator ) const = 0;
+
+		// the entity type records of the package
+		virtual size_t GetEntityTypeCount() const = 0;
+		virtual const EntityTypeRecord *GetEntityType( size_t index ) const = 0;
+	};
+
+	// how the SHA-256 hash of an entity file is verified when the entity is loaded
+	enum class VerificationPolicy
+	{
+		Always,			// verify the hash on every load
+		Never,			// never verify the hash, the entity files are trusted
+		Sampled,		// verify the hash on every n:th load, set by Options::VerificationSampleInterval
+		OncePerFile,	// verify the hash on the first load of a file, and record the file (by size and modification time) in a sidecar file in the entity folder
+	};
+
+	// how a load was verified, reported by LoadEntity
+	struct LoadReport
+	{
+		// the verification policy which applied to the load
+		VerificationPolicy Policy = VerificationPolicy::Always;
+
+		// true if the hash of the file was calculated and compared in this load. (false if the entity was already loaded,
+		// if the policy skipped the verification, or if the file was verified by an earlier load with OncePerFile.)
+		bool HashVerified = false;
+
+		// true if the entity was already being loaded, and this load shared the result of that load
+		bool Coalesced = false;
+	};
+
+	// options of the entity manager, which are set in Initialize
+	struct Options
+	{
+		// write the numeric entity type id to the header of the entity files, instead of the entity type string. 
+		// this makes the files smaller and faster to load. files with either header are always readable.
+		bool WriteEntityTypeIds = false;
+
+		// the stream_format_flags of the written entity files. the flags are stored in the files, and files 
+		// written with any flags are always readable.
+		u16 StreamFormatFlags = sf_none;
+
+		// load entity files by memory-mapping them, instead of reading them into an allocated buffer. the hash 
+		// is verified and the entity is read directly from the mapped file, which is unmapped when the entity is loaded.
+		bool MemoryMapEntityFiles = false;
+
+		// the verification of the hash of the entity files when loaded. the default is to always verify the files.
+		VerificationPolicy Verification = VerificationPolicy::Always;
+
+		// with VerificationPolicy::Sampled, verify one of every VerificationSampleInterval loads
+		u32 VerificationSampleInterval = 16;
+
+		// the budget of the entity cache, as a max number of entities and a max total size in bytes (the serialized size of 
+		// the entities). when a new entity is loaded or added and the cache is over budget, the least recently used entities 
+		// which are not referenced outside of the manager are evicted, down to 15/16 of the budget so that the following inserts 
+		// do not have to evict again. the loaded or added entity itself is kept, even if it is over the budget on its own. 
+		// 0 is unlimited.
+		u64 CacheMaxEntityCount = 0;
+		u64 CacheMaxBytes = 0;
+
+		// the worker pool which runs the loads and adds of entities. WorkerThreadCount 0 is one thread per hardware thread. 
+		// when WorkerQueueCapacity tasks are queued, further async calls block until a task is started.
+		u32 WorkerThreadCount = 0;
+		u32 WorkerQueueCapacity = 1024;
+
+		// the write streams which serialize added entities are pooled, and keep their allocations between adds. new streams 
+		// reserve WriteStreamInitialSize bytes, and streams which have grown beyond WriteStreamMaxPooledSize are freed instead of pooled.
+		u64 WriteStreamInitialSize = 1024 * 1024;
+		u64 WriteStreamMaxPooledSize = 1024 * 1024 * 64;
+	};
+
+	// statistics of the entity cache, returned by GetCacheStatistics
+	struct CacheStatistics
+	{
+		u64 EntityCount = 0;	// the number of resident entities
+		u64 ResidentBytes = 0;	// the total serialized size of the resident entities
+		u64 Hits = 0;			// lookups and loads of entities which were resident
+		u64 Misses = 0;			// lookups and loads of entities which were not resident
+		u64 Evictions = 0;		// entities evicted to keep the cache within budget
 	};
 
 private:
 	std::string Path;
+	Options Settings;
+
+	// a resident entity, with its serialized size, its position in the LRU list, and the use tick of its last insert or lookup
+	struct EntityRecord
+	{
+		std::shared_ptr<const Entity> Object;
+		u64 Size = 0;
+		std::list<entity_ref>::iterator LruPosition;
+		u64 LastUsed = 0;
+	};
+
+	// a shard of the resident entities, each with its own lock and LRU list
+	struct EntityShard
+	{
+		std::unordered_map<entity_ref, EntityRecord> Entities;
+		ctle::readers_writer_lock EntitiesLock;
+
+		// the resident entities, most recently used first. reordered by lookups, which hold the read lock of 
+		// EntitiesLock, so the list (and the LastUsed ticks of the records) is also guarded by LruLock.
+		std::list<entity_ref> Lru;
+		std::mutex LruLock;
+
+		std::atomic<u64> Hits{ 0 };
+		std::atomic<u64> Misses{ 0 };
+		std::atomic<u64> Evictions{ 0 };
+	};
+
+	// the entities are partitioned into shards by the hash of the entity_ref, so lookups and inserts 
+	// of different entities mostly do not contend on the same lock
+	static constexpr const size_t EntityShardCount = 16;
+	EntityShard EntityShards[EntityShardCount];
+
+	// the resident entities of all shards, which are kept within the cache budget, and the use tick which orders the 
+	// uses of entities across the shards
+	std::atomic<u64> ResidentEntityCount{ 0 };
+	std::atomic<u64> ResidentBytes{ 0 };
+	std::atomic<u64> UseTick{ 0 };
 
-	std::unordered_map<entity_ref, std::shared_ptr<const Entity>> Entities;
-	ctle::readers_writer_lock EntitiesLock;
 	std::vector<const PackageRecord *> Records;
 
-	void InsertEntity( const entity_ref &ref, const std::shared_ptr<const Entity> &entity );
+	// the entity type records of all packages, set up in Initialize and read-only after that
+	std::unordered_map<std::string, const EntityTypeRecord *> EntityTypes;
+	std::unordered_map<u64, const EntityTypeRecord *> EntityTypeIds;
+
+	// the number of loads, to select the loads to verify with VerificationPolicy::Sampled
+	std::atomic<u64> LoadCounter{ 0 };
+
+	// the loads in flight, with the promises of the later callers which share the result of the load
+	std::unordered_map<entity_ref, std::vector<std::promise<status>>> LoadsInFlight;
+	std::mutex LoadsInFlightLock;
 
-	static status ReadTask( EntityManager *pThis, const entity_ref ref );
+	// the files which are verified, with their size and modification time, with VerificationPolicy::OncePerFile
+	std::unordered_map<entity_ref, std::pair<u64, u64>> VerifiedFiles;
+	std::mutex VerifiedFilesLock;
+
+	const EntityTypeRecord *GetEntityTypeRecord( const Entity *obj ) const;
+
+	EntityShard &GetEntityShard( const entity_ref &ref );
+
+	void InsertEntity( const entity_ref &ref, const std::shared_ptr<const Entity> &entity, u64 size );
+
+	// find a resident entity and mark it as most recently used, counts cache hits and misses
+	std::shared_ptr<const Entity> FindEntity( const entity_ref &ref );
+
+	// an entity which can be evicted, collected when scanning the shards
+	struct EvictionCandidate
+	{
+		entity_ref Ref;
+		u64 Size;
+		u64 LastUsed;
+		EntityShard *Shard;
+	};
+
+	// when over budget, the cache is evicted down to the budget less 1/CacheLowWaterDivisor of it
+	static constexpr const u64 CacheLowWaterDivisor = 16;
+
+	// evict the least recently used, non-referenced entities of all shards until the cache is at the low-water mark 
+	// of the budget. the shards are scanned once, and each shard is write-locked at most once. keepRef is not evicted. 
+	// no shard lock may be held by the caller, as the shards are locked one at a time.
+	void EvictEntities( const entity_ref &keepRef );
+	bool IsCacheOverBudget( u64 maxEntityCount, u64 maxBytes ) const;
+
+	// load the verified files sidecar, and check or record the verification of a file
+	void LoadVerifiedFiles();
+	bool IsFileVerified( const entity_ref &ref, u64 fileSize, u64 fileModifiedTime );
+	void AddVerifiedFile( const entity_ref &ref, u64 fileSize, u64 fileModifiedTime );
+
+	// remove a load from the loads in flight, and set the result (or the exception, if set) of the callers which share the load
+	void EndLoadInFlight( const entity_ref &ref, status result, const std::exception_ptr &exception );
+
+	static status ReadTask( EntityManager *pThis, const entity_ref ref, LoadReport *report );
+	static status LoadTask( EntityManager *pThis, const entity_ref ref, LoadReport *report );
 	static std::pair<entity_ref, status> WriteTask( EntityManager *pThis, std::shared_ptr<const Entity> entity );
 
+	// run a task on the worker pool. if the pool is not running, the task is not run, notRunTask is called 
+	// instead and the returned future is ready with its result.
+	template<class _Ret> std::future<_Ret> RunTask( std::function<_Ret()> task, std::function<_Ret()> notRunTask );
+
+	// the pool of write streams used by WriteTask
+	MemoryWriteStreamPool WriteStreams;
+
+	// the worker pool, which is declared last, so it is stopped (and its queued tasks are done) before the other members are destroyed
+	WorkerPool Workers;
+
 public:
 	status Initialize( const std::string &path, const std::vector<const PackageRecord *> &records );
+	status Initialize( const std::string &path, const std::vector<const PackageRecord *> &records, const Options &options );
+
+	// Returns the type record of the entity type with the name or id, from any of the registered packages, or nullptr if the type is not registered.
+	const EntityTypeRecord *FindEntityType( const std::string &entityTypeString ) const;
+	const EntityTypeRecord *FindEntityType( u64 entityTypeId ) const;
 
 	// Asks the handler to load an entity and insert into the Entities map. 
+	// If the entity is already being loaded, the call shares the result of that load, and the file is only read once.
+	// If report is set, it receives how the load was verified. (With LoadEntityAsync, the report must be kept until the future is ready.)
+	// If the manager is not initialized, the load returns status::not_initialized.
 	std::future<status> LoadEntityAsync( const entity_ref &ref );
+	std::future<status> LoadEntityAsync( const entity_ref &ref, LoadReport *report );
 	status LoadEntity( const entity_ref &ref );
+	status LoadEntity( const entity_ref &ref, LoadReport *report );
+
+	// Loads a batch of entities, using the worker pool. Returns the status of each load, in the order of refs.
+	std::vector<status> LoadEntities( const std::vector<entity_ref> &refs );
 
 	// Unloads all entities which are not referenced outside of the EntityHandler
 	// To make sure an entity is kept around, keep a reference to the entity using the 
@@ -61,6 +251,9 @@ public:
 	// Returns a loaded entity, or nullptr if the entity is not loaded.
 	std::shared_ptr<const Entity> GetLoadedEntity( const entity_ref &ref );
 
+	// Returns the resident size and the hit, miss and eviction counts of the entity cache.
+	CacheStatistics GetCacheStatistics();
+
 	// Transfers ownership of a writable entity to the handler. The entity is serialized
 	// and written to disk, and is from now on locked and immutable. 
 	// The method returns the entity reference to the entity on return. 
@@ -68,9 +261,17 @@ public:
 	// read-only.
 	// Note! If the exact same entity data (same hash of the serialized data) is added, the 
 	// existing reference will be returned and the status will be WAlreadyExists
+	// Note! If the manager is not initialized, the entity is not added, and the status is not_initialized.
 	std::future<std::pair<entity_ref, status>> AddEntityAsync( const std::shared_ptr<const Entity> &entity );
 	std::pair<entity_ref, status> AddEntity( const std::shared_ptr<const Entity> &entity );
 
+	// Adds a batch of entities, using the worker pool. Returns the entity reference and status of each entity, in the order of entities.
+	std::vector<std::pair<entity_ref, status>> AddEntities( const std::vector<std::shared_ptr<const Entity>> &entities );
+
+	// Runs a task on the worker pool, after the loads and adds which are already queued. The future is ready with 
+	// status::ok when the task has run. If the manager is not initialized, the task is not run, and the status is not_initialized.
+	std::future<status> RunTaskAsync( const std::function<void()> &task );
+
 
 };
 
@@ -3,97 +3,414 @@
 
 #include "EntityManager.h"
 
+#include <fstream>
+#include <algorithm>
 #include <ctle/file_funcs.h>
 
+#ifndef _MSC_VER
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#endif
+
 namespace pds
 {
 #include "_pds_macros.inl"
 
+// read-only memory mapping of a whole file, which is unmapped when the object is destroyed
+class mapped_file
+{
+public:
+	mapped_file() = default;
+	mapped_file( const mapped_file & ) = delete;
+	mapped_file &operator=( const mapped_file & ) = delete;
+	~mapped_file() { this->close(); }
+
+	// map the file. returns false if the file cant be opened or mapped. an empty file is not mapped, but is opened successfully.
+	bool open( const std::string &path );
+	void close();
+
+	const u8 *data() const { return this->Data; }
+	u64 size() const { return this->Size; }
+
+private:
+	const u8 *Data = nullptr;
+	u64 Size = 0;
+#ifdef _MSC_VER
+	HANDLE FileHandle = INVALID_HANDLE_VALUE;
+	HANDLE MappingHandle = nullptr;
+#endif
+};
+
+#ifdef _MSC_VER
 
-static std::shared_ptr<Entity> entityNew( const std::vector<const EntityManager::PackageRecord *> &records, const char *entityTypeString )
+bool mapped_file::open( const std::string &path )
 {
-	if( !entityTypeString )
+	this->close();
+
+	this->FileHandle = CreateFileA( path.c_str(), GENERIC_READ, FILE_SHARE_READ, nullptr, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, nullptr );
+	if( this->FileHandle == INVALID_HANDLE_VALUE )
+		return false;
+
+	LARGE_INTEGER file_size = {};
+	if( !GetFileSizeEx( this->FileHandle, &file_size ) )
 	{
-		ctLogError << "Invalid parameter, entityTypeString must be a pointer to a string" << ctLogEnd;
-		return nullptr;
+		this->close();
+		return false;
 	}
+	if( file_size.QuadPart == 0 )
+		return true;
 
-	for( size_t i = 0; i < records.size(); ++i )
+	this->MappingHandle = CreateFileMappingA( this->FileHandle, nullptr, PAGE_READONLY, 0, 0, nullptr );
+	if( !this->MappingHandle )
 	{
-		auto ret = records[i]->New( entityTypeString );
-		if( ret )
-			return ret;
+		this->close();
+		return false;
+	}
+	this->Data = (const u8 *)MapViewOfFile( this->MappingHandle, FILE_MAP_READ, 0, 0, 0 );
+	if( !this->Data )
+	{
+		this->close();
+		return false;
 	}
+	this->Size = (u64)file_size.QuadPart;
+	return true;
+}
 
-	ctLogError << "Unrecognized entity, cannot allocate entity of type: " << entityTypeString << " is not registered with any package." << ctLogEnd;
-	return nullptr;
+void mapped_file::close()
+{
+	if( this->Data )
+		UnmapViewOfFile( this->Data );
+	if( this->MappingHandle )
+		CloseHandle( this->MappingHandle );
+	if( this->FileHandle != INVALID_HANDLE_VALUE )
+		CloseHandle( this->FileHandle );
+	this->Data = nullptr;
+	this->Size = 0;
+	this->MappingHandle = nullptr;
+	this->FileHandle = INVALID_HANDLE_VALUE;
 }
 
-static bool entityWrite( const std::vector<const EntityManager::PackageRecord *> &records, const Entity *obj, EntityWriter &writer )
+// get the size and the modification time of a file, the time in 100 nanosecond intervals
+static bool get_file_size_and_time( const std::string &path, u64 &size, u64 &modified_time )
 {
-	if( !obj )
+	WIN32_FILE_ATTRIBUTE_DATA attributes = {};
+	if( !GetFileAttributesExA( path.c_str(), GetFileExInfoStandard, &attributes ) )
+		return false;
+	size = ( (u64)attributes.nFileSizeHigh << 32 ) | (u64)attributes.nFileSizeLow;
+	modified_time = ( (u64)attributes.ftLastWriteTime.dwHighDateTime << 32 ) | (u64)attributes.ftLastWriteTime.dwLowDateTime;
+	return true;
+}
+
+#else
+
+bool mapped_file::open( const std::string &path )
+{
+	this->close();
+
+	const int fd = ::open( path.c_str(), O_RDONLY );
+	if( fd < 0 )
+		return false;
+
+	struct stat file_stat = {};
+	if( fstat( fd, &file_stat ) != 0 )
 	{
-		ctLogError << "Invalid parameter, obj must be a pointer to an allocated object" << ctLogEnd;
+		::close( fd );
 		return false;
 	}
-
-	for( size_t i = 0; i < records.size(); ++i )
+	if( file_stat.st_size == 0 )
 	{
-		auto ret = records[i]->Write( obj, writer );
-		if( ret )
-			return ret;
+		::close( fd );
+		return true;
 	}
 
-	ctLogError << "Unrecognized entity, " << obj->EntityTypeString() << " is not registered with any package." << ctLogEnd;
-	return false;
+	// the mapping is kept when the file is closed
+	void *mapping = mmap( nullptr, (size_t)file_stat.st_size, PROT_READ, MAP_PRIVATE, fd, 0 );
+	::close( fd );
+	if( mapping == MAP_FAILED )
+		return false;
+
+	// the file is read front to back, both when hashed and when deserialized
+	madvise( mapping, (size_t)file_stat.st_size, MADV_SEQUENTIAL );
+
+	this->Data = (const u8 *)mapping;
+	this->Size = (u64)file_stat.st_size;
+	return true;
+}
+
+void mapped_file::close()
+{
+	if( this->Data )
+		munmap( (void *)this->Data, (size_t)this->Size );
+	this->Data = nullptr;
+	this->Size = 0;
+}
+
+// get the size and the modification time of a file, the time in nanoseconds
+static bool get_file_size_and_time( const std::string &path, u64 &size, u64 &modified_time )
+{
+	struct stat file_stat = {};
+	if( stat( path.c_str(), &file_stat ) != 0 )
+		return false;
+	size = (u64)file_stat.st_size;
+#ifdef __APPLE__
+	modified_time = (u64)file_stat.st_mtimespec.tv_sec * 1000000000 + (u64)file_stat.st_mtimespec.tv_nsec;
+#else
+	modified_time = (u64)file_stat.st_mtim.tv_sec * 1000000000 + (u64)file_stat.st_mtim.tv_nsec;
+#endif
+	return true;
+}
+
+#endif
+
+// the sidecar file in the entity folder which lists the verified files, with VerificationPolicy::OncePerFile. 
+// each record is the hash of the file, followed by the u64 size and u64 modification time of the file.
+static const char *verified_files_sidecar_name = "verified_files.bin";
+static const u64 verified_files_record_size = 48;
+
+
+const EntityTypeRecord *EntityManager::FindEntityType( const std::string &entityTypeString ) const
+{
+	const auto it = this->EntityTypes.find( entityTypeString );
+	if( it == this->EntityTypes.end() )
+		return nullptr;
+
+	return it->second;
 }
 
-static bool entityRead( const std::vector<const EntityManager::PackageRecord *> &records, Entity *obj, EntityReader &reader )
+const EntityTypeRecord *EntityManager::FindEntityType( u64 entityTypeId ) const
+{
+	const auto it = this->EntityTypeIds.find( entityTypeId );
+	if( it == this->EntityTypeIds.end() )
+		return nullptr;
+
+	return it->second;
+}
+
+const EntityTypeRecord *EntityManager::GetEntityTypeRecord( const Entity *obj ) const
 {
 	if( !obj )
 	{
 		ctLogError << "Invalid parameter, obj must be a pointer to an allocated object" << ctLogEnd;
-		return false;
+		return nullptr;
 	}
 
-	for( size_t i = 0; i < records.size(); ++i )
+	// use the record of the entity if it has one, else look it up by the type string
+	const EntityTypeRecord *record = obj->GetEntityTypeRecord();
+	if( !record )
 	{
-		auto ret = records[i]->Read( obj, reader );
-		if( ret )
-			return ret;
+		record = this->FindEntityType( obj->EntityTypeString() );
+		if( !record )
+		{
+			ctLogError << "Unrecognized entity, " << obj->EntityTypeString() << " is not registered with any package." << ctLogEnd;
+			return nullptr;
+		}
 	}
 
-	ctLogError << "Unrecognized entity, " << obj->EntityTypeString() << " is not registered with any package." << ctLogEnd;
-	return false;
+	return record;
 }
 
-static bool entityValidate( const std::vector<const EntityManager::PackageRecord *> &records, const Entity *obj, EntityValidator &validator )
+EntityManager::EntityShard &EntityManager::GetEntityShard( const entity_ref &ref )
+{
+	// select the shard by the top bits of the hash, the low bits are used by the maps of the shards
+	const size_t refHash = std::hash<entity_ref>{}( ref );
+	return this->EntityShards[( refHash >> ( sizeof( size_t ) * 8 - 8 ) ) % EntityShardCount];
+}
+
+void EntityManager::InsertEntity( const entity_ref &ref, const std::shared_ptr<const Entity> &entity, u64 size )
 {
-	if( !obj )
 	{
-		ctLogError << "Invalid parameter, obj must be a pointer to an allocated object" << ctLogEnd;
-		return false;
+		EntityShard &shard = this->GetEntityShard( ref );
+		ctle::readers_writer_lock::write_guard guard( shard.EntitiesLock );
+
+		// if the entity is already resident (loaded or added concurrently), keep the resident entity
+		auto inserted = shard.Entities.emplace( ref, EntityRecord() );
+		if( !inserted.second )
+			return;
+
+		EntityRecord &record = inserted.first->second;
+		record.Object = entity;
+		record.Size = size;
+		record.LruPosition = shard.Lru.insert( shard.Lru.begin(), ref );
+		record.LastUsed = ++this->UseTick;
+		++this->ResidentEntityCount;
+		this->ResidentBytes += size;
 	}
 
-	for( size_t i = 0; i < records.size(); ++i )
+	// the new entity is kept, so it is resident when the load or add returns
+	this->EvictEntities( ref );
+}
+
+std::shared_ptr<const Entity> EntityManager::FindEntity( const entity_ref &ref )
+{
+	EntityShard &shard = this->GetEntityShard( ref );
+	ctle::readers_writer_lock::read_guard guard( shard.EntitiesLock );
+
+	const auto it = shard.Entities.find( ref );
+	if( it == shard.Entities.end() )
 	{
-		auto ret = records[i]->Validate( obj, validator );
-		if( ret )
-			return ret;
+		++shard.Misses;
+		return nullptr;
 	}
+	++shard.Hits;
+
+	// move to the front of the LRU list
+	std::lock_guard<std::mutex> lruGuard( shard.LruLock );
+	shard.Lru.splice( shard.Lru.begin(), shard.Lru, it->second.LruPosition );
+	it->second.LastUsed = ++this->UseTick;
+
+	return it->second.Object;
+}
 
-	ctLogError << "Unrecognized entity, " << obj->EntityTypeString() << " is not registered with any package." << ctLogEnd;
+bool EntityManager::IsCacheOverBudget( u64 maxEntityCount, u64 maxBytes ) const
+{
+	if( maxEntityCount != 0 && this->ResidentEntityCount > maxEntityCount )
+		return true;
+	if( maxBytes != 0 && this->ResidentBytes > maxBytes )
+		return true;
 	return false;
 }
 
-void EntityManager::InsertEntity( const entity_ref &ref, const std::shared_ptr<const Entity> &entity )
+void EntityManager::EvictEntities( const entity_ref &keepRef )
+{
+	if( !this->IsCacheOverBudget( this->Settings.CacheMaxEntityCount, this->Settings.CacheMaxBytes ) )
+		return;
+
+	// evict down to the low-water mark of the budget, so the following inserts do not have to evict again
+	const u64 lowEntityCount = this->Settings.CacheMaxEntityCount - ( this->Settings.CacheMaxEntityCount / CacheLowWaterDivisor );
+	const u64 lowBytes = this->Settings.CacheMaxBytes - ( this->Settings.CacheMaxBytes / CacheLowWaterDivisor );
+	const u64 residentEntityCount = this->ResidentEntityCount;
+	const u64 residentBytes = this->ResidentBytes;
+	const u64 excessEntityCount = ( lowEntityCount != 0 && residentEntityCount > lowEntityCount ) ? residentEntityCount - lowEntityCount : 0;
+	const u64 excessBytes = ( lowBytes != 0 && residentBytes > lowBytes ) ? residentBytes - lowBytes : 0;
+
+	// scan each shard once, and collect the least recently used entities which are only held by us, 
+	// until the candidates of the shard cover the excess on their own
+	std::vector<EvictionCandidate> candidates;
+	for( EntityShard &shard : this->EntityShards )
+	{
+		ctle::readers_writer_lock::read_guard guard( shard.EntitiesLock );
+		std::lock_guard<std::mutex> lruGuard( shard.LruLock );
+
+		u64 entityCount = 0;
+		u64 bytes = 0;
+		for( auto lruIt = shard.Lru.rbegin(); lruIt != shard.Lru.rend() && ( entityCount < excessEntityCount || bytes < excessBytes ); ++lruIt )
+		{
+			if( *lruIt == keepRef )
+				continue;
+			const EntityRecord &record = shard.Entities.find( *lruIt )->second;
+			if( record.Object.use_count() != 1 )
+				continue;
+			candidates.push_back( { *lruIt, record.Size, record.LastUsed, &shard } );
+			++entityCount;
+			bytes += record.Size;
+		}
+	}
+
+	// pick the least recently used candidates of all shards which cover the excess
+	std::sort( candidates.begin(), candidates.end(), 
+		[]( const EvictionCandidate &a, const EvictionCandidate &b ) { return a.LastUsed < b.LastUsed; } );
+	u64 entityCount = 0;
+	u64 bytes = 0;
+	size_t pickedCount = 0;
+	while( pickedCount < candidates.size() && ( entityCount < excessEntityCount || bytes < excessBytes ) )
+	{
+		++entityCount;
+		bytes += candidates[pickedCount].Size;
+		++pickedCount;
+	}
+	candidates.resize( pickedCount );
+
+	// evict the picked entities, grouped by shard so each shard is write-locked once. the shards were unlocked 
+	// in between, so skip entities which have been used, referenced or evicted since the scan.
+	std::stable_sort( candidates.begin(), candidates.end(), 
+		[]( const EvictionCandidate &a, const EvictionCandidate &b ) { return std::less<const EntityShard *>()( a.Shard, b.Shard ); } );
+	auto candidateIt = candidates.begin();
+	while( candidateIt != candidates.end() )
+	{
+		EntityShard &shard = *candidateIt->Shard;
+		ctle::readers_writer_lock::write_guard guard( shard.EntitiesLock );
+		for( ; candidateIt != candidates.end() && candidateIt->Shard == &shard; ++candidateIt )
+		{
+			if( !this->IsCacheOverBudget( lowEntityCount, lowBytes ) )
+				return;
+
+			const auto it = shard.Entities.find( candidateIt->Ref );
+			if( it == shard.Entities.end() 
+			 || it->second.LastUsed != candidateIt->LastUsed 
+			 || it->second.Object.use_count() != 1 )
+				continue;
+
+			--this->ResidentEntityCount;
+			this->ResidentBytes -= it->second.Size;
+			shard.Lru.erase( it->second.LruPosition );
+			shard.Entities.erase( it );
+			++shard.Evictions;
+		}
+	}
+}
+
+void EntityManager::LoadVerifiedFiles()
+{
+	std::lock_guard<std::mutex> lock( this->VerifiedFilesLock );
+
+	const std::string sidecarPath = this->Path + "/" + verified_files_sidecar_name;
+	if( !ctle::file_exists( sidecarPath ) )
+		return;
+
+	std::vector<u8> allocation;
+	if( !ctle::read_file( sidecarPath, allocation ) )
+	{
+		ctLogError << "Could not read the verified files list " << sidecarPath << ", all files will be verified again" << ctLogEnd;
+		return;
+	}
+
+	// read all whole records, a partially written record at the end is ignored
+	MemoryReadStream rstream( allocation.data(), allocation.size(), false );
+	while( rstream.GetSize() - rstream.GetPosition() >= verified_files_record_size )
+	{
+		hash digest = {};
+		rstream.Read( &digest, 1 );
+		const u64 fileSize = rstream.Read<u64>();
+		const u64 fileModifiedTime = rstream.Read<u64>();
+		this->VerifiedFiles[entity_ref( digest )] = std::pair<u64, u64>( fileSize, fileModifiedTime );
+	}
+}
+
+bool EntityManager::IsFileVerified( const entity_ref &ref, u64 fileSize, u64 fileModifiedTime )
+{
+	std::lock_guard<std::mutex> lock( this->VerifiedFilesLock );
+
+	const auto it = this->VerifiedFiles.find( ref );
+	if( it == this->VerifiedFiles.end() )
+		return false;
+
+	// the file must not have changed since it was verified
+	return it->second.first == fileSize && it->second.second == fileModifiedTime;
+}
+
+void EntityManager::AddVerifiedFile( const entity_ref &ref, u64 fileSize, u64 fileModifiedTime )
 {
-	ctle::readers_writer_lock::write_guard guard( this->EntitiesLock );
+	std::lock_guard<std::mutex> lock( this->VerifiedFilesLock );
+
+	this->VerifiedFiles[ref] = std::pair<u64, u64>( fileSize, fileModifiedTime );
 
-	this->Entities.emplace( ref, entity );
+	// append the record to the sidecar. if the write fails, the file is just verified again on the next run
+	MemoryWriteStream wstream( verified_files_record_size );
+	wstream.Write( hash( ref ) );
+	wstream.Write( fileSize );
+	wstream.Write( fileModifiedTime );
+	std::ofstream sidecar( this->Path + "/" + verified_files_sidecar_name, std::ios::binary | std::ios::app );
+	sidecar.write( (const char *)wstream.GetData(), (std::streamsize)wstream.GetSize() );
 }
 
 status EntityManager::Initialize( const std::string &path, const std::vector<const PackageRecord *> &records )
+{
+	return this->Initialize( path, records, Options() );
+}
+
+status EntityManager::Initialize( const std::string &path, const std::vector<const PackageRecord *> &records, const Options &options )
 {
 	if( !this->Path.empty() )
 	{
@@ -117,19 +434,79 @@ status EntityManager::Initialize( const std::string &path, const std::vector<con
 
 #endif
 	this->Path = path;
+	this->Settings = options;
 
-	// copy the package records
+	// copy the package records, and register the entity types of all packages
 	this->Records = records;
+	for( const PackageRecord *record : this->Records )
+	{
+		const size_t entityTypeCount = record->GetEntityTypeCount();
+		for( size_t i = 0; i < entityTypeCount; ++i )
+		{
+			const EntityTypeRecord *entityType = record->GetEntityType( i );
+			if( !this->EntityTypes.emplace( entityType->EntityTypeString(), entityType ).second
+				|| !this->EntityTypeIds.emplace( entityType->EntityTypeId(), entityType ).second )
+			{
+				ctLogError << "Entity type " << entityType->EntityTypeString() << " (or its type id) is registered by more than one package" << ctLogEnd;
+				this->Path.clear();
+				this->Records.clear();
+				this->EntityTypes.clear();
+				this->EntityTypeIds.clear();
+				return status::invalid_param;
+			}
+		}
+	}
+
+	// load the list of files which are already verified
+	if( this->Settings.Verification == VerificationPolicy::OncePerFile )
+	{
+		this->LoadVerifiedFiles();
+	}
+
+	// set up the pool of write streams
+	this->WriteStreams.SetAllocationSizes( this->Settings.WriteStreamInitialSize, this->Settings.WriteStreamMaxPooledSize );
+
+	// start the worker pool
+	const status result = this->Workers.Start( this->Settings.WorkerThreadCount, this->Settings.WorkerQueueCapacity );
+	if( !result )
+	{
+		ctLogError << "Could not start the worker pool of the entity manager" << ctLogEnd;
+		return result;
+	}
 
 	return status::ok;
 }
 
-status EntityManager::ReadTask( EntityManager *pThis, const entity_ref ref )
+template<class _Ret> std::future<_Ret> EntityManager::RunTask( std::function<_Ret()> task, std::function<_Ret()> notRunTask )
+{
+	// the packaged task is shared, since the queued tasks of the pool must be copyable
+	auto packagedTask = std::make_shared<std::packaged_task<_Ret()>>( std::move( task ) );
+	std::future<_Ret> futr = packagedTask->get_future();
+	if( !this->Workers.Enqueue( [packagedTask]() { ( *packagedTask )(); } ) )
+	{
+		// the pool is not running, since the manager is not initialized or is being destroyed. 
+		// dont run the task, as it could outlive the manager, return the result of notRunTask instead.
+		ctLogError << "The worker pool of the entity manager is not running, the manager must be initialized" << ctLogEnd;
+		std::promise<_Ret> notRun;
+		notRun.set_value( notRunTask() );
+		return notRun.get_future();
+	}
+	return futr;
+}
+
+status EntityManager::ReadTask( EntityManager *pThis, const entity_ref ref, LoadReport *report )
 {
 	const uint hash_size = 32;
 
+	if( report )
+	{
+		report->Policy = pThis->Settings.Verification;
+		report->HashVerified = false;
+		report->Coalesced = false;
+	}
+
 	// skip if entity already is loaded
-	if( pThis->IsEntityLoaded( ref ) )
+	if( pThis->FindEntity( ref ) )
 	{
 		return status::ok;
 	}
@@ -138,33 +515,102 @@ status EntityManager::ReadTask( EntityManager *pThis, const entity_ref ref )
 	const std::string fileName = to_string( hash( ref ) ) + ".dat";
 	const std::string filePath = pThis->Path + "/" + fileName;
 
+	// with OncePerFile, get the size and time of the file before it is read, to check if it is already verified
+	u64 fileSize = 0;
+	u64 fileModifiedTime = 0;
+	bool hasFileInfo = false;
+	if( pThis->Settings.Verification == VerificationPolicy::OncePerFile )
+	{
+		hasFileInfo = get_file_size_and_time( filePath, fileSize, fileModifiedTime );
+	}
+
+	// read the file into an allocation, or map it. either is kept until the entity is read
 	std::vector<u8> allocation;
-	if( !ctle::read_file( filePath, allocation ) )
+	mapped_file mapping;
+	const u8 *buffer = nullptr;
+	u64 total_size = 0;
+	if( pThis->Settings.MemoryMapEntityFiles )
 	{
-		return status::cant_read;
+		if( !mapping.open( filePath ) )
+		{
+			return status::cant_read;
+		}
+		buffer = mapping.data();
+		total_size = mapping.size();
+	}
+	else
+	{
+		if( !ctle::read_file( filePath, allocation ) )
+		{
+			return status::cant_read;
+		}
+		buffer = allocation.data();
+		total_size = allocation.size();
 	}
 
 	// cant be less in size than the size of the hash at the end
-	if( allocation.size() < hash_size )
+	if( total_size < hash_size )
 	{
 		return status::corrupted;
 	}
 
-	u8 *buffer = allocation.data();
-	u64 total_size = allocation.size();
+	// decide if the hash is verified in this load, based on the verification policy
+	bool verifyHash = true;
+	switch( pThis->Settings.Verification )
+	{
+		case VerificationPolicy::Never:
+			verifyHash = false;
+			break;
+		case VerificationPolicy::Sampled:
+		{
+			const u64 interval = ( pThis->Settings.VerificationSampleInterval > 0 ) ? pThis->Settings.VerificationSampleInterval : 1;
+			verifyHash = ( pThis->LoadCounter.fetch_add( 1 ) % interval ) == 0;
+			break;
+		}
+		case VerificationPolicy::OncePerFile:
+			// if the file changed after its size and time were read, it is verified (and not recorded)
+			hasFileInfo = hasFileInfo && ( fileSize == total_size );
+			verifyHash = !( hasFileInfo && pThis->IsFileVerified( ref, fileSize, fileModifiedTime ) );
+			break;
+		default:
+			break;
+	}
 
-	// calculate the sha256 hash on the data, and make sure it compares correctly with the hash
-	hash digest = {};
-	ctle::calculate_sha256_hash( digest, buffer, total_size );
-	if( digest != hash( ref ) )
+	if( verifyHash )
 	{
-		// sha hash does not compare correctly, file is corrupted
-		return status::corrupted;
+		// calculate the sha256 hash on the data, and make sure it compares correctly with the hash
+		hash digest = {};
+		ctle::calculate_sha256_hash( digest, buffer, total_size );
+		if( digest != hash( ref ) )
+		{
+			// sha hash does not compare correctly, file is corrupted
+			return status::corrupted;
+		}
+
+		if( hasFileInfo )
+		{
+			pThis->AddVerifiedFile( ref, fileSize, fileModifiedTime );
+		}
+		if( report )
+		{
+			report->HashVerified = true;
+		}
 	}
 
-	// set up a memory stream and deserializer
+	// set up a memory stream
 	MemoryReadStream rstream( buffer, total_size, false );
-	EntityReader reader( rstream );
+
+	// if the file has a stream format value before the entity section, read it. (files without it use the original format)
+	u16 streamFormatFlags = sf_none;
+	if( rstream.Peek() != (u8)ValueType::VT_Subsection )
+	{
+		EntityReader formatReader( rstream );
+		if( !formatReader.Read<u16>( pdsKeyMacro( "StreamFormat" ), streamFormatFlags ) )
+			return status::corrupted;
+	}
+
+	// set up the deserializer
+	EntityReader reader( rstream, rstream.GetSize(), streamFormatFlags );
 
 	// read file header and deserialize the entity
 	bool result = {};
@@ -172,14 +618,39 @@ status EntityManager::ReadTask( EntityManager *pThis, const entity_ref ref )
 	std::tie( sectionReader, result ) = reader.BeginReadSection( pdsKeyMacro( "EntityFile" ), false );
 	if( !result )
 		return status::corrupted;
-	std::string entityTypeString;
-	result = sectionReader->Read<std::string>( pdsKeyMacro( "EntityType" ), entityTypeString );
-	if( !result )
-		return status::corrupted;
-	std::shared_ptr<Entity> entity = entityNew( pThis->Records, entityTypeString.c_str() );
+
+	// the header has either the entity type string, or the numeric entity type id
+	const EntityTypeRecord *entityType = nullptr;
+	if( rstream.Peek() == (u8)ValueType::VT_String )
+	{
+		std::string entityTypeString;
+		result = sectionReader->Read<std::string>( pdsKeyMacro( "EntityType" ), entityTypeString );
+		if( !result )
+			return status::corrupted;
+		entityType = pThis->FindEntityType( entityTypeString );
+		if( !entityType )
+		{
+			ctLogError << "Unrecognized entity, cannot allocate entity of type: " << entityTypeString << " is not registered with any package." << ctLogEnd;
+			return status::not_initialized;
+		}
+	}
+	else
+	{
+		u64 entityTypeId = 0;
+		result = sectionReader->Read<u64>( pdsKeyMacro( "EntityTypeId" ), entityTypeId );
+		if( !result )
+			return status::corrupted;
+		entityType = pThis->FindEntityType( entityTypeId );
+		if( !entityType )
+		{
+			ctLogError << "Unrecognized entity, cannot allocate entity of type id: " << entityTypeId << " is not registered with any package." << ctLogEnd;
+			return status::not_initialized;
+		}
+	}
+	std::shared_ptr<Entity> entity = entityType->New();
 	if( !entity )
 		return status::not_initialized;
-	result = entityRead( pThis->Records, entity.get(), *sectionReader );
+	result = entityType->Read( entity.get(), *sectionReader );
 	if( !result )
 		return status::corrupted;
 	result = reader.EndReadSection( sectionReader );
@@ -187,7 +658,7 @@ status EntityManager::ReadTask( EntityManager *pThis, const entity_ref ref )
 		return status::corrupted;
 
 	// transfer into the Entities map 
-	pThis->InsertEntity( ref, entity );
+	pThis->InsertEntity( ref, entity, total_size );
 
 	// done
 	return status::ok;
@@ -195,31 +666,144 @@ status EntityManager::ReadTask( EntityManager *pThis, const entity_ref ref )
 
 std::future<status> EntityManager::LoadEntityAsync( const entity_ref &ref )
 {
-	return std::async( ReadTask, this, ref );
+	return this->LoadEntityAsync( ref, nullptr );
+}
+
+void EntityManager::EndLoadInFlight( const entity_ref &ref, status result, const std::exception_ptr &exception )
+{
+	// remove the load from the loads in flight, and pass the result to the callers which share it. 
+	// (the entity is already inserted, so new callers will find it loaded.)
+	std::vector<std::promise<status>> waiters;
+	{
+		std::lock_guard<std::mutex> lock( this->LoadsInFlightLock );
+		const auto it = this->LoadsInFlight.find( ref );
+		if( it != this->LoadsInFlight.end() )
+		{
+			waiters = std::move( it->second );
+			this->LoadsInFlight.erase( it );
+		}
+	}
+	for( std::promise<status> &waiter : waiters )
+	{
+		if( exception )
+			waiter.set_exception( exception );
+		else
+			waiter.set_value( result );
+	}
+}
+
+status EntityManager::LoadTask( EntityManager *pThis, const entity_ref ref, LoadReport *report )
+{
+	// the load must always be ended, also if the read throws (such as bad_alloc), or later loads of the entity would wait forever
+	status result = status::undefined_error;
+	std::exception_ptr exception;
+	try
+	{
+		result = ReadTask( pThis, ref, report );
+	}
+	catch( ... )
+	{
+		exception = std::current_exception();
+	}
+
+	pThis->EndLoadInFlight( ref, result, exception );
+	if( exception )
+	{
+		std::rethrow_exception( exception );
+	}
+	return result;
+}
+
+std::future<status> EntityManager::LoadEntityAsync( const entity_ref &ref, LoadReport *report )
+{
+	{
+		std::lock_guard<std::mutex> lock( this->LoadsInFlightLock );
+
+		// if the entity is already being loaded, wait for that load instead of reading the file again
+		const auto it = this->LoadsInFlight.find( ref );
+		if( it != this->LoadsInFlight.end() )
+		{
+			if( report )
+			{
+				report->Policy = this->Settings.Verification;
+				report->HashVerified = false;
+				report->Coalesced = true;
+			}
+			it->second.emplace_back();
+			return it->second.back().get_future();
+		}
+
+		this->LoadsInFlight.emplace( ref, std::vector<std::promise<status>>() );
+	}
+
+	// the load must run asynchronously (not deferred), since other callers may wait for it. 
+	// if the task cant be started, end the load, so the callers which already share it are not left waiting.
+	try
+	{
+		return this->RunTask<status>( 
+			[this, ref, report]() { return LoadTask( this, ref, report ); },
+			[this, ref]() { this->EndLoadInFlight( ref, status::not_initialized, nullptr ); return status::not_initialized; } );
+	}
+	catch( ... )
+	{
+		this->EndLoadInFlight( ref, status::undefined_error, std::current_exception() );
+		throw;
+	}
 }
 
 status EntityManager::LoadEntity( const entity_ref &ref )
 {
-	auto futr = this->LoadEntityAsync( ref );
+	return this->LoadEntity( ref, nullptr );
+}
+
+status EntityManager::LoadEntity( const entity_ref &ref, LoadReport *report )
+{
+	auto futr = this->LoadEntityAsync( ref, report );
 	futr.wait();
 	return futr.get();
 }
 
-status EntityManager::UnloadNonReferencedEntities()
+std::vector<status> EntityManager::LoadEntities( const std::vector<entity_ref> &refs )
 {
-	ctle::readers_writer_lock::write_guard guard( this->EntitiesLock );
+	// queue all loads (blocks while the queue of the pool is full), then wait for them in order
+	std::vector<std::future<status>> futrs;
+	futrs.reserve( refs.size() );
+	for( const entity_ref &ref : refs )
+	{
+		futrs.emplace_back( this->LoadEntityAsync( ref ) );
+	}
 
-	auto it = this->Entities.begin();
-	while( it != this->Entities.end() )
+	std::vector<status> results;
+	results.reserve( refs.size() );
+	for( std::future<status> &futr : futrs )
 	{
-		// if this entity is only held by us, remove it, else skip to next
-		if( it->second.use_count() == 1 )
-		{
-			it = this->Entities.erase( it );
-		}
-		else
+		results.emplace_back( futr.get() );
+	}
+	return results;
+}
+
+status EntityManager::UnloadNonReferencedEntities()
+{
+	// sweep one shard at a time, the other shards are not locked
+	for( EntityShard &shard : this->EntityShards )
+	{
+		ctle::readers_writer_lock::write_guard guard( shard.EntitiesLock );
+
+		auto it = shard.Entities.begin();
+		while( it != shard.Entities.end() )
 		{
-			++it;
+			// if this entity is only held by us, remove it, else skip to next
+			if( it->second.Object.use_count() == 1 )
+			{
+				--this->ResidentEntityCount;
+				this->ResidentBytes -= it->second.Size;
+				shard.Lru.erase( it->second.LruPosition );
+				it = shard.Entities.erase( it );
+			}
+			else
+			{
+				++it;
+			}
 		}
 	}
 
@@ -229,40 +813,65 @@ status EntityManager::UnloadNonReferencedEntities()
 
 bool EntityManager::IsEntityLoaded( const entity_ref &ref )
 {
-	ctle::readers_writer_lock::read_guard guard( this->EntitiesLock );
+	EntityShard &shard = this->GetEntityShard( ref );
+	ctle::readers_writer_lock::read_guard guard( shard.EntitiesLock );
 
-	return this->Entities.find( ref ) != this->Entities.end();
+	return shard.Entities.find( ref ) != shard.Entities.end();
 }
 
 std::shared_ptr<const Entity> EntityManager::GetLoadedEntity( const entity_ref &ref )
 {
-	ctle::readers_writer_lock::read_guard guard( this->EntitiesLock );
-
-	const auto it = this->Entities.find( ref );
-	if( it == this->Entities.end() )
-		return nullptr;
+	return this->FindEntity( ref );
+}
 
-	return it->second;
+EntityManager::CacheStatistics EntityManager::GetCacheStatistics()
+{
+	// sum up the counters of the shards
+	CacheStatistics statistics;
+	statistics.EntityCount = this->ResidentEntityCount;
+	statistics.ResidentBytes = this->ResidentBytes;
+	for( EntityShard &shard : this->EntityShards )
+	{
+		statistics.Hits += shard.Hits;
+		statistics.Misses += shard.Misses;
+		statistics.Evictions += shard.Evictions;
+	}
+	return statistics;
 }
 
 std::pair<entity_ref, status> EntityManager::WriteTask( EntityManager *pThis, std::shared_ptr<const Entity> entity )
 {
 	EntityValidator validator;
-	MemoryWriteStream wstream;
-	EntityWriter writer( wstream );
+	// use a pooled write stream, which is returned to the pool when the task is done
+	MemoryWriteStreamPool::Handle pooledStream = pThis->WriteStreams.Acquire();
+	MemoryWriteStream &wstream = *pooledStream;
+	EntityWriter writer( wstream, pThis->Settings.StreamFormatFlags );
+
+	// get the type record of the entity
+	const EntityTypeRecord *entityType = pThis->GetEntityTypeRecord( entity.get() );
+	if( !entityType )
+		return std::pair<entity_ref, status>( {}, status::corrupted );
 
 	// make sure the entity is valid
-	if( !entityValidate( pThis->Records, entity.get(), validator ) )
+	if( !entityType->Validate( entity.get(), validator ) )
 		return std::pair<entity_ref, status>( {}, status::corrupted );
 	if( validator.GetErrorCount() > 0 )
 		return std::pair<entity_ref, status>( {}, status::invalid );
 
-	// serialize to a stream
+	// serialize to a stream, with the stream format first if it is not the original format
+	if( pThis->Settings.StreamFormatFlags != sf_none )
+	{
+		if( !writer.Write<u16>( pdsKeyMacro( "StreamFormat" ), pThis->Settings.StreamFormatFlags ) )
+			return std::pair<entity_ref, status>( {}, status::undefined_error );
+	}
 	EntityWriter *sectionWriter = writer.BeginWriteSection( pdsKeyMacro( "EntityFile" ) );
 	if( !sectionWriter )
 		return std::pair<entity_ref, status>( {}, status::undefined_error );
-	sectionWriter->Write<std::string>( pdsKeyMacro( "EntityType" ), entity->EntityTypeString() );
-	if( !entityWrite( pThis->Records, entity.get(), *sectionWriter ) )
+	if( pThis->Settings.WriteEntityTypeIds )
+		sectionWriter->Write<u64>( pdsKeyMacro( "EntityTypeId" ), entityType->EntityTypeId() );
+	else
+		sectionWriter->Write<std::string>( pdsKeyMacro( "EntityType" ), entity->EntityTypeString() );
+	if( !entityType->Write( entity.get(), *sectionWriter ) )
 		return std::pair<entity_ref, status>( {}, status::undefined_error );
 	if( !writer.EndWriteSection( sectionWriter ) )
 		return std::pair<entity_ref, status>( {}, status::undefined_error );
@@ -289,7 +898,7 @@ std::pair<entity_ref, status> EntityManager::WriteTask( EntityManager *pThis, st
 	}
 
 	// transfer into the Entities map 
-	pThis->InsertEntity( entity_ref( digest ), entity );
+	pThis->InsertEntity( entity_ref( digest ), entity, totalBytesToWrite );
 
 	// done
 	return std::pair<entity_ref, status>( entity_ref( digest ), status::ok );
@@ -297,7 +906,9 @@ std::pair<entity_ref, status> EntityManager::WriteTask( EntityManager *pThis, st
 
 std::future<std::pair<entity_ref, status>> EntityManager::AddEntityAsync( const std::shared_ptr<const Entity> &entity )
 {
-	return std::async( WriteTask, this, entity );
+	return this->RunTask<std::pair<entity_ref, status>>( 
+		[this, entity]() { return WriteTask( this, entity ); },
+		[]() { return std::pair<entity_ref, status>( {}, status::not_initialized ); } );
 }
 
 std::pair<entity_ref, status> EntityManager::AddEntity( const std::shared_ptr<const Entity> &entity )
@@ -307,6 +918,32 @@ std::pair<entity_ref, status> EntityManager::AddEntity( const std::shared_ptr<co
 	return futr.get();
 }
 
+std::vector<std::pair<entity_ref, status>> EntityManager::AddEntities( const std::vector<std::shared_ptr<const Entity>> &entities )
+{
+	// queue all adds (blocks while the queue of the pool is full), then wait for them in order
+	std::vector<std::future<std::pair<entity_ref, status>>> futrs;
+	futrs.reserve( entities.size() );
+	for( const std::shared_ptr<const Entity> &entity : entities )
+	{
+		futrs.emplace_back( this->AddEntityAsync( entity ) );
+	}
+
+	std::vector<std::pair<entity_ref, status>> results;
+	results.reserve( entities.size() );
+	for( std::future<std::pair<entity_ref, status>> &futr : futrs )
+	{
+		results.emplace_back( futr.get() );
+	}
+	return results;
+}
+
+std::future<status> EntityManager::RunTaskAsync( const std::function<void()> &task )
+{
+	return this->RunTask<status>( 
+		[task]() { task(); return status::ok; },
+		[]() { return status::not_initialized; } );
+}
+
 #include "_pds_undef_macros.inl"
 }
 // namespace pds
@@ -21,10 +21,43 @@ enum class reader_status
 	success // success, has value
 };
 
+// reads a size or count value from the stream, as written by write_size_value
+// returns false if the value could not be read, or if a variable length integer is not valid
+inline bool read_size_value( MemoryReadStream &sstream, const u16 format_flags, u64 &dest_value )
+{
+	if( !( format_flags & sf_compact_sizes ) )
+	{
+		return ( sstream.Read( &dest_value, 1 ) == 1 );
+	}
+
+	// read 7 bits per byte, lowest bits first, until a byte without the high bit is found. 
+	// a 64 bit value uses at most 10 bytes, where the last byte can only hold the top bit
+	u64 value = 0;
+	for( u64 shift = 0; shift < 64; shift += 7 )
+	{
+		u8 byte = 0;
+		if( sstream.Read( &byte, 1 ) != 1 )
+		{
+			return false;
+		}
+		if( shift == 63 && byte > 1 )
+		{
+			return false;
+		}
+		value |= u64( byte & 0x7f ) << shift;
+		if( !( byte & 0x80 ) )
+		{
+			dest_value = value;
+			return true;
+		}
+	}
+	return false;
+}
+
 // read the header of a large block
 // returns the stream position of the expected end of the block, to validate the read position
 // a stream position of 0 is not possible, and indicates error
-inline u64 begin_read_large_block( MemoryReadStream &sstream, ValueType VT, const char *key, const u8 key_size_in_bytes )
+inline u64 begin_read_large_block( MemoryReadStream &sstream, const u16 format_flags, ValueType VT, const char *key, const u8 key_size_in_bytes )
 {
 	ctSanityCheck( key_size_in_bytes <= EntityMaxKeyLength ); // max key length
 
@@ -38,9 +71,14 @@ inline u64 begin_read_large_block( MemoryReadStream &sstream, ValueType VT, cons
 	}
 
 	// check the size, and calculate expected end position
-	const u64 block_size = sstream.Read<u64>();
+	u64 block_size = 0;
+	if( !read_size_value( sstream, format_flags, block_size ) )
+	{
+		ctLogError << "The block size could not be read from the stream" << ctLogEnd;
+		return 0;
+	}
 	const u64 expected_end_pos = sstream.GetPosition() + block_size;
-	if( expected_end_pos > sstream.GetSize() )
+	if( block_size > sstream.GetSize() || expected_end_pos > sstream.GetSize() )
 	{
 		// not the expected type
 		ctLogError << "The block size:" << block_size << " points beyond the end of the stream size" << ctLogEnd;
@@ -71,6 +109,64 @@ inline u64 begin_read_large_block( MemoryReadStream &sstream, ValueType VT, cons
 	return expected_end_pos;
 }
 
+// skips over the next block in the stream, of any value type, using the size of the block, and checks the key of the block
+// the block must end at or before end_position
+inline bool skip_block( MemoryReadStream &sstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const u64 end_position )
+{
+	ctSanityCheck( key_size_in_bytes <= EntityMaxKeyLength ); // max key length
+
+	// read the size of the block, and find the key of the block. small blocks have the key last in the block, 
+	// and large blocks have the key size and key first in the block
+	const u8 value_type = sstream.Read<u8>();
+	u64 block_size = 0;
+	u64 key_position = 0;
+	if( value_type < 0x40 )
+	{
+		block_size = sstream.Read<u8>();
+		if( block_size < key_size_in_bytes )
+		{
+			ctLogError << "The size of the block in the input stream:" << block_size << " is smaller than the key" << ctLogEnd;
+			return false;
+		}
+		key_position = sstream.GetPosition() + block_size - key_size_in_bytes;
+	}
+	else
+	{
+		if( !read_size_value( sstream, format_flags, block_size ) )
+		{
+			ctLogError << "The block size could not be read from the stream" << ctLogEnd;
+			return false;
+		}
+		key_position = sstream.GetPosition() + 1;
+	}
+
+	const u64 block_end_position = sstream.GetPosition() + block_size;
+	if( block_size > end_position || block_end_position > end_position || key_position + key_size_in_bytes > block_end_position )
+	{
+		ctLogError << "The block size:" << block_size << " points beyond the end of the section" << ctLogEnd;
+		return false;
+	}
+	if( value_type >= 0x40 && sstream.Read<u8>() != key_size_in_bytes )
+	{
+		std::string expected_key_name( key, key_size_in_bytes );
+		ctLogError << "The size of the input key does not match expected size: " << (u32)key_size_in_bytes << " for key: \"" << expected_key_name << "\"" << ctLogEnd;
+		return false;
+	}
+
+	// check the key, and move to the end of the block
+	char read_key[EntityMaxKeyLength];
+	sstream.SetPosition( key_position );
+	if( sstream.Read( (i8 *)read_key, (u64)key_size_in_bytes ) != (u64)key_size_in_bytes
+		|| memcmp( key, read_key, (u64)key_size_in_bytes ) != 0 )
+	{
+		std::string expected_key_name( key, key_size_in_bytes );
+		std::string read_key_name( read_key, key_size_in_bytes );
+		ctLogError << "Unexpected key name in the stream. Expected name: " << expected_key_name << " read name: " << read_key_name << ctLogEnd;
+		return false;
+	}
+	return sstream.SetPosition( block_end_position );
+}
+
 // ends the block, write the size of the block
 inline bool end_read_large_block( MemoryReadStream &sstream, u64 expected_end_pos )
 {
@@ -80,7 +176,7 @@ inline bool end_read_large_block( MemoryReadStream &sstream, u64 expected_end_po
 
 // template method that Reads a small block of a specific ValueType VT to the stream. Since most value types 
 // can have different bit depths, the second parameter I is the actual type of the data stored. The data can have more than one values of type I, the count is stored in IC.
-template<ValueType VT, class T> inline reader_status read_single_item( MemoryReadStream &sstream, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, T *dest_data )
+template<ValueType VT, class T> inline reader_status read_single_item( MemoryReadStream &sstream, const u16 /*format_flags*/, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, T *dest_data )
 {
 	static_assert( ( VT >= ValueType::VT_Bool ) && ( VT <= ValueType::VT_Hash ), "Invalid type for generic template of read_single_item" );
 
@@ -170,10 +266,10 @@ template<ValueType VT, class T> inline reader_status read_single_item( MemoryRea
 };
 
 // special implementation of read_small_block for bool values, which reads a u8 and converts to bool
-template<> inline reader_status read_single_item<ValueType::VT_Bool, bool>( MemoryReadStream &sstream, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, bool *dest_data )
+template<> inline reader_status read_single_item<ValueType::VT_Bool, bool>( MemoryReadStream &sstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, bool *dest_data )
 {
 	u8 u8val;
-	reader_status status = read_single_item<ValueType::VT_Bool, u8>( sstream, key, key_size_in_bytes, empty_value_is_allowed, &u8val );
+	reader_status status = read_single_item<ValueType::VT_Bool, u8>( sstream, format_flags, key, key_size_in_bytes, empty_value_is_allowed, &u8val );
 	if( status != reader_status::fail )
 	{
 		( *dest_data ) = (bool)u8val;
@@ -183,14 +279,14 @@ template<> inline reader_status read_single_item<ValueType::VT_Bool, bool>( Memo
 
 // template method that Reads a small block of a specific ValueType VT to the stream. Since most value types 
 // can have different bit depths, the second parameter I is the actual type of the data stored. The data can have more than one values of type I, the count is stored in IC.
-template<> inline reader_status read_single_item<ValueType::VT_String, string>( MemoryReadStream &sstream, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, string *dest_data )
+template<> inline reader_status read_single_item<ValueType::VT_String, string>( MemoryReadStream &sstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, string *dest_data )
 {
 	static_assert( sizeof( u64 ) == sizeof( size_t ), "Unsupported size_t, current code requires it to be 8 bytes in size, equal to u64" );
 
 	ctSanityCheck( dest_data );
 
 	// read block header
-	const u64 expected_end_position = begin_read_large_block( sstream, ValueType::VT_String, key, key_size_in_bytes );
+	const u64 expected_end_position = begin_read_large_block( sstream, format_flags, ValueType::VT_String, key, key_size_in_bytes );
 	if( expected_end_position == 0 )
 	{
 		ctLogError << "begin_read_large_block() failed unexpectedly" << ctLogEnd;
@@ -222,9 +318,19 @@ template<> inline reader_status read_single_item<ValueType::VT_String, string>(
 	}
 
 	// non-empty, read in the string size
-	const u64 string_size = sstream.Read<u64>();
+	u64 string_size = 0;
+	if( !read_size_value( sstream, format_flags, string_size ) )
+	{
+		ctLogError << "The string size could not be read from the stream" << ctLogEnd;
+		return reader_status::fail;
+	}
 
 	// make sure the item count is plausible before allocating the vector
+	if( sstream.GetPosition() > expected_end_position )
+	{
+		ctLogError << "The string size in the stream is invalid, it is beyond the size of the value block" << ctLogEnd;
+		return reader_status::fail;
+	}
 	const u64 expected_string_size = ( expected_end_position - sstream.GetPosition() );
 	if( string_size > expected_string_size )
 	{
@@ -281,14 +387,30 @@ inline reader_status end_read_empty_large_block( MemoryReadStream &sstream, cons
 }
 
 // reads an array header and value size from the stream, and decodes into flags, then reads the index if one exists. 
-inline bool read_array_metadata_and_index( MemoryReadStream &sstream, size_t &out_per_item_size, size_t &out_item_count, const u64 block_end_position, std::vector<i32> *dest_index )
+inline bool read_array_metadata_and_index( MemoryReadStream &sstream, const u16 format_flags, size_t &out_per_item_size, size_t &out_item_count, const u64 block_end_position, std::vector<i32> *dest_index )
 {
 	static_assert( sizeof( u64 ) <= sizeof( size_t ), "Unsupported size_t, current code requires it to be at least 8 bytes in size, equal to u64" );
 
 	const u64 start_position = sstream.GetPosition();
-	u64 expected_end_position = start_position + sizeof( u16 ) + sizeof( u64 );
 
-	const u16 array_flags = sstream.Read<u16>();
+	// read the flags, which is a variable length integer in the compact sizes format
+	u16 array_flags = 0;
+	u64 flags_size = sizeof( u16 );
+	if( format_flags & sf_compact_sizes )
+	{
+		u64 flags_value = 0;
+		if( !read_size_value( sstream, format_flags, flags_value ) || flags_value > 0xffff )
+		{
+			ctLogError << "The array flags in the stream are invalid" << ctLogEnd;
+			return false;
+		}
+		array_flags = u16( flags_value );
+		flags_size = sstream.GetPosition() - start_position;
+	}
+	else
+	{
+		array_flags = sstream.Read<u16>();
+	}
 	out_per_item_size = (size_t)( array_flags & 0xff );
 	const bool has_index = ( array_flags & 0x100 ) != 0;
 	const bool index_is_64bit = ( array_flags & 0x200 ) != 0;
@@ -301,7 +423,15 @@ inline bool read_array_metadata_and_index( MemoryReadStream &sstream, size_t &ou
 	}
 
 	// read in the item count
-	out_item_count = (size_t)sstream.Read<u64>();
+	const u64 item_count_position = sstream.GetPosition();
+	u64 item_count = 0;
+	if( !read_size_value( sstream, format_flags, item_count ) )
+	{
+		ctLogError << "The array item count could not be read from the stream" << ctLogEnd;
+		return false;
+	}
+	out_item_count = (size_t)item_count;
+	u64 expected_end_position = start_position + flags_size + ( sstream.GetPosition() - item_count_position );
 
 	// if we have an index, read it
 	if( has_index )
@@ -315,7 +445,14 @@ inline bool read_array_metadata_and_index( MemoryReadStream &sstream, size_t &ou
 
 		// read in the size of the index
 		ctSanityCheck( block_end_position >= sstream.GetPosition() );
-		const u64 index_count = sstream.Read<u64>();
+		const u64 index_count_position = sstream.GetPosition();
+		u64 index_count = 0;
+		if( !read_size_value( sstream, format_flags, index_count ) || sstream.GetPosition() > block_end_position )
+		{
+			ctLogError << "The index item count could not be read from the block" << ctLogEnd;
+			return false;
+		}
+		const u64 index_count_size = sstream.GetPosition() - index_count_position;
 		const u64 maximum_possible_index_count = ( block_end_position - sstream.GetPosition() ) / sizeof( u32 );
 		if( index_count > maximum_possible_index_count )
 		{
@@ -331,7 +468,7 @@ inline bool read_array_metadata_and_index( MemoryReadStream &sstream, size_t &ou
 		sstream.Read( p_index_data, index_count );
 
 		// modify the expected end position
-		expected_end_position += sizeof( u64 ) + ( index_count * sizeof( i32 ) );
+		expected_end_position += index_count_size + ( index_count * sizeof( i32 ) );
 	}
 	else
 	{
@@ -352,7 +489,7 @@ inline bool read_array_metadata_and_index( MemoryReadStream &sstream, size_t &ou
 	return true;
 }
 
-template<ValueType VT, class T> inline reader_status read_array( MemoryReadStream &sstream, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, std::vector<T> *dest_items, std::vector<i32> *dest_index )
+template<ValueType VT, class T> inline reader_status read_array( MemoryReadStream &sstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, std::vector<T> *dest_items, std::vector<i32> *dest_index )
 {
 	static_assert( ( VT >= ValueType::VT_Array_Bool ) && ( VT <= ValueType::VT_Array_Hash ), "Invalid type for generic read_array template" );
 	static_assert( sizeof( u64 ) >= sizeof( size_t ), "Unsupported size_t, current code requires it to be at max 8 bytes in size, equal to u64" );
@@ -361,7 +498,7 @@ template<ValueType VT, class T> inline reader_status read_array( MemoryReadStrea
 	ctSanityCheck( dest_items );
 
 	// read block header. if we are already at the end, the block is empty, end the block and make sure empty is allowed
-	const u64 block_end_position = begin_read_large_block( sstream, VT, key, key_size_in_bytes );
+	const u64 block_end_position = begin_read_large_block( sstream, format_flags, VT, key, key_size_in_bytes );
 	if( block_end_position == 0 )
 	{
 		ctLogError << "begin_read_large_block() failed unexpectedly" << ctLogEnd;
@@ -375,7 +512,7 @@ template<ValueType VT, class T> inline reader_status read_array( MemoryReadStrea
 	// read item size & count and index if it exists, or make sure we do not expect an index
 	size_t per_item_size = 0;
 	size_t item_count = 0;
-	if( !read_array_metadata_and_index( sstream, per_item_size, item_count, block_end_position, dest_index ) )
+	if( !read_array_metadata_and_index( sstream, format_flags, per_item_size, item_count, block_end_position, dest_index ) )
 	{
 		return reader_status::fail;
 	}
@@ -419,12 +556,12 @@ template<ValueType VT, class T> inline reader_status read_array( MemoryReadStrea
 }
 
 // read_array implementation for bool arrays (which need specific packing)
-template <> inline reader_status read_array<ValueType::VT_Array_Bool, bool>( MemoryReadStream &sstream, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, std::vector<bool> *dest_items, std::vector<i32> *dest_index )
+template <> inline reader_status read_array<ValueType::VT_Array_Bool, bool>( MemoryReadStream &sstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, std::vector<bool> *dest_items, std::vector<i32> *dest_index )
 {
 	ctSanityCheck( dest_items );
 
 	// read block header. if we are already at the end, the block is empty, end the block and make sure empty is allowed
-	const u64 block_end_position = begin_read_large_block( sstream, ValueType::VT_Array_Bool, key, key_size_in_bytes );
+	const u64 block_end_position = begin_read_large_block( sstream, format_flags, ValueType::VT_Array_Bool, key, key_size_in_bytes );
 	if( block_end_position == 0 )
 	{
 		ctLogError << "begin_read_large_block() failed unexpectedly" << ctLogEnd;
@@ -438,7 +575,7 @@ template <> inline reader_status read_array<ValueType::VT_Array_Bool, bool>( Mem
 	// read item size & count and index if it exists, or make sure we do not expect an index
 	size_t per_item_size = 0;
 	size_t bool_count = 0;
-	if( !read_array_metadata_and_index( sstream, per_item_size, bool_count, block_end_position, dest_index ) )
+	if( !read_array_metadata_and_index( sstream, format_flags, per_item_size, bool_count, block_end_position, dest_index ) )
 	{
 		return reader_status::fail;
 	}
@@ -480,14 +617,14 @@ template <> inline reader_status read_array<ValueType::VT_Array_Bool, bool>( Mem
 	return reader_status::success;
 }
 
-template<> inline reader_status read_array<ValueType::VT_Array_String, string>( MemoryReadStream &sstream, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, std::vector<string> *dest_items, std::vector<i32> *dest_index )
+template<> inline reader_status read_array<ValueType::VT_Array_String, string>( MemoryReadStream &sstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const bool empty_value_is_allowed, std::vector<string> *dest_items, std::vector<i32> *dest_index )
 {
 	static_assert( sizeof( u64 ) == sizeof( size_t ), "Unsupported size_t, current code requires it to be 8 bytes in size, equal to u64" );
 
 	ctSanityCheck( dest_items );
 
 	// read block header. if we are already at the end, the block is empty, end the block and make sure empty is allowed
-	const u64 block_end_position = begin_read_large_block( sstream, ValueType::VT_Array_String, key, key_size_in_bytes );
+	const u64 block_end_position = begin_read_large_block( sstream, format_flags, ValueType::VT_Array_String, key, key_size_in_bytes );
 	if( block_end_position == 0 )
 	{
 		ctLogError << "begin_read_large_block() failed unexpectedly" << ctLogEnd;
@@ -501,14 +638,15 @@ template<> inline reader_status read_array<ValueType::VT_Array_String, string>(
 	// read item size & count and index if it exists, or make sure we do not expect an index
 	size_t per_item_size = 0;
 	size_t string_count = 0;
-	if( !read_array_metadata_and_index( sstream, per_item_size, string_count, block_end_position, dest_index ) )
+	if( !read_array_metadata_and_index( sstream, format_flags, per_item_size, string_count, block_end_position, dest_index ) )
 	{
 		return reader_status::fail;
 	}
 
 	// make sure the item count is plausible before allocating the vector
-	// (the size is assuming only empty strings, so only the size of the string size (sizeof(u64)) per string)
-	const u64 maximum_possible_item_count = ( block_end_position - sstream.GetPosition() ) / sizeof( u64 );
+	// (the size is assuming only empty strings, so only the size of the string size (sizeof(u64), or at least one byte if compact) per string)
+	const u64 minimum_string_size = ( format_flags & sf_compact_sizes ) ? 1 : sizeof( u64 );
+	const u64 maximum_possible_item_count = ( block_end_position - sstream.GetPosition() ) / minimum_string_size;
 	if( string_count > maximum_possible_item_count )
 	{
 		ctLogError << "The array string count in the stream is invalid, it is beyond the size of the block" << ctLogEnd;
@@ -523,7 +661,12 @@ template<> inline reader_status read_array<ValueType::VT_Array_String, string>(
 	{
 		string &dest_string = ( *dest_items )[string_index];
 
-		const u64 string_size = sstream.Read<u64>();
+		u64 string_size = 0;
+		if( !read_size_value( sstream, format_flags, string_size ) || sstream.GetPosition() > block_end_position )
+		{
+			ctLogError << "A string size in a string array could not be read from the block" << ctLogEnd;
+			return reader_status::fail;
+		}
 
 		// make sure the string is not outsize of possible size
 		const u64 maximum_possible_string_size = ( block_end_position - sstream.GetPosition() );
@@ -557,9 +700,177 @@ template<> inline reader_status read_array<ValueType::VT_Array_String, string>(
 	return reader_status::success;
 }
 
-EntityReader::EntityReader( MemoryReadStream &_sstream ) : sstream( _sstream ), end_position( _sstream.GetSize() ) {}
+EntityReader::EntityReader( MemoryReadStream &_sstream ) : sstream( _sstream ), end_position( _sstream.GetSize() ), format_flags( sf_none ) {}
 
-EntityReader::EntityReader( MemoryReadStream &_sstream, const u64 _end_position ) : sstream( _sstream ), end_position( _end_position ) {}
+EntityReader::EntityReader( MemoryReadStream &_sstream, const u64 _end_position ) : sstream( _sstream ), end_position( _end_position ), format_flags( sf_none ) {}
+
+EntityReader::EntityReader( MemoryReadStream &_sstream, const u64 _end_position, const u16 _format_flags ) : sstream( _sstream ), end_position( _end_position ), format_flags( _format_flags ) {}
+
+// set up the reader to read the values of a section, which starts at _section_data_position and ends at _section_end_position
+void EntityReader::BeginSectionData( const u64 _section_data_position, const u64 _section_end_position )
+{
+	this->section_data_position = _section_data_position;
+	this->section_end_position = _section_end_position;
+	this->table_of_contents_is_loaded = false;
+	this->table_of_contents.clear();
+}
+
+// load the table of contents from the end of the section, the read position of the stream is not changed
+bool EntityReader::LoadTableOfContents()
+{
+	if( this->table_of_contents_is_loaded )
+	{
+		return true;
+	}
+	if( !( this->format_flags & sf_section_toc ) || this->section_data_position == 0 )
+	{
+		ctLogError << "The reader does not read a section with a table of contents" << ctLogEnd;
+		return false;
+	}
+	if( this->section_end_position < this->section_data_position + sizeof( u64 ) )
+	{
+		ctLogError << "The section is too small to have a table of contents, the stream is probably corrupted" << ctLogEnd;
+		return false;
+	}
+
+	const u64 read_position = this->sstream.GetPosition();
+	const u64 table_end_position = this->section_end_position - sizeof( u64 );
+
+	// read the offset of the table, from the end of the section
+	this->sstream.SetPosition( table_end_position );
+	const u64 table_offset = this->sstream.Read<u64>();
+	if( table_offset > ( table_end_position - this->section_data_position ) )
+	{
+		ctLogError << "The table of contents offset is beyond the end of the section, the stream is probably corrupted" << ctLogEnd;
+		this->sstream.SetPosition( read_position );
+		return false;
+	}
+	this->sstream.SetPosition( this->section_data_position + table_offset );
+
+	// read the entries, each entry is at least an offset and a key length
+	u64 entry_count = 0;
+	bool is_valid = read_size_value( this->sstream, this->format_flags, entry_count )
+		&& this->sstream.GetPosition() <= table_end_position
+		&& entry_count <= ( table_end_position - this->sstream.GetPosition() ) / 2;
+	std::vector<std::pair<std::string, u64>> entries;
+	if( is_valid )
+	{
+		entries.resize( entry_count );
+	}
+	for( u64 entry_index = 0; is_valid && entry_index < entry_count; ++entry_index )
+	{
+		u64 value_offset = 0;
+		char key[EntityMaxKeyLength];
+		const bool has_offset = read_size_value( this->sstream, this->format_flags, value_offset ) && value_offset < table_offset;
+		const u8 key_length = this->sstream.Read<u8>();
+		is_valid = has_offset
+			&& key_length <= EntityMaxKeyLength
+			&& this->sstream.Read( (i8 *)key, key_length ) == key_length;
+		if( is_valid )
+		{
+			entries[entry_index] = std::pair<std::string, u64>( std::string( key, key_length ), value_offset );
+		}
+	}
+	is_valid = is_valid && ( this->sstream.GetPosition() == table_end_position );
+
+	this->sstream.SetPosition( read_position );
+	if( !is_valid )
+	{
+		ctLogError << "The table of contents of the section is invalid, the stream is probably corrupted" << ctLogEnd;
+		return false;
+	}
+
+	this->table_of_contents = std::move( entries );
+	this->table_of_contents_is_loaded = true;
+	return true;
+}
+
+bool EntityReader::SeekToValue( const char *key, const u8 key_length )
+{
+	if( this->active_subsection )
+	{
+		ctLogError << "Cannot seek while there is an active subsection." << ctLogEnd;
+		return false;
+	}
+	if( !this->LoadTableOfContents() )
+	{
+		return false;
+	}
+
+	// seek to the first value with the key
+	for( const auto &entry : this->table_of_contents )
+	{
+		if( entry.first.size() == key_length && memcmp( entry.first.data(), key, key_length ) == 0 )
+		{
+			return this->sstream.SetPosition( this->section_data_position + entry.second );
+		}
+	}
+	return false;
+}
+
+// Seek to a field of a generated item
+bool EntityReader::SeekToValue( const char *key, const u8 key_length, const u8 field_id )
+{
+	if( this->format_flags & sf_compact_keys )
+	{
+		const char field_key[2] = { (char)field_id, 0 }; // zero terminated, as keys are logged as strings
+		return this->SeekToValue( field_key, 1 );
+	}
+	return this->SeekToValue( key, key_length );
+}
+
+bool EntityReader::SkipValue( const char *key, const u8 key_length )
+{
+	if( this->active_subsection )
+	{
+		ctLogError << "Cannot skip a value while there is an active subsection." << ctLogEnd;
+		return false;
+	}
+	// the block must be inside the current section (which is a section in an array, if reading one)
+	const u64 block_end_limit = ( this->section_end_position != 0 ) ? this->section_end_position : this->end_position;
+	return skip_block( this->sstream, this->format_flags, key, key_length, block_end_limit );
+}
+
+// Skip a field of a generated item
+bool EntityReader::SkipValue( const char *key, const u8 key_length, const u8 field_id )
+{
+	if( this->format_flags & sf_compact_keys )
+	{
+		const char field_key[2] = { (char)field_id, 0 }; // zero terminated, as keys are logged as strings
+		return this->SkipValue( field_key, 1 );
+	}
+	return this->SkipValue( key, key_length );
+}
+
+bool EntityReader::GetFlipByteOrder() const
+{
+	return this->sstream.GetFlipByteOrder();
+}
+
+bool EntityReader::ReadRawData( std::vector<u8> &dest )
+{
+	if( this->active_subsection )
+	{
+		ctLogError << "Cannot read raw data while there is an active subsection." << ctLogEnd;
+		return false;
+	}
+	const u64 data_end_position = ( this->section_end_position != 0 ) ? this->section_end_position : this->end_position;
+	const u64 start_position = this->sstream.GetPosition();
+	if( data_end_position < start_position || data_end_position > this->sstream.GetSize() )
+	{
+		ctLogError << "The end of the section is outside the stream, the stream is probably corrupted" << ctLogEnd;
+		return false;
+	}
+
+	const u64 data_size = data_end_position - start_position;
+	dest.resize( (size_t)data_size );
+	if( data_size > 0 && this->sstream.Read( dest.data(), data_size ) != data_size )
+	{
+		ctLogError << "Could not read the raw data of the section" << ctLogEnd;
+		return false;
+	}
+	return true;
+}
 
 // Read a section. 
 // If the section is null, the section is directly closed, nullptr+success is returned 
@@ -573,7 +884,7 @@ std::tuple<EntityReader *, bool> EntityReader::BeginReadSection( const char *key
 	}
 
 	// read block header
-	const u64 end_of_section = begin_read_large_block( sstream, ValueType::VT_Subsection, key, key_length );
+	const u64 end_of_section = begin_read_large_block( sstream, this->format_flags, ValueType::VT_Subsection, key, key_length );
 	if( end_of_section == 0 )
 	{
 		ctLogError << "begin_read_large_block() failed unexpectedly, stream is probably corrupted" << ctLogEnd;
@@ -589,10 +900,22 @@ std::tuple<EntityReader *, bool> EntityReader::BeginReadSection( const char *key
 	}
 
 	// allocate the subsection and return it to the caller to be used to read items in the subsection
-	this->active_subsection = std::unique_ptr<EntityReader>( new EntityReader( this->sstream, end_of_section ) );
+	this->active_subsection = std::unique_ptr<EntityReader>( new EntityReader( this->sstream, end_of_section, this->format_flags ) );
+	this->active_subsection->BeginSectionData( this->sstream.GetPosition(), end_of_section );
 	return std::tuple<EntityReader *, bool>( this->active_subsection.get(), true );
 }
 
+// Read a section of a field of a generated item
+std::tuple<EntityReader *, bool> EntityReader::BeginReadSection( const char *key, const u8 key_length, const u8 field_id, const bool null_section_is_allowed )
+{
+	if( this->format_flags & sf_compact_keys )
+	{
+		const char field_key[2] = { (char)field_id, 0 }; // zero terminated, as keys are logged as strings
+		return this->BeginReadSection( field_key, 1, null_section_is_allowed );
+	}
+	return this->BeginReadSection( key, key_length, null_section_is_allowed );
+}
+
 bool EntityReader::EndReadSection( const EntityReader *section_reader )
 {
 	if( section_reader != this->active_subsection.get() )
@@ -601,6 +924,12 @@ bool EntityReader::EndReadSection( const EntityReader *section_reader )
 		return false;
 	}
 
+	// with a table of contents, the values can be read out of order, and the table is skipped over
+	if( this->format_flags & sf_section_toc )
+	{
+		this->sstream.SetPosition( this->active_subsection->end_position );
+	}
+
 	if( !end_read_large_block( this->sstream, this->active_subsection->end_position ) )
 	{
 		ctLogError << "end_read_large_block failed unexpectedly, the stream is probably corrupted." << ctLogEnd;
@@ -624,7 +953,7 @@ std::tuple<EntityReader *, size_t, bool> EntityReader::BeginReadSectionsArray( c
 	}
 
 	// read block header. if we are already at the end, the block is empty, end the block and make sure empty is allowed
-	const u64 end_of_section = begin_read_large_block( sstream, ValueType::VT_Array_Subsection, key, key_length );
+	const u64 end_of_section = begin_read_large_block( sstream, this->format_flags, ValueType::VT_Array_Subsection, key, key_length );
 	if( end_of_section == 0 )
 	{
 		ctLogError << "begin_read_large_block() failed unexpectedly, stream is probably corrupted" << ctLogEnd;
@@ -641,14 +970,14 @@ std::tuple<EntityReader *, size_t, bool> EntityReader::BeginReadSectionsArray( c
 
 	// read item size & count and index if it exists, or make sure we do not expect an index
 	size_t per_item_size = 0;
-	if( !read_array_metadata_and_index( sstream, per_item_size, this->active_subsection_array_size, end_of_section, dest_index ) )
+	if( !read_array_metadata_and_index( sstream, this->format_flags, per_item_size, this->active_subsection_array_size, end_of_section, dest_index ) )
 	{
 		return std::tuple<EntityReader *, size_t, bool>( nullptr, 0, false );
 	}
 	this->active_subsection_index = size_t( ~0 );
 
 	// allocate the subsection and return it to the caller to be used to read items in the subsection
-	this->active_subsection = std::unique_ptr<EntityReader>( new EntityReader( this->sstream, end_of_section ) );
+	this->active_subsection = std::unique_ptr<EntityReader>( new EntityReader( this->sstream, end_of_section, this->format_flags ) );
 	return std::tuple<EntityReader *, size_t, bool>( this->active_subsection.get(), this->active_subsection_array_size, true );
 }
 
@@ -671,8 +1000,16 @@ bool EntityReader::BeginReadSectionInArray( const EntityReader *sections_array_r
 	}
 
 	this->active_subsection_index = section_index;
-	const u64 section_size = sstream.Read<u64>();
+	u64 section_size = 0;
+	if( !read_size_value( this->sstream, this->format_flags, section_size )
+		|| sstream.GetPosition() > this->active_subsection->end_position
+		|| section_size > ( this->active_subsection->end_position - sstream.GetPosition() ) )
+	{
+		ctLogError << "The size of the section in the array is invalid, it is beyond the size of the array" << ctLogEnd;
+		return false;
+	}
 	this->active_subsection_end_pos = sstream.GetPosition() + section_size;
+	this->active_subsection->BeginSectionData( sstream.GetPosition(), this->active_subsection_end_pos );
 
 	if( dest_section_has_data == nullptr )
 	{
@@ -699,6 +1036,12 @@ bool EntityReader::EndReadSectionInArray( const EntityReader *sections_array_rea
 		return false;
 	}
 
+	// with a table of contents, the values can be read out of order, and the table is skipped over
+	if( this->format_flags & sf_section_toc )
+	{
+		this->sstream.SetPosition( this->active_subsection_end_pos );
+	}
+
 	const u64 end_pos = sstream.GetPosition();
 
 	if( end_pos != this->active_subsection_end_pos )
@@ -9,46 +9,181 @@ namespace pds
 {
 #include "_pds_macros.inl"
 
+// returns the number of bytes used by a size or count value in the stream
+inline u64 size_value_byte_count( const u16 format_flags, u64 value )
+{
+	if( !( format_flags & sf_compact_sizes ) )
+	{
+		return sizeof( u64 );
+	}
+
+	// a variable length integer stores 7 bits per byte
+	u64 byte_count = 1;
+	while( value >= 0x80 )
+	{
+		value >>= 7;
+		++byte_count;
+	}
+	return byte_count;
+}
+
+// writes a size or count value to the stream. in the compact sizes format, the value is written as a variable length integer, 
+// 7 bits per byte with the lowest bits first, and the high bit set on all bytes except the last. otherwise it is written as an u64.
+inline void write_size_value( MemoryWriteStream &dstream, const u16 format_flags, u64 value )
+{
+	if( !( format_flags & sf_compact_sizes ) )
+	{
+		dstream.Write( value );
+		return;
+	}
+
+	u8 bytes[10];
+	u64 byte_count = 0;
+	do
+	{
+		bytes[byte_count] = u8( value & 0x7f );
+		value >>= 7;
+		if( value )
+		{
+			bytes[byte_count] |= 0x80;
+		}
+		++byte_count;
+	} while( value );
+	dstream.Write( bytes, byte_count );
+}
+
+// the number of bytes reserved for a size value which is not known until the data after it has been written. in the compact
+// sizes format, 4 varint bytes hold sizes up to 256MB, larger sizes move the data forward to make room for the extra bytes
+inline u64 reserved_size_value_byte_count( const u16 format_flags )
+{
+	return ( format_flags & sf_compact_sizes ) ? 4 : sizeof( u64 );
+}
+
+// writes a size value padded to byte_count bytes. in the compact sizes format, the varint is padded with zero bits in bytes which 
+// have the high bit set, which the reader decodes as the same value. byte_count must be at least size_value_byte_count of the value
+inline void write_padded_size_value( MemoryWriteStream &dstream, const u16 format_flags, u64 value, const u64 byte_count )
+{
+	if( !( format_flags & sf_compact_sizes ) )
+	{
+		dstream.Write( value );
+		return;
+	}
+
+	ctSanityCheck( byte_count >= size_value_byte_count( format_flags, value ) && byte_count <= 10 );
+	u8 bytes[10];
+	for( u64 byte_index = 0; byte_index < byte_count; ++byte_index )
+	{
+		bytes[byte_index] = u8( value & 0x7f );
+		value >>= 7;
+		if( byte_index + 1 < byte_count )
+		{
+			bytes[byte_index] |= 0x80;
+		}
+	}
+	dstream.Write( bytes, byte_count );
+}
+
+// reserves space for a size value which is not known until the data after it has been written, returns the number of bytes reserved.
+inline u64 begin_reserved_size_value( MemoryWriteStream &dstream, const u16 format_flags )
+{
+	// write empty stand in value for now (INT64_MAX, or unterminated varint bytes, on purpose), which is definitely 
+	// wrong, as to trigger any test if the value is not overwritten with the correct value
+	const u64 reserved_size = reserved_size_value_byte_count( format_flags );
+	if( format_flags & sf_compact_sizes )
+	{
+		const u8 stand_in[4] = { 0xff, 0xff, 0xff, 0xff };
+		dstream.Write( stand_in, reserved_size );
+		return reserved_size;
+	}
+	dstream.Write( (u64)INT64_MAX );
+	return reserved_size;
+}
 
-// called to begin a large block
-// returns the stream position of the start of the block, to be used when writing the size when ending the block
-inline bool begin_write_large_block( MemoryWriteStream &dstream, ValueType VT, const char *key, const u8 key_size_in_bytes )
+// writes the size of the data from the end of the reservation at reserved_pos up to the current position, into the reservation
+inline bool end_reserved_size_value( MemoryWriteStream &dstream, const u16 format_flags, const u64 reserved_pos )
+{
+	const u64 reserved_size = reserved_size_value_byte_count( format_flags );
+	if( dstream.GetPosition() < reserved_pos + reserved_size )
+	{
+		return false;
+	}
+	const u64 data_size = dstream.GetPosition() - reserved_pos - reserved_size;
+
+	// if the size does not fit in the reservation, move the data forward to make room for it
+	u64 size_byte_count = size_value_byte_count( format_flags, data_size );
+	if( size_byte_count > reserved_size )
+	{
+		dstream.Insert( reserved_pos + reserved_size, size_byte_count - reserved_size );
+	}
+	else
+	{
+		size_byte_count = reserved_size;
+	}
+
+	const u64 end_pos = dstream.GetPosition();
+	dstream.SetPosition( reserved_pos );
+	write_padded_size_value( dstream, format_flags, data_size, size_byte_count );
+	dstream.SetPosition( end_pos ); // move back the where we were
+	return true;
+}
+
+// called to begin a large block, where the size of the block is not known until the block ends
+inline bool begin_write_large_block( MemoryWriteStream &dstream, const u16 format_flags, ValueType VT, const char *key, const u8 key_size_in_bytes )
+{
+	const u8 value_type = (u8)VT;
+	const u64 start_pos = dstream.GetPosition();
+	ctSanityCheck( key_size_in_bytes <= EntityMaxKeyLength );
+
+	// write block header, with a reserved size value which is written when the block ends
+	dstream.Write( value_type );
+	const u64 reserved_size = begin_reserved_size_value( dstream, format_flags );
+	dstream.Write( key_size_in_bytes );
+	dstream.Write( (i8 *)key, key_size_in_bytes );
+
+	// sizeof(value_type)=1 + reserved_size + sizeof(key_size_in_bytes)=1 + key_size_in_bytes;
+	const u64 expected_end_pos = start_pos + reserved_size + key_size_in_bytes + 2;
+
+	const u64 end_pos = dstream.GetPosition();
+	ctSanityCheck( end_pos == expected_end_pos );
+	return ( end_pos == expected_end_pos );
+}
+
+// called to begin a large block, where the size of the data of the block (data_size) is known before it is written. 
+// the size is written directly, so the block is not ended with end_write_large_block
+inline bool begin_write_large_block( MemoryWriteStream &dstream, const u16 format_flags, ValueType VT, const char *key, const u8 key_size_in_bytes, const u64 data_size )
 {
 	const u8 value_type = (u8)VT;
 	const u64 start_pos = dstream.GetPosition();
 	ctSanityCheck( key_size_in_bytes <= EntityMaxKeyLength );
 
-	// sizeof(value_type)=1 + sizeof(block_size)=8 + sizeof(key_size_in_bytes)=1 + key_size_in_bytes;
-	const u64 expected_end_pos = start_pos + key_size_in_bytes + 10;
+	// the block size includes the key and the key size
+	const u64 block_size = data_size + key_size_in_bytes + 1;
 
-	// write block header 
-	// write empty stand in value for now (INT64_MAX on purpose), which is definitely 
-	// wrong, as to trigger any test if the value is not overwritten with the correct value
+	// write block header
 	dstream.Write( value_type );
-	dstream.Write( (u64)INT64_MAX );
+	write_size_value( dstream, format_flags, block_size );
 	dstream.Write( key_size_in_bytes );
 	dstream.Write( (i8 *)key, key_size_in_bytes );
 
+	// sizeof(value_type)=1 + size value + sizeof(key_size_in_bytes)=1 + key_size_in_bytes;
+	const u64 expected_end_pos = start_pos + size_value_byte_count( format_flags, block_size ) + key_size_in_bytes + 2;
+
 	const u64 end_pos = dstream.GetPosition();
 	ctSanityCheck( end_pos == expected_end_pos );
 	return ( end_pos == expected_end_pos );
 }
 
 // ends the block
-// writes the size of the block in the header of the block
-inline bool end_write_large_block( MemoryWriteStream &dstream, u64 start_pos )
+// writes the size of the block in the header of the block. note that in the compact sizes format, the data 
+// of the block is moved forward in the stream if the size needs more bytes than were reserved
+inline bool end_write_large_block( MemoryWriteStream &dstream, const u16 format_flags, u64 start_pos )
 {
-	const u64 end_pos = dstream.GetPosition();
-	const u64 block_size = end_pos - start_pos - 9; // total block size - ( sizeof( valuetype )=1 + sizeof( block_size_variable )=8 )
-	dstream.SetPosition( start_pos + 1 ); // skip over the valuetype
-	dstream.Write( block_size );
-	dstream.SetPosition( end_pos ); // move back the where we were
-	return ( end_pos > start_pos ); // only thing we really can check
+	return end_reserved_size_value( dstream, format_flags, start_pos + 1 ); // skip over the valuetype
 }
 
 // template method that writes a small block of a specific ValueType VT to the stream. Since most value types 
 // can have different bit depths, the second parameter I is the actual type of the data stored. The data can have more than one values of type I, the count is stored in IC.
-template<ValueType VT, class T> inline bool write_single_value( MemoryWriteStream &dstream, const char *key, const u8 key_length, const T *data )
+template<ValueType VT, class T> inline bool write_single_value( MemoryWriteStream &dstream, const u16 /*format_flags*/, const char *key, const u8 key_length, const T *data )
 {
 	static_assert( ( VT >= ValueType::VT_Bool ) && ( VT <= ValueType::VT_Hash ), "Invalid type for general write_single_value template" );
 
@@ -79,63 +214,47 @@ template<ValueType VT, class T> inline bool write_single_value( MemoryWriteStrea
 };
 
 // specialization of write_single_value for bool values, which need conversion to u8
-template<> inline bool write_single_value<ValueType::VT_Bool, bool>( MemoryWriteStream &dstream, const char *key, const u8 key_length, const bool *data )
+template<> inline bool write_single_value<ValueType::VT_Bool, bool>( MemoryWriteStream &dstream, const u16 format_flags, const char *key, const u8 key_length, const bool *data )
 {
 	// if data is set, convert to an u8 value, and point at it
 	const u8 u8val = ( data ) ? ( (u8)( *data ) ) : 0;
 	const u8 *p_data = ( data ) ? ( &u8val ) : nullptr;
-	return write_single_value<ValueType::VT_Bool, u8>( dstream, key, key_length, p_data );
+	return write_single_value<ValueType::VT_Bool, u8>( dstream, format_flags, key, key_length, p_data );
 }
 
 // specialization of write_single_value for strings
-template<> inline bool write_single_value<ValueType::VT_String, std::string>( MemoryWriteStream &dstream, const char *key, const u8 key_size_in_bytes, const std::string *string_value )
+template<> inline bool write_single_value<ValueType::VT_String, std::string>( MemoryWriteStream &dstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const std::string *string_value )
 {
-	// record start position, we need this in the end block
-	const u64 start_pos = dstream.GetPosition();
+	// the size of the string data is known up front (an empty value, which is not the same as an empty string, has no data)
+	const u64 character_count = ( string_value ) ? u64( string_value->size() ) : 0;
+	const u64 values_size = ( string_value ) ? ( character_count + size_value_byte_count( format_flags, character_count ) ) : 0;
 
 	// begin a large block
-	if( !begin_write_large_block( dstream, ValueType::VT_String, key, key_size_in_bytes ) )
+	if( !begin_write_large_block( dstream, format_flags, ValueType::VT_String, key, key_size_in_bytes, values_size ) )
 	{
 		ctLogError << "begin_write_large_block() failed unexpectedly" << ctLogEnd;
 		return false;
 	}
 
-	// record start of the array data, for error check
-	const u64 string_data_start_pos = dstream.GetPosition();
-
-	// if empty value (not same as empty string, which just has size 0)
+	// empty value, early out
 	if( !string_value )
 	{
-		// empty string, early out 
-		if( !end_write_large_block( dstream, start_pos ) )
-		{
-			ctLogError << "end_write_large_block() failed unexpectedly" << ctLogEnd;
-			return false;
-		}
 		return true;
 	}
 
+	// record start of the string data, for error check
+	const u64 string_data_start_pos = dstream.GetPosition();
+
 	// write the size of the string, and the actual string values
-	const u64 character_count = u64( string_value->size() );
-	const u64 values_size = character_count + sizeof( u64 );
-	dstream.Write( character_count );
+	write_size_value( dstream, format_flags, character_count );
 	if( character_count > 0 )
 	{
 		const i8 *data = (const i8 *)string_value->data();
 		dstream.Write( data, character_count );
 	}
 
-	// make sure all data was written
-	const u64 expected_end_pos = string_data_start_pos + values_size;
-
-	// end the block by going back to the start and writing the start position offset
-	if( !end_write_large_block( dstream, start_pos ) )
-	{
-		ctLogError << "end_write_large_block() failed unexpectedly" << ctLogEnd;
-		return false;
-	}
-
 	// make sure we are at the expected end pos
+	const u64 expected_end_pos = string_data_start_pos + values_size;
 	const u64 end_pos = dstream.GetPosition();
 	if( end_pos != expected_end_pos )
 	{
@@ -147,8 +266,18 @@ template<> inline bool write_single_value<ValueType::VT_String, std::string>( Me
 	return true;
 }
 
+// returns the number of bytes written by write_array_metadata_and_index
+inline u64 array_metadata_and_index_byte_count( const u16 format_flags, size_t per_item_size, size_t item_count, const std::vector<i32> *index )
+{
+	const u16 has_index = ( index ) ? ( 0x100 ) : ( 0 );
+	const u16 array_flags = has_index | u16( per_item_size );
+	const u64 flags_size = ( format_flags & sf_compact_sizes ) ? size_value_byte_count( format_flags, array_flags ) : sizeof( u16 );
+	const u64 index_size = ( index ) ? ( ( index->size() * sizeof( i32 ) ) + size_value_byte_count( format_flags, index->size() ) ) : 0;
+	return flags_size + size_value_byte_count( format_flags, item_count ) + index_size;
+}
+
 // reads an array header and value size from the stream, and decodes into flags, then reads the index if one exists. 
-inline bool write_array_metadata_and_index( MemoryWriteStream &dstream, size_t per_item_size, size_t item_count, const std::vector<i32> *index )
+inline bool write_array_metadata_and_index( MemoryWriteStream &dstream, const u16 format_flags, size_t per_item_size, size_t item_count, const std::vector<i32> *index )
 {
 	static_assert( sizeof( u64 ) <= sizeof( size_t ), "Unsupported size_t, current code requires it to be at least 8 bytes in size, equal to u64" );
 	ctSanityCheck( per_item_size <= 0xff );
@@ -159,27 +288,36 @@ inline bool write_array_metadata_and_index( MemoryWriteStream &dstream, size_t p
 	const u16 has_index = ( index ) ? ( 0x100 ) : ( 0 );
 	const u16 index_is_64bit = 0; // we do not support 64 bit indices yet
 	const u16 array_flags = has_index | index_is_64bit | u16( per_item_size );
-	dstream.Write( array_flags );
+	u64 flags_size = sizeof( u16 );
+	if( format_flags & sf_compact_sizes )
+	{
+		write_size_value( dstream, format_flags, array_flags );
+		flags_size = size_value_byte_count( format_flags, array_flags );
+	}
+	else
+	{
+		dstream.Write( array_flags );
+	}
 
 	// write the number of items
-	dstream.Write( u64( item_count ) );
+	write_size_value( dstream, format_flags, u64( item_count ) );
 
 	// if we have an index, write it 
 	u64 index_size = 0;
 	if( index != nullptr )
 	{
 		const u64 index_count = index->size();
-		dstream.Write( index_count );
+		write_size_value( dstream, format_flags, index_count );
 		dstream.Write( index->data(), index_count );
 
-		index_size = ( index_count * sizeof( i32 ) ) + sizeof( u64 ); // the index values and the value count
+		index_size = ( index_count * sizeof( i32 ) ) + size_value_byte_count( format_flags, index_count ); // the index values and the value count
 	}
 
 	// make sure all data was written
 	const u64 expected_end_pos =
 		start_pos
-		+ sizeof( u16 ) // the flags
-		+ sizeof( u64 ) // the item count
+		+ flags_size // the flags
+		+ size_value_byte_count( format_flags, item_count ) // the item count
 		+ index_size; // the (optional) index
 
 	const u64 end_pos = dstream.GetPosition();
@@ -193,7 +331,7 @@ inline bool write_array_metadata_and_index( MemoryWriteStream &dstream, size_t p
 }
 
 // write indexed array to stream
-template<ValueType VT, class T> inline bool write_array( MemoryWriteStream &dstream, const char *key, const u8 key_size_in_bytes, const std::vector<T> *items, const std::vector<i32> *index )
+template<ValueType VT, class T> inline bool write_array( MemoryWriteStream &dstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const std::vector<T> *items, const std::vector<i32> *index )
 {
 	static_assert( ( VT >= ValueType::VT_Array_Bool ) && ( VT <= ValueType::VT_Array_Hash ), "Invalid type for write_array" );
 	static_assert( sizeof( typename data_type_information<T>::value_type ) <= 0xff, "Invalid value size, cannot exceed 255 bytes" );
@@ -201,21 +339,22 @@ template<ValueType VT, class T> inline bool write_array( MemoryWriteStream &dstr
 	const size_t value_size = sizeof( typename data_type_information<T>::value_type );
 	const size_t values_per_type = data_type_information<T>::value_count;
 
-	// record start position, we need this in the end block
-	const u64 start_pos = dstream.GetPosition();
+	// the size of the array data is known up front
+	const u64 values_count = ( items ) ? ( items->size() * values_per_type ) : 0;
+	const u64 data_size = ( items ) ? ( array_metadata_and_index_byte_count( format_flags, value_size, values_count, index ) + ( values_count * value_size ) ) : 0;
 
 	// begin a large block
-	if( !begin_write_large_block( dstream, VT, key, key_size_in_bytes ) )
+	if( !begin_write_large_block( dstream, format_flags, VT, key, key_size_in_bytes, data_size ) )
 	{
 		ctLogError << "begin_write_large_block() failed unexpectedly" << ctLogEnd;
 		return false;
 	}
+	const u64 expected_end_pos = dstream.GetPosition() + data_size;
 
 	// write data if we have it
 	if( items )
 	{
-		const u64 values_count = items->size() * values_per_type;
-		if( !write_array_metadata_and_index( dstream, value_size, values_count, index ) )
+		if( !write_array_metadata_and_index( dstream, format_flags, value_size, values_count, index ) )
 		{
 			return false;
 		}
@@ -238,10 +377,11 @@ template<ValueType VT, class T> inline bool write_array( MemoryWriteStream &dstr
 		}
 	}
 
-	// end the block by going back to the start and writing the size of the payload
-	if( !end_write_large_block( dstream, start_pos ) )
+	// make sure the whole block was written
+	const u64 end_pos = dstream.GetPosition();
+	if( end_pos != expected_end_pos )
 	{
-		ctLogError << "end_write_large_block() failed unexpectedly" << ctLogEnd;
+		ctLogError << "End position of data " << end_pos << " does not equal the expected end position which is " << expected_end_pos << ctLogEnd;
 		return false;
 	}
 
@@ -250,31 +390,31 @@ template<ValueType VT, class T> inline bool write_array( MemoryWriteStream &dstr
 }
 
 // specialization of write_array for bool arrays
-template<> inline bool write_array<ValueType::VT_Array_Bool, bool>( MemoryWriteStream &dstream, const char *key, const u8 key_size_in_bytes, const std::vector<bool> *items, const std::vector<i32> *index )
+template<> inline bool write_array<ValueType::VT_Array_Bool, bool>( MemoryWriteStream &dstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const std::vector<bool> *items, const std::vector<i32> *index )
 {
-	// record start position, we need this in the end block
-	const u64 start_pos = dstream.GetPosition();
+	// the size of the array data is known up front, the bools are packed 8 per byte
+	const u64 number_of_packed_u8s = ( items ) ? ( ( items->size() + 7 ) / 8 ) : 0;
+	const u64 data_size = ( items ) ? ( array_metadata_and_index_byte_count( format_flags, 0, items->size(), index ) + number_of_packed_u8s ) : 0;
 
 	// begin a large block
-	if( !begin_write_large_block( dstream, ValueType::VT_Array_Bool, key, key_size_in_bytes ) )
+	if( !begin_write_large_block( dstream, format_flags, ValueType::VT_Array_Bool, key, key_size_in_bytes, data_size ) )
 	{
 		ctLogError << "begin_write_large_block() failed unexpectedly" << ctLogEnd;
 		return false;
 	}
+	const u64 expected_end_pos = dstream.GetPosition() + data_size;
 
 	// write data if we have it
 	if( items )
 	{
 		// write the item count and items
-		if( !write_array_metadata_and_index( dstream, 0, items->size(), index ) )
+		if( !write_array_metadata_and_index( dstream, format_flags, 0, items->size(), index ) )
 		{
 			return false;
 		}
 
 		if( items->size() > 0 )
 		{
-			const u64 number_of_packed_u8s = ( items->size() + 7 ) / 8;
-
 			// pack the bool vector to a temporary u8 vector
 			// round up, should the last u8 be not fully filled
 			std::vector<u8> packed_vec( number_of_packed_u8s );
@@ -302,10 +442,11 @@ template<> inline bool write_array<ValueType::VT_Array_Bool, bool>( MemoryWriteS
 		}
 	}
 
-	// end the block by going back to the start and writing the start position offset
-	if( !end_write_large_block( dstream, start_pos ) )
+	// make sure the whole block was written
+	const u64 end_pos = dstream.GetPosition();
+	if( end_pos != expected_end_pos )
 	{
-		ctLogError << "end_write_large_block() failed unexpectedly" << ctLogEnd;
+		ctLogError << "End position of data " << end_pos << " does not equal the expected end position which is " << expected_end_pos << ctLogEnd;
 		return false;
 	}
 
@@ -314,23 +455,32 @@ template<> inline bool write_array<ValueType::VT_Array_Bool, bool>( MemoryWriteS
 }
 
 // specialization of write_array for string arrays
-template<> inline bool write_array<ValueType::VT_Array_String, std::string>( MemoryWriteStream &dstream, const char *key, const u8 key_size_in_bytes, const std::vector<std::string> *items, const std::vector<i32> *index )
+template<> inline bool write_array<ValueType::VT_Array_String, std::string>( MemoryWriteStream &dstream, const u16 format_flags, const char *key, const u8 key_size_in_bytes, const std::vector<std::string> *items, const std::vector<i32> *index )
 {
-	// record start position, we need this in the end block
-	const u64 start_pos = dstream.GetPosition();
+	// each string adds its length value and characters to the values_size
+	u64 values_size = 0;
+	if( items )
+	{
+		for( const std::string &item : *items )
+		{
+			values_size += size_value_byte_count( format_flags, item.size() ) + item.size();
+		}
+	}
+	const u64 data_size = ( items ) ? ( array_metadata_and_index_byte_count( format_flags, 0, items->size(), index ) + values_size ) : 0;
 
 	// begin a large block
-	if( !begin_write_large_block( dstream, ValueType::VT_Array_String, key, key_size_in_bytes ) )
+	if( !begin_write_large_block( dstream, format_flags, ValueType::VT_Array_String, key, key_size_in_bytes, data_size ) )
 	{
 		ctLogError << "begin_write_large_block() failed unexpectedly" << ctLogEnd;
 		return false;
 	}
+	const u64 expected_end_pos = dstream.GetPosition() + data_size;
 
 	// write data if we have it
 	if( items )
 	{
 		// write the item count and items
-		if( !write_array_metadata_and_index( dstream, 0, items->size(), index ) )
+		if( !write_array_metadata_and_index( dstream, format_flags, 0, items->size(), index ) )
 		{
 			return false;
 		}
@@ -339,21 +489,15 @@ template<> inline bool write_array<ValueType::VT_Array_String, std::string>( Mem
 		{
 			const u64 values_start_pos = dstream.GetPosition();
 
-			// this is the minimum size, with only empty strings. each string will add to the values_size
-			u64 values_size = sizeof( u64 ) * items->size();
-
 			// write each string in the array
 			for( size_t string_index = 0; string_index < items->size(); ++string_index )
 			{
 				u64 string_length = ( *items )[string_index].size();
-				dstream.Write( string_length );
+				write_size_value( dstream, format_flags, string_length );
 				if( string_length > 0 )
 				{
 					i8 *p_data = (i8 *)( ( *items )[string_index].data() );
 					dstream.Write( p_data, string_length );
-
-					// update size of values
-					values_size += string_length;
 				}
 			}
 
@@ -370,10 +514,11 @@ template<> inline bool write_array<ValueType::VT_Array_String, std::string>( Mem
 		}
 	}
 
-	// end the block by going back to the start and writing the start position offset
-	if( !end_write_large_block( dstream, start_pos ) )
+	// make sure the whole block was written
+	const u64 end_pos = dstream.GetPosition();
+	if( end_pos != expected_end_pos )
 	{
-		ctLogError << "end_write_large_block() failed unexpectedly" << ctLogEnd;
+		ctLogError << "End position of data " << end_pos << " does not equal the expected end position which is " << expected_end_pos << ctLogEnd;
 		return false;
 	}
 
@@ -381,9 +526,44 @@ template<> inline bool write_array<ValueType::VT_Array_String, std::string>( Mem
 	return true;
 }
 
-EntityWriter::EntityWriter( MemoryWriteStream &_dstream ) : dstream( _dstream ), start_position( _dstream.GetPosition() )
+EntityWriter::EntityWriter( MemoryWriteStream &_dstream ) : dstream( _dstream ), start_position( _dstream.GetPosition() ), format_flags( sf_none )
+{}
+
+EntityWriter::EntityWriter( MemoryWriteStream &_dstream, const u16 _format_flags ) : dstream( _dstream ), start_position( _dstream.GetPosition() ), format_flags( _format_flags )
 {}
 
+// add the value which is about to be written to the table of contents, if the stream has tables of contents and this writer is a section
+void EntityWriter::AddTableOfContentsEntry( const char *key, const u8 key_length )
+{
+	if( ( this->format_flags & sf_section_toc ) && this->section_data_position != 0 )
+	{
+		this->table_of_contents.emplace_back( std::string( key, key_length ), this->dstream.GetPosition() - this->section_data_position );
+	}
+}
+
+// write the table of contents at the end of the section, and clear it. nothing is written for an empty 
+// section, so it is still read as a null section
+void EntityWriter::WriteTableOfContents()
+{
+	if( !( this->format_flags & sf_section_toc ) || this->table_of_contents.empty() )
+	{
+		return;
+	}
+
+	const u64 table_offset = this->dstream.GetPosition() - this->section_data_position;
+	write_size_value( this->dstream, this->format_flags, u64( this->table_of_contents.size() ) );
+	for( const auto &entry : this->table_of_contents )
+	{
+		ctSanityCheck( entry.first.size() <= EntityMaxKeyLength );
+		write_size_value( this->dstream, this->format_flags, entry.second );
+		this->dstream.Write( u8( entry.first.size() ) );
+		this->dstream.Write( (const i8 *)entry.first.data(), entry.first.size() );
+	}
+	this->dstream.Write( table_offset );
+
+	this->table_of_contents.clear();
+}
+
 // Build a section. 
 EntityWriter *EntityWriter::BeginWriteSection( const char *key, const u8 key_length )
 {
@@ -393,18 +573,33 @@ EntityWriter *EntityWriter::BeginWriteSection( const char *key, const u8 key_len
 		return nullptr;
 	}
 
+	// add the section to the table of contents of this section
+	this->AddTableOfContentsEntry( key, key_length );
+
 	// create a writer for the array, to store the start position before calling the begin large block 
-	this->active_subsection = std::unique_ptr<EntityWriter>( new EntityWriter( this->dstream ) );
+	this->active_subsection = std::unique_ptr<EntityWriter>( new EntityWriter( this->dstream, this->format_flags ) );
 
-	if( !begin_write_large_block( this->dstream, ValueType::VT_Subsection, key, key_length ) )
+	if( !begin_write_large_block( this->dstream, this->format_flags, ValueType::VT_Subsection, key, key_length ) )
 	{
 		ctLogError << "begin_write_large_block failed to write header." << ctLogEnd;
 		return nullptr;
 	}
 
+	this->active_subsection->section_data_position = this->dstream.GetPosition();
 	return this->active_subsection.get();
 }
 
+// Build a section of a field of a generated item
+EntityWriter *EntityWriter::BeginWriteSection( const char *key, const u8 key_length, const u8 field_id )
+{
+	if( this->format_flags & sf_compact_keys )
+	{
+		const char field_key[2] = { (char)field_id, 0 }; // zero terminated, as keys are logged as strings
+		return this->BeginWriteSection( field_key, 1 );
+	}
+	return this->BeginWriteSection( key, key_length );
+}
+
 bool EntityWriter::EndWriteSection( const EntityWriter *section_writer )
 {
 	if( this->active_subsection.get() != section_writer )
@@ -413,7 +608,10 @@ bool EntityWriter::EndWriteSection( const EntityWriter *section_writer )
 		return false;
 	}
 
-	if( !end_write_large_block( this->dstream, this->active_subsection->start_position ) )
+	// end the section with its table of contents
+	this->active_subsection->WriteTableOfContents();
+
+	if( !end_write_large_block( this->dstream, this->format_flags, this->active_subsection->start_position ) )
 	{
 		ctLogError << "end_write_large_block failed unexpectedly." << ctLogEnd;
 		return false;
@@ -441,10 +639,13 @@ EntityWriter *EntityWriter::BeginWriteSectionsArray( const char *key, const u8 k
 		return nullptr;
 	}
 
+	// add the sections array to the table of contents of this section
+	this->AddTableOfContentsEntry( key, key_length );
+
 	// create a writer for the array, to store the start position before calling the begin large block 
-	this->active_subsection = std::unique_ptr<EntityWriter>( new EntityWriter( this->dstream ) );
+	this->active_subsection = std::unique_ptr<EntityWriter>( new EntityWriter( this->dstream, this->format_flags ) );
 
-	if( !begin_write_large_block( this->dstream, ValueType::VT_Array_Subsection, key, key_length ) )
+	if( !begin_write_large_block( this->dstream, this->format_flags, ValueType::VT_Array_Subsection, key, key_length ) )
 	{
 		ctLogError << "begin_write_large_block failed to write header." << ctLogEnd;
 		return nullptr;
@@ -458,7 +659,7 @@ EntityWriter *EntityWriter::BeginWriteSectionsArray( const char *key, const u8 k
 	}
 
 	// write out flags, index and array size
-	if( !write_array_metadata_and_index( dstream, 0, array_size, index ) )
+	if( !write_array_metadata_and_index( this->dstream, this->format_flags, 0, array_size, index ) )
 	{
 		return nullptr;
 	}
@@ -491,10 +692,11 @@ bool EntityWriter::BeginWriteSectionInArray( const EntityWriter *sections_array_
 	this->active_array_index = section_index;
 	this->active_array_index_start_position = this->dstream.GetPosition();
 
-	// write a temporary subsection size (INT64_MAX on purpose)
-	dstream.Write( (u64)INT64_MAX );
+	// reserve the subsection size, which is written when the section ends
+	const u64 reserved_size = begin_reserved_size_value( this->dstream, this->format_flags );
+	this->active_subsection->section_data_position = this->dstream.GetPosition();
 
-	return dstream.GetPosition() == ( this->active_array_index_start_position + sizeof( u64 ) );
+	return dstream.GetPosition() == ( this->active_array_index_start_position + reserved_size );
 }
 
 bool EntityWriter::EndWriteSectionInArray( const EntityWriter *sections_array_writer, const size_t section_index )
@@ -505,12 +707,11 @@ bool EntityWriter::EndWriteSectionInArray( const EntityWriter *sections_array_wr
 		return false;
 	}
 
-	const u64 end_pos = dstream.GetPosition();
-	const u64 block_size = end_pos - this->active_array_index_start_position - sizeof( u64 ); // total block size - ( sizeof( section_size_value )=8 )
-	dstream.SetPosition( this->active_array_index_start_position );
-	dstream.Write( block_size );
-	dstream.SetPosition( end_pos ); // move back the where we were
-	return ( end_pos > this->active_array_index_start_position ); // only thing we really can check
+	// end the section with its table of contents
+	this->active_subsection->WriteTableOfContents();
+
+	// write the size of the section into the reservation at the start of the section
+	return end_reserved_size_value( this->dstream, this->format_flags, this->active_array_index_start_position );
 }
 
 bool EntityWriter::EndWriteSectionsArray( const EntityWriter *sections_array_writer )
@@ -526,7 +727,7 @@ bool EntityWriter::EndWriteSectionsArray( const EntityWriter *sections_array_wri
 		return false;
 	}
 
-	if( !end_write_large_block( this->dstream, this->active_subsection->start_position ) )
+	if( !end_write_large_block( this->dstream, this->format_flags, this->active_subsection->start_position ) )
 	{
 		ctLogError << "end_write_large_block failed unexpectedly." << ctLogEnd;
 		return false;
@@ -30,6 +30,18 @@ namespace pds
 //		u8 KeySizeInBytes; // the size of the key of the value (EntityMaxKeyLength is the max length of any key)
 //		u8 KeyData[]; // the key of the value 
 //		u8 Value[]; // <- defined size, equal to the rest of SizeInBytes after the key data ( sizeof(KeySizeInBytes)=1 + KeySizeInBytes bytes) 
+//
+// Optional stream formats, selected with the stream_format_flags when the stream is written. A stream must be read with the same flags:
+// * sf_compact_keys: The fields of the generated items are keyed by their field id (the index of the field in the item) 
+//   as a single byte key, instead of the name of the field. All other keys are unchanged.
+// * sf_compact_sizes: The sizes of large blocks and the sizes and counts of arrays, strings and subsections are written as variable 
+//   length integers, 7 bits per byte with the lowest bits first, and the high bit of each byte set if more bytes follow. 
+//   The array flags are also written as a variable length integer. The sizes of subsections, which are not known until the 
+//   subsection has been written, are padded to at least 4 bytes, by setting the high bit of bytes which only hold zero bits.
+// * sf_section_toc: Each section (and section in a sections array) with values ends with a table of contents, which is used by 
+//   EntityReader::SeekToValue to read values out of order. The table is written after the values of the section as: 
+//   The number of entries (a size value), then for each value in the order written: the offset of the value from the start of 
+//   the values of the section (a size value), u8 key length, the key. The section ends with the u64 offset of the table itself.
 
 // reflection and serialization value types
 enum class ValueType
@@ -89,6 +101,15 @@ enum class ValueType
 	VT_Array_String = 0xe1, // array of strings
 };
 
+// flags of optional stream formats. streams written without any flags use the original format
+enum stream_format_flags
+{
+	sf_none = 0x0,
+	sf_compact_keys = 0x1, // key the fields of generated items with a single byte field id
+	sf_compact_sizes = 0x2, // write sizes and counts as variable length integers
+	sf_section_toc = 0x4, // end each section with a table of contents of its values
+};
+
 // enumeration of container types
 enum class container_type_index
 {
@@ -0,0 +1,66 @@
+// pds - Persistent data structure framework, Copyright (c) 2022 Ulrik Lindahl
+// Licensed under the MIT license https://github.com/Cooolrik/pds/blob/main/LICENSE
+
+#pragma once
+
+#include <atomic>
+#include <mutex>
+#include "pds.h"
+
+namespace pds
+{
+
+// LazyItem holds an item which is decoded on demand. When read from a stream, the data of the section of the item is kept
+// as a raw copy, and the item is only decoded the first time it is accessed. A LazyItem is written exactly as the item
+// itself, so an item variable can be made lazy (or not) without changing the stream.
+// The decoding is synchronized, so a LazyItem in a shared (const) entity can be accessed from multiple threads.
+template <class _Ty>
+class LazyItem
+{
+public:
+	using value_type = _Ty;
+
+	class MF;
+	friend MF;
+
+	// ctors/dtor and copy/move operators
+	LazyItem() = default;
+	LazyItem( const LazyItem &rval ) { MF::DeepCopy( *this, &rval ); }
+	LazyItem &operator=( const LazyItem &rval ) { MF::DeepCopy( *this, &rval ); return *this; }
+	LazyItem( LazyItem &&rval ) { this->MoveFrom( rval ); }
+	LazyItem &operator=( LazyItem &&rval ) { this->MoveFrom( rval ); return *this; }
+	~LazyItem() = default;
+
+	// value compare operators, which compare the decoded items
+	bool operator==( const LazyItem &rval ) const { return MF::Equals( this, &rval ); }
+	bool operator!=( const LazyItem &rval ) const { return !( MF::Equals( this, &rval ) ); }
+
+private:
+	mutable std::mutex v_DecodeMutex;
+	mutable std::atomic<bool> v_IsDecoded{ true };
+	mutable value_type v_Item = {};
+
+	// the raw data of the section, and the format of the stream it was read from, kept until the item is decoded
+	mutable std::vector<u8> v_EncodedData;
+	u16 v_FormatFlags = sf_none;
+	bool v_FlipByteOrder = false;
+
+	void MoveFrom( LazyItem &rval );
+
+public:
+	// decode the item, if it is not yet decoded. if the decoding fails, the item is cleared and the error is returned.
+	status Decode() const;
+
+	// returns true if the item is decoded (an item which is not read from a stream is always decoded)
+	bool IsDecoded() const noexcept { return this->v_IsDecoded.load( std::memory_order_acquire ); }
+
+	// the size of the raw data which is kept until the item is decoded
+	size_t EncodedSize() const;
+
+	// access the item, which is decoded on the first access
+	const value_type &Item() const { this->Decode(); return this->v_Item; }
+	value_type &Item() { this->Decode(); return this->v_Item; }
+};
+
+}
+// namespace pds
@@ -0,0 +1,157 @@
+// pds - Persistent data structure framework, Copyright (c) 2022 Ulrik Lindahl
+// Licensed under the MIT license https://github.com/Cooolrik/pds/blob/main/LICENSE
+
+#pragma once
+
+#include "LazyItem.h"
+
+#include "EntityWriter.h"
+#include "EntityReader.h"
+#include "EntityValidator.h"
+#include "MemoryReadStream.h"
+
+namespace pds
+{
+#include "_pds_macros.inl"
+
+template<class _Ty>
+class LazyItem<_Ty>::MF
+{
+	using _MgmCl = LazyItem<_Ty>;
+
+public:
+	static status Clear( _MgmCl &obj );
+	static status DeepCopy( _MgmCl &dest, const _MgmCl *source );
+	static bool Equals( const _MgmCl *lval, const _MgmCl *rval );
+
+	static status Write( const _MgmCl &obj, EntityWriter &writer );
+	static status Read( _MgmCl &obj, EntityReader &reader );
+
+	static status Validate( const _MgmCl &obj, EntityValidator &validator );
+};
+
+template<class _Ty>
+status LazyItem<_Ty>::MF::Clear( _MgmCl &obj )
+{
+	std::lock_guard<std::mutex> lock( obj.v_DecodeMutex );
+	obj.v_EncodedData = std::vector<u8>();
+	obj.v_IsDecoded.store( true, std::memory_order_release );
+	return _Ty::MF::Clear( obj.v_Item );
+}
+
+template<class _Ty>
+status LazyItem<_Ty>::MF::DeepCopy( _MgmCl &dest, const _MgmCl *source )
+{
+	if( &dest == source )
+		return status::ok;
+	if( !source )
+		return MF::Clear( dest );
+
+	// copy the item as it is, decoded or not
+	std::lock( dest.v_DecodeMutex, source->v_DecodeMutex );
+	std::lock_guard<std::mutex> dest_lock( dest.v_DecodeMutex, std::adopt_lock );
+	std::lock_guard<std::mutex> source_lock( source->v_DecodeMutex, std::adopt_lock );
+	dest.v_EncodedData = source->v_EncodedData;
+	dest.v_FormatFlags = source->v_FormatFlags;
+	dest.v_FlipByteOrder = source->v_FlipByteOrder;
+	dest.v_IsDecoded.store( source->v_IsDecoded.load( std::memory_order_relaxed ), std::memory_order_release );
+	return _Ty::MF::DeepCopy( dest.v_Item, &source->v_Item );
+}
+
+template<class _Ty>
+bool LazyItem<_Ty>::MF::Equals( const _MgmCl *lval, const _MgmCl *rval )
+{
+	// early out if the pointers are equal (includes nullptr)
+	if( lval == rval )
+		return true;
+
+	// early out if one of the pointers is nullptr (both can't be null because of above test)
+	if( !lval || !rval )
+		return false;
+
+	// compare the decoded items
+	return _Ty::MF::Equals( &lval->Item(), &rval->Item() );
+}
+
+template<class _Ty>
+status LazyItem<_Ty>::MF::Write( const _MgmCl &obj, EntityWriter &writer )
+{
+	return _Ty::MF::Write( obj.Item(), writer );
+}
+
+template<class _Ty>
+status LazyItem<_Ty>::MF::Read( _MgmCl &obj, EntityReader &reader )
+{
+	// keep a copy of the data of the section, and decode it on first access
+	std::lock_guard<std::mutex> lock( obj.v_DecodeMutex );
+	ctStatusCall( _Ty::MF::Clear( obj.v_Item ) );
+	if( !reader.ReadRawData( obj.v_EncodedData ) )
+		return status::cant_read;
+	obj.v_FormatFlags = reader.GetFormatFlags();
+	obj.v_FlipByteOrder = reader.GetFlipByteOrder();
+	obj.v_IsDecoded.store( false, std::memory_order_release );
+	return status::ok;
+}
+
+template<class _Ty>
+status LazyItem<_Ty>::MF::Validate( const _MgmCl &obj, EntityValidator &validator )
+{
+	return _Ty::MF::Validate( obj.Item(), validator );
+}
+
+template<class _Ty>
+status LazyItem<_Ty>::Decode() const
+{
+	if( this->v_IsDecoded.load( std::memory_order_acquire ) )
+		return status::ok;
+
+	std::lock_guard<std::mutex> lock( this->v_DecodeMutex );
+	if( this->v_IsDecoded.load( std::memory_order_relaxed ) )
+		return status::ok; // decoded by another thread while waiting for the lock
+
+	// read the item from the kept data, with the format of the original stream
+	MemoryReadStream rstream( this->v_EncodedData.data(), this->v_EncodedData.size(), this->v_FlipByteOrder );
+	EntityReader reader( rstream, rstream.GetSize(), this->v_FormatFlags );
+	const status result = _Ty::MF::Read( this->v_Item, reader );
+	if( !result )
+	{
+		ctLogError << "Failed to decode the lazy item, the item is cleared" << ctLogEnd;
+		_Ty::MF::Clear( this->v_Item );
+	}
+
+	// release the data, the item is decoded
+	this->v_EncodedData = std::vector<u8>();
+	this->v_IsDecoded.store( true, std::memory_order_release );
+	return result;
+}
+
+template<class _Ty>
+size_t LazyItem<_Ty>::EncodedSize() const
+{
+	std::lock_guard<std::mutex> lock( this->v_DecodeMutex );
+	return this->v_EncodedData.size();
+}
+
+template<class _Ty>
+void LazyItem<_Ty>::MoveFrom( LazyItem &rval )
+{
+	if( this == &rval )
+		return;
+
+	std::lock( this->v_DecodeMutex, rval.v_DecodeMutex );
+	std::lock_guard<std::mutex> lock( this->v_DecodeMutex, std::adopt_lock );
+	std::lock_guard<std::mutex> rval_lock( rval.v_DecodeMutex, std::adopt_lock );
+	this->v_Item = std::move( rval.v_Item );
+	this->v_EncodedData = std::move( rval.v_EncodedData );
+	this->v_FormatFlags = rval.v_FormatFlags;
+	this->v_FlipByteOrder = rval.v_FlipByteOrder;
+	this->v_IsDecoded.store( rval.v_IsDecoded.load( std::memory_order_relaxed ), std::memory_order_release );
+
+	// leave rval as an empty, decoded item
+	rval.v_EncodedData = std::vector<u8>();
+	rval.v_IsDecoded.store( true, std::memory_order_release );
+}
+
+#include "_pds_undef_macros.inl"
+}
+// namespace pds
@@ -3,6 +3,8 @@
 
 #pragma once
 
+#include <memory>
+#include <mutex>
 #include "pds.h"
 
 namespace pds
@@ -56,6 +58,16 @@ public:
 	u64 GetPosition() const;
 	void SetPosition( u64 new_pos );
 
+	// Reset the stream to empty, with position 0 and no byte order flipping. The reserved allocation is kept, so the stream can be reused without allocating.
+	void Reset();
+
+	// get the reserved size of the allocation, which is at least the size of the stream
+	u64 GetReservedSize() const;
+
+	// Insert count bytes at pos, by moving the data from pos to the end of the stream forward. The inserted bytes are not 
+	// initialized, and if the current position is at or after pos, it is moved forward with the data.
+	void Insert( u64 pos, u64 count );
+
 	// FlipByteOrder is set if the stream flips byte order of multibyte values 
 	bool GetFlipByteOrder() const;
 	void SetFlipByteOrder( bool value );
@@ -89,6 +101,46 @@ public:
 	void Write( const hash *src, u64 count );
 };
 
+// A pool of write streams, which keep their allocations between uses. Streams which have grown beyond the 
+// high-water mark are freed when returned, instead of being kept in the pool. The pool is thread safe.
+class MemoryWriteStreamPool
+{
+public:
+	// a stream taken from the pool, which is returned to the pool when the handle is destroyed
+	class Handle
+	{
+	public:
+		Handle( MemoryWriteStreamPool &_pool, std::unique_ptr<MemoryWriteStream> _stream ) : pool( &_pool ), stream( std::move( _stream ) ) {}
+		Handle( Handle &&rval ) = default;
+		Handle( const Handle & ) = delete;
+		Handle &operator=( const Handle & ) = delete;
+		~Handle();
+
+		MemoryWriteStream &operator*() const { return *this->stream; }
+		MemoryWriteStream *operator->() const { return this->stream.get(); }
+
+	private:
+		MemoryWriteStreamPool *pool;
+		std::unique_ptr<MemoryWriteStream> stream;
+	};
+
+	// set the initial allocation size of new streams, and the high-water mark of the allocations of pooled streams.
+	// streams which are already pooled are freed.
+	void SetAllocationSizes( u64 _InitialAllocationSize, u64 _HighWaterMark );
+
+	// take a stream from the pool, or allocate a new stream if the pool is empty. the stream is empty, with position 0.
+	Handle Acquire();
+
+private:
+	u64 InitialAllocationSize = 1024 * 1024; // 1MB initial size
+	u64 HighWaterMark = 1024 * 1024 * 64; // 64MB max size of pooled streams
+
+	std::vector<std::unique_ptr<MemoryWriteStream>> Streams;
+	std::mutex Lock;
+
+	void Release( std::unique_ptr<MemoryWriteStream> stream );
+};
+
 inline void MemoryWriteStream::WriteRawData( const void *src, u64 count )
 {
 	// cap the end position
@@ -134,6 +186,18 @@ inline u64 MemoryWriteStream::GetPosition() const
 	return this->Position;
 }
 
+inline void MemoryWriteStream::Reset()
+{
+	this->DataSize = 0;
+	this->Position = 0;
+	this->FlipByteOrder = false;
+}
+
+inline u64 MemoryWriteStream::GetReservedSize() const
+{
+	return this->DataReservedSize;
+}
+
 inline void MemoryWriteStream::SetPosition( u64 new_pos )
 {
 	if( new_pos > DataSize )
@@ -143,6 +207,23 @@ inline void MemoryWriteStream::SetPosition( u64 new_pos )
 	this->Position = new_pos;
 }
 
+inline void MemoryWriteStream::Insert( u64 pos, u64 count )
+{
+	const u64 old_size = this->DataSize;
+	if( pos > old_size )
+	{
+		pos = old_size;
+	}
+
+	// grow the stream, and move the data after pos forward
+	this->Resize( old_size + count );
+	memmove( &this->Data[pos + count], &this->Data[pos], old_size - pos );
+	if( this->Position >= pos )
+	{
+		this->Position += count;
+	}
+}
+
 inline bool MemoryWriteStream::GetFlipByteOrder() const
 {
 	return this->FlipByteOrder;
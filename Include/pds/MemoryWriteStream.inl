@@ -74,5 +74,59 @@ void MemoryWriteStream::Resize( u64 newSize )
 	this->DataSize = newSize;
 }
 
+MemoryWriteStreamPool::Handle::~Handle()
+{
+	if( this->stream )
+	{
+		this->pool->Release( std::move( this->stream ) );
+	}
+}
+
+void MemoryWriteStreamPool::SetAllocationSizes( u64 _InitialAllocationSize, u64 _HighWaterMark )
+{
+	std::lock_guard<std::mutex> lock( this->Lock );
+
+	this->InitialAllocationSize = _InitialAllocationSize;
+	this->HighWaterMark = _HighWaterMark;
+	this->Streams.clear();
+}
+
+MemoryWriteStreamPool::Handle MemoryWriteStreamPool::Acquire()
+{
+	u64 allocationSize = 0;
+	{
+		std::lock_guard<std::mutex> lock( this->Lock );
+
+		if( !this->Streams.empty() )
+		{
+			std::unique_ptr<MemoryWriteStream> stream = std::move( this->Streams.back() );
+			this->Streams.pop_back();
+			return Handle( *this, std::move( stream ) );
+		}
+		allocationSize = this->InitialAllocationSize;
+	}
+
+	// the pool is empty, allocate a new stream (outside of the lock)
+	return Handle( *this, std::unique_ptr<MemoryWriteStream>( new MemoryWriteStream( allocationSize ) ) );
+}
+
+void MemoryWriteStreamPool::Release( std::unique_ptr<MemoryWriteStream> stream )
+{
+	stream->Reset();
+
+	{
+		std::lock_guard<std::mutex> lock( this->Lock );
+
+		if( stream->GetReservedSize() <= this->HighWaterMark )
+		{
+			this->Streams.emplace_back( std::move( stream ) );
+			return;
+		}
+	}
+
+	// give back the memory of a stream which has grown beyond the high-water mark (outside of the lock)
+	stream.reset();
+}
+
 }
 // namespace pds
\ No newline at end of file
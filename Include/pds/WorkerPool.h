@@ -0,0 +1,53 @@
+// pds - Persistent data structure framework, Copyright (c) 2022 Ulrik Lindahl
+// Licensed under the MIT license https://github.com/Cooolrik/pds/blob/main/LICENSE
+
+#pragma once
+
+#include <condition_variable>
+#include <deque>
+#include <functional>
+#include <mutex>
+#include <thread>
+
+#include "pds.h"
+
+namespace pds
+{
+
+// A fixed-size pool of worker threads, which run tasks from a bounded queue.
+// When the queue is full, Enqueue blocks until a worker has taken a task from the queue.
+class WorkerPool
+{
+public:
+	WorkerPool() = default;
+	WorkerPool( const WorkerPool & ) = delete;
+	WorkerPool &operator=( const WorkerPool & ) = delete;
+	~WorkerPool();
+
+	// start the worker threads. if threadCount is 0, one thread per hardware thread is started.
+	status Start( size_t threadCount, size_t queueCapacity );
+
+	// run all queued tasks, and stop the worker threads
+	void Stop();
+
+	// returns true if the worker threads are started
+	bool IsRunning();
+
+	// add a task to the queue. blocks while the queue is full. returns false if the pool is not running.
+	bool Enqueue( std::function<void()> task );
+
+private:
+	std::vector<std::thread> Threads;
+	std::deque<std::function<void()>> Tasks;
+	size_t QueueCapacity = 0;
+	bool Stopping = false;
+
+	std::mutex Lock;
+	std::condition_variable TaskAvailable;
+	std::condition_variable SpaceAvailable;
+
+	void WorkerThread();
+};
+
+}
+// namespace pds
@@ -0,0 +1,116 @@
+// pds - Persistent data structure framework, Copyright (c) 2022 Ulrik Lindahl
+// Licensed under the MIT license https://github.com/Cooolrik/pds/blob/main/LICENSE
+
+#include "WorkerPool.h"
+
+namespace pds
+{
+#include "_pds_macros.inl"
+
+WorkerPool::~WorkerPool()
+{
+	this->Stop();
+}
+
+status WorkerPool::Start( size_t threadCount, size_t queueCapacity )
+{
+	std::lock_guard<std::mutex> lock( this->Lock );
+
+	if( !this->Threads.empty() )
+	{
+		return status::already_initialized;
+	}
+	if( queueCapacity == 0 )
+	{
+		return status::invalid_param; // the queue must fit at least one task
+	}
+	if( threadCount == 0 )
+	{
+		threadCount = std::thread::hardware_concurrency();
+		if( threadCount == 0 )
+			threadCount = 1;
+	}
+
+	this->QueueCapacity = queueCapacity;
+	this->Stopping = false;
+	for( size_t i = 0; i < threadCount; ++i )
+	{
+		this->Threads.emplace_back( &WorkerPool::WorkerThread, this );
+	}
+
+	return status::ok;
+}
+
+void WorkerPool::Stop()
+{
+	// tell the workers to stop when the queue is empty, and wait for them to finish
+	std::vector<std::thread> threads;
+	{
+		std::lock_guard<std::mutex> lock( this->Lock );
+		this->Stopping = true;
+		threads = std::move( this->Threads );
+		this->Threads.clear();
+	}
+	this->TaskAvailable.notify_all();
+	this->SpaceAvailable.notify_all();
+
+	for( std::thread &thread : threads )
+	{
+		thread.join();
+	}
+}
+
+bool WorkerPool::IsRunning()
+{
+	std::lock_guard<std::mutex> lock( this->Lock );
+
+	return !this->Threads.empty() && !this->Stopping;
+}
+
+bool WorkerPool::Enqueue( std::function<void()> task )
+{
+	std::unique_lock<std::mutex> lock( this->Lock );
+
+	if( this->Threads.empty() )
+	{
+		return false;
+	}
+	this->SpaceAvailable.wait( lock, [this]() { return this->Stopping || this->Tasks.size() < this->QueueCapacity; } );
+	if( this->Stopping )
+	{
+		return false;
+	}
+
+	this->Tasks.emplace_back( std::move( task ) );
+	lock.unlock();
+	this->TaskAvailable.notify_one();
+	return true;
+}
+
+void WorkerPool::WorkerThread()
+{
+	for( ;;)
+	{
+		std::function<void()> task;
+		{
+			std::unique_lock<std::mutex> lock( this->Lock );
+
+			// wait for a task, and stop when stopping and there are no tasks left
+			this->TaskAvailable.wait( lock, [this]() { return this->Stopping || !this->Tasks.empty(); } );
+			if( this->Tasks.empty() )
+			{
+				return;
+			}
+
+			task = std::move( this->Tasks.front() );
+			this->Tasks.pop_front();
+		}
+		this->SpaceAvailable.notify_one();
+
+		task();
+	}
+}
+
+#include "_pds_undef_macros.inl"
+}
+// namespace pds
@@ -39,7 +39,10 @@
 //#define pdsSanityCheckCoreDebugMacro( statement ) 
 //#endif
 
-// pdsKeyMacro is used to define a key in the pds file stream
-#define pdsKeyMacro( name ) name , (u8)(strlen(name))
+// pdsKeyMacro is used to define a key in the pds file stream. the name must be a string literal, so the length is known at compile time
+#define pdsKeyMacro( name ) name , (u8)(sizeof( name "" )-1)
+
+// pdsFieldKeyMacro is used to define the key of a field of a generated item, with both the name and the field id of the field
+#define pdsFieldKeyMacro( name , field_id ) name , (u8)(sizeof( name "" )-1) , (u8)(field_id)
 
 
@@ -28,3 +28,4 @@
 #undef pdsValidationError
 #undef pdsValidationErrorEnd
 #undef pdsKeyMacro
+#undef pdsFieldKeyMacro
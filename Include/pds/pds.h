@@ -3,6 +3,7 @@
 
 #pragma once
 
+#include <bitset>
 #include <ctle/status.h>
 
 #include "ElementTypes.h"
@@ -13,11 +14,15 @@ class EntityValidator;
 class EntityWriter;
 class EntityReader;
 class EntityManager;
+class EntityTypeRecord;
 class MemoryReadStream;
 class MemoryWriteStream;
 
 using uint = uint32_t;
 using ctle::status;
+
+// mask of the fields of a generated item, indexed by the field ids of the item (the Fields of the item)
+using field_mask = std::bitset<256>;
 }
 // namespace pds
 
@@ -44,6 +49,7 @@ using ctle::status;
 #include "DirectedGraph_MF.h"
 #include "IndexedVector_MF.h"
 #include "ItemTable_MF.h"
+#include "LazyItem_MF.h"
 
 namespace pds
 {
@@ -72,6 +78,7 @@ item_ref item_ref::make_ref()
 #include "DynamicTypes.inl"
 #include "MemoryWriteStream.inl"
 #include "MemoryReadStream.inl"
+#include "WorkerPool.inl"
 #include "EntityManager.inl"
 #include "Varying.inl"
 #include "Varying_MF.inl"
@@ -51,7 +51,7 @@ template<class T> void TestEntityWriter_TestValueType( const MemoryWriteStream &
 
 	// set up a temporary entity reader and read back the values
 	MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
-	EntityReader er( rs );
+	EntityReader er( rs, rs.GetSize(), ew.GetFormatFlags() );
 	rs.SetPosition( start_pos );
 
 	// read back value
@@ -109,11 +109,11 @@ TEST( EntityReadWriteTests, TestEntityWriterAndReadback )
 {
 	setup_random_seed();
 
-	// for each pass, run with normal or flipped byte order
-	for( uint pass_index = 0; pass_index < ( 2 * global_number_of_passes ); ++pass_index )
+	// for each pass, run with normal or flipped byte order, and with the original or compact sizes format
+	for( uint pass_index = 0; pass_index < ( 4 * global_number_of_passes ); ++pass_index )
 	{
 		MemoryWriteStream ws;
-		EntityWriter ew( ws );
+		EntityWriter ew( ws, ( pass_index & 0x2 ) ? u16( sf_compact_sizes ) : u16( sf_none ) );
 
 		ws.SetFlipByteOrder( ( pass_index & 0x1 ) != 0 );
 
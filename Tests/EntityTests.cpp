@@ -4,8 +4,110 @@
 #include "Tests.h"
 
 #include <pds/EntityValidator.h>
+#include <pds/EntityWriter.h>
+#include <pds/EntityReader.h>
+#include <pds/MemoryWriteStream.h>
+#include <pds/MemoryReadStream.h>
+#include <pds/LazyItem_MF.h>
 
 #include "TestPackA/TestEntityA.h"
+#include "TestPackA/TestEntityB.h"
+
+#include <cstdio>
+#include <fstream>
+#include <iterator>
+#include <thread>
+#include <atomic>
+#ifndef _MSC_VER
+#include <fcntl.h>
+#include <sys/stat.h>
+#endif
+
+// create a folder for the entity files of a test, and remove the verified files list of earlier runs
+static std::string setup_entity_folder( const std::string &name )
+{
+	const std::string path = "./" + name;
+#ifdef _MSC_VER
+	CreateDirectoryA( path.c_str(), nullptr );
+#else
+	mkdir( path.c_str(), 0777 );
+#endif
+	std::remove( ( path + "/verified_files.bin" ).c_str() );
+	return path;
+}
+
+static std::string entity_file_path( const std::string &folder, const entity_ref &ref )
+{
+	return folder + "/" + ctle::to_string( hash( ref ) ) + ".dat";
+}
+
+static std::vector<u8> read_entity_file( const std::string &folder, const entity_ref &ref )
+{
+	std::ifstream file( entity_file_path( folder, ref ), std::ios::binary );
+	return std::vector<u8>( std::istreambuf_iterator<char>( file ), std::istreambuf_iterator<char>() );
+}
+
+static void write_entity_file( const std::string &folder, const entity_ref &ref, const u8 *data, size_t size )
+{
+	std::ofstream file( entity_file_path( folder, ref ), std::ios::binary | std::ios::trunc );
+	file.write( (const char *)data, (std::streamsize)size );
+}
+
+// get and set the modification time of a file, in the units of the file system (100 ns on Windows, 1 ns otherwise)
+#ifdef _MSC_VER
+static const u64 file_time_second = 10000000;
+
+static u64 get_file_modified_time( const std::string &path )
+{
+	WIN32_FILE_ATTRIBUTE_DATA attributes = {};
+	if( !GetFileAttributesExA( path.c_str(), GetFileExInfoStandard, &attributes ) )
+		return 0;
+	return ( (u64)attributes.ftLastWriteTime.dwHighDateTime << 32 ) | (u64)attributes.ftLastWriteTime.dwLowDateTime;
+}
+
+static void set_file_modified_time( const std::string &path, u64 modified_time )
+{
+	HANDLE file = CreateFileA( path.c_str(), FILE_WRITE_ATTRIBUTES, FILE_SHARE_READ | FILE_SHARE_WRITE, nullptr, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, nullptr );
+	ASSERT_NE( file, INVALID_HANDLE_VALUE );
+	FILETIME file_time = {};
+	file_time.dwLowDateTime = (DWORD)( modified_time & 0xffffffff );
+	file_time.dwHighDateTime = (DWORD)( modified_time >> 32 );
+	EXPECT_TRUE( SetFileTime( file, nullptr, nullptr, &file_time ) );
+	CloseHandle( file );
+}
+#else
+static const u64 file_time_second = 1000000000;
+
+static u64 get_file_modified_time( const std::string &path )
+{
+	struct stat file_stat = {};
+	if( stat( path.c_str(), &file_stat ) != 0 )
+		return 0;
+#ifdef __APPLE__
+	return (u64)file_stat.st_mtimespec.tv_sec * file_time_second + (u64)file_stat.st_mtimespec.tv_nsec;
+#else
+	return (u64)file_stat.st_mtim.tv_sec * file_time_second + (u64)file_stat.st_mtim.tv_nsec;
+#endif
+}
+
+static void set_file_modified_time( const std::string &path, u64 modified_time )
+{
+	struct timespec times[2] = {};
+	times[0].tv_nsec = UTIME_OMIT; // keep the access time
+	times[1].tv_sec = (time_t)( modified_time / file_time_second );
+	times[1].tv_nsec = (long)( modified_time % file_time_second );
+	EXPECT_EQ( utimensat( AT_FDCWD, path.c_str(), times, 0 ), 0 );
+}
+#endif
+
+// a new entity with a name and a random text, so each entity has its own file
+static std::shared_ptr<TestPackA::TestEntityA> new_test_entity( const std::string &name )
+{
+	auto ent = std::make_shared<TestPackA::TestEntityA>();
+	ent->Name() = name;
+	ent->OptionalText().set( random_value<string>() );
+	return ent;
+}
 
 TEST( EntityTests, EntityManagementBasicTests )
 {
@@ -53,3 +155,776 @@ TEST( EntityTests, EntityManagementBasicTests )
 	TestEntityA::MF::Clear( ent2 );
 	EXPECT_TRUE( TestEntityA::MF::Equals( &ent1, &ent2 ) );
 }
+
+TEST( EntityTests, EntityTypeRecordTests )
+{
+	using TestPackA::TestEntityA;
+
+	const EntityManager::PackageRecord *packageRecord = TestPackA::GetPackageRecord();
+	ASSERT_TRUE( packageRecord != nullptr );
+
+	// the entity must return the type record of its own type
+	TestEntityA ent;
+	const EntityTypeRecord *entityType = ent.GetEntityTypeRecord();
+	ASSERT_TRUE( entityType != nullptr );
+	EXPECT_EQ( std::string( entityType->EntityTypeString() ), std::string( TestEntityA::ItemTypeString ) );
+	EXPECT_EQ( entityType->EntityTypeId(), TestEntityA::EntityTypeId );
+
+	// the record must be listed by the package, and all listed records must be unique
+	bool found = false;
+	std::set<std::string> entityTypeStrings;
+	std::set<u64> entityTypeIds;
+	for( size_t i = 0; i < packageRecord->GetEntityTypeCount(); ++i )
+	{
+		const EntityTypeRecord *record = packageRecord->GetEntityType( i );
+		ASSERT_TRUE( record != nullptr );
+		EXPECT_TRUE( entityTypeStrings.insert( record->EntityTypeString() ).second );
+		EXPECT_TRUE( entityTypeIds.insert( record->EntityTypeId() ).second );
+		if( record == entityType )
+			found = true;
+	}
+	EXPECT_TRUE( found );
+
+	// new entities created by the record are of the same type
+	std::shared_ptr<Entity> newEnt = entityType->New();
+	ASSERT_TRUE( newEnt != nullptr );
+	EXPECT_EQ( newEnt->GetEntityTypeRecord(), entityType );
+}
+
+TEST( EntityTests, EntitySafeCastTests )
+{
+	using TestPackA::TestEntityA;
+	using TestPackA::TestEntityB;
+
+	std::shared_ptr<const Entity> entA = std::make_shared<TestEntityA>();
+	std::shared_ptr<const Entity> entB = std::make_shared<TestEntityB>();
+
+	// cast to the correct type must succeed, and to any other type must fail
+	EXPECT_EQ( TestEntityA::MF::EntitySafeCast( entA.get() ), entA.get() );
+	EXPECT_EQ( TestEntityA::MF::EntitySafeCast( entB.get() ), nullptr );
+	EXPECT_EQ( TestEntityB::MF::EntitySafeCast( entB ), entB );
+	EXPECT_EQ( TestEntityB::MF::EntitySafeCast( entA ), nullptr );
+	EXPECT_EQ( TestEntityA::MF::EntitySafeCast( std::shared_ptr<const Entity>() ), nullptr );
+}
+
+TEST( EntityTests, EntityCompactKeysTests )
+{
+	using TestPackA::TestEntityA;
+
+	TestEntityA ent;
+	ent.Name() = random_value<string>();
+	ent.OptionalText().set( random_value<string>() );
+
+	// write with the original and the compact keys format, and read back with the same format
+	u64 stream_sizes[2] = {};
+	for( u16 format_flags : { u16( sf_none ), u16( sf_compact_keys ) } )
+	{
+		MemoryWriteStream ws;
+		EntityWriter ew( ws, format_flags );
+		EXPECT_EQ( TestEntityA::MF::Write( ent, ew ), status::ok );
+		stream_sizes[format_flags] = ws.GetSize();
+
+		MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
+		EntityReader er( rs, rs.GetSize(), format_flags );
+		TestEntityA readback;
+		EXPECT_EQ( TestEntityA::MF::Read( readback, er ), status::ok );
+		EXPECT_TRUE( TestEntityA::MF::Equals( &ent, &readback ) );
+	}
+
+	// the compact keys are smaller than the names
+	EXPECT_LT( stream_sizes[sf_compact_keys], stream_sizes[sf_none] );
+}
+
+TEST( EntityTests, EntitySectionTableOfContentsTests )
+{
+	using TestPackA::TestEntityA;
+
+	TestEntityA ent;
+	ent.Name() = random_value<string>();
+	ent.OptionalText().set( random_value<string>() );
+
+	for( u16 format_flags : { u16( sf_section_toc ), u16( sf_section_toc | sf_compact_keys | sf_compact_sizes ) } )
+	{
+		// write the entity in a section, which gets a table of contents
+		MemoryWriteStream ws;
+		EntityWriter ew( ws, format_flags );
+		EntityWriter *section_writer = ew.BeginWriteSection( "Entity", 6 );
+		EXPECT_NE( section_writer, nullptr );
+		EXPECT_EQ( TestEntityA::MF::Write( ent, *section_writer ), status::ok );
+		EXPECT_TRUE( ew.EndWriteSection( section_writer ) );
+
+		// read the full entity sequentially
+		{
+			MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
+			EntityReader er( rs, rs.GetSize(), format_flags );
+			EntityReader *section_reader = nullptr;
+			bool success = false;
+			std::tie( section_reader, success ) = er.BeginReadSection( "Entity", 6, false );
+			EXPECT_TRUE( success );
+			TestEntityA readback;
+			EXPECT_EQ( TestEntityA::MF::Read( readback, *section_reader ), status::ok );
+			EXPECT_TRUE( TestEntityA::MF::Equals( &ent, &readback ) );
+			EXPECT_TRUE( er.EndReadSection( section_reader ) );
+		}
+
+		// seek to the fields out of order, and skip the rest of the section
+		{
+			MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
+			EntityReader er( rs, rs.GetSize(), format_flags );
+			EntityReader *section_reader = nullptr;
+			bool success = false;
+			std::tie( section_reader, success ) = er.BeginReadSection( "Entity", 6, false );
+			EXPECT_TRUE( success );
+
+			optional_value<string> optional_text;
+			EXPECT_TRUE( section_reader->SeekToValue( "OptionalText", 12, 2 ) );
+			EXPECT_TRUE( section_reader->Read( "OptionalText", 12, 2, optional_text ) );
+			EXPECT_EQ( optional_text.value(), ent.OptionalText().value() );
+
+			string name;
+			EXPECT_TRUE( section_reader->SeekToValue( "Name", 4, 1 ) );
+			EXPECT_TRUE( section_reader->Read( "Name", 4, 1, name ) );
+			EXPECT_EQ( name, ent.Name() );
+
+			EXPECT_FALSE( section_reader->SeekToValue( "NotAField", 9 ) );
+			EXPECT_TRUE( er.EndReadSection( section_reader ) );
+		}
+	}
+}
+
+TEST( EntityTests, EntityReadFieldsTests )
+{
+	using TestPackA::TestEntityA;
+
+	TestEntityA ent;
+	ent.TestVariableA().set();
+	ent.Name() = random_value<string>();
+	ent.OptionalText().set( random_value<string>() );
+	ent.LazyItemA().set();
+	ent.LazyItemA().value().Item().Name() = random_value<string>();
+
+	for( u16 format_flags : { u16( sf_none ), u16( sf_compact_keys | sf_compact_sizes ) } )
+	{
+		MemoryWriteStream ws;
+		EntityWriter ew( ws, format_flags );
+		EXPECT_EQ( TestEntityA::MF::Write( ent, ew ), status::ok );
+
+		// read only the name, the other fields are skipped
+		field_mask fields;
+		fields.set( TestEntityA::Fields::Name );
+
+		MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
+		EntityReader er( rs, rs.GetSize(), format_flags );
+		TestEntityA readback;
+		EXPECT_EQ( TestEntityA::MF::ReadFields( readback, er, fields ), status::ok );
+		EXPECT_EQ( readback.Name(), ent.Name() );
+		EXPECT_FALSE( readback.TestVariableA().has_value() );
+		EXPECT_FALSE( readback.OptionalText().has_value() );
+		EXPECT_FALSE( readback.LazyItemA().has_value() );
+		EXPECT_EQ( rs.GetPosition(), ws.GetSize() );
+
+		// read all fields
+		fields.set();
+		MemoryReadStream rs_all( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
+		EntityReader er_all( rs_all, rs_all.GetSize(), format_flags );
+		TestEntityA readback_all;
+		EXPECT_EQ( TestEntityA::MF::ReadFields( readback_all, er_all, fields ), status::ok );
+		EXPECT_TRUE( TestEntityA::MF::Equals( &ent, &readback_all ) );
+	}
+}
+
+TEST( EntityTests, EntityLazyItemTests )
+{
+	using TestPackA::v1_0::TestItemA;
+
+	TestItemA item;
+	item.Name() = random_value<string>();
+	item.OptionalText().set( random_value<string>() );
+
+	for( u16 format_flags : { u16( sf_none ), u16( sf_compact_keys | sf_compact_sizes | sf_section_toc ) } )
+	{
+		// write the item in a section
+		MemoryWriteStream ws;
+		EntityWriter ew( ws, format_flags );
+		EntityWriter *section_writer = ew.BeginWriteSection( "Item", 4 );
+		EXPECT_NE( section_writer, nullptr );
+		EXPECT_EQ( TestItemA::MF::Write( item, *section_writer ), status::ok );
+		EXPECT_TRUE( ew.EndWriteSection( section_writer ) );
+
+		// read it back as a lazy item, which keeps the data of the section until accessed
+		MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
+		EntityReader er( rs, rs.GetSize(), format_flags );
+		EntityReader *section_reader = nullptr;
+		bool success = false;
+		std::tie( section_reader, success ) = er.BeginReadSection( "Item", 4, false );
+		EXPECT_TRUE( success );
+		EXPECT_NE( section_reader, nullptr );
+		LazyItem<TestItemA> lazy;
+		EXPECT_EQ( LazyItem<TestItemA>::MF::Read( lazy, *section_reader ), status::ok );
+		EXPECT_TRUE( er.EndReadSection( section_reader ) );
+		EXPECT_EQ( rs.GetPosition(), ws.GetSize() );
+		EXPECT_FALSE( lazy.IsDecoded() );
+		EXPECT_GT( lazy.EncodedSize(), size_t( 0 ) );
+
+		// copies are also lazy, and decode to the same item
+		LazyItem<TestItemA> lazy_copy = lazy;
+		EXPECT_FALSE( lazy_copy.IsDecoded() );
+
+		// access decodes the item, and releases the data
+		EXPECT_TRUE( TestItemA::MF::Equals( &lazy.Item(), &item ) );
+		EXPECT_TRUE( lazy.IsDecoded() );
+		EXPECT_EQ( lazy.EncodedSize(), size_t( 0 ) );
+		EXPECT_TRUE( lazy == lazy_copy );
+		EXPECT_TRUE( lazy_copy.IsDecoded() );
+
+		// a lazy item is written exactly as the item
+		MemoryWriteStream lazy_ws;
+		EntityWriter lazy_ew( lazy_ws, format_flags );
+		section_writer = lazy_ew.BeginWriteSection( "Item", 4 );
+		EXPECT_NE( section_writer, nullptr );
+		EXPECT_EQ( LazyItem<TestItemA>::MF::Write( lazy, *section_writer ), status::ok );
+		EXPECT_TRUE( lazy_ew.EndWriteSection( section_writer ) );
+		EXPECT_EQ( lazy_ws.GetSize(), ws.GetSize() );
+		EXPECT_EQ( memcmp( lazy_ws.GetData(), ws.GetData(), ws.GetSize() ), 0 );
+	}
+}
+
+TEST( EntityTests, EntityLazyItemVariableTests )
+{
+	using TestPackA::TestEntityA;
+	using TestPackA::v1_0::TestItemA;
+
+	TestEntityA ent;
+	ent.Name() = random_value<string>();
+	ent.LazyItemA().set();
+	ent.LazyItemA().value().Item().Name() = random_value<string>();
+	ent.LazyItemA().value().Item().OptionalText().set( random_value<string>() );
+
+	for( u16 format_flags : { u16( sf_none ), u16( sf_compact_keys | sf_compact_sizes | sf_section_toc ) } )
+	{
+		MemoryWriteStream ws;
+		EntityWriter ew( ws, format_flags );
+		EXPECT_EQ( TestEntityA::MF::Write( ent, ew ), status::ok );
+
+		// the generated read keeps the data of the lazy item, and decodes it on access
+		MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
+		EntityReader er( rs, rs.GetSize(), format_flags );
+		TestEntityA readback;
+		EXPECT_EQ( TestEntityA::MF::Read( readback, er ), status::ok );
+		EXPECT_EQ( rs.GetPosition(), ws.GetSize() );
+		ASSERT_TRUE( readback.LazyItemA().has_value() );
+		EXPECT_FALSE( readback.LazyItemA().value().IsDecoded() );
+		EXPECT_GT( readback.LazyItemA().value().EncodedSize(), size_t( 0 ) );
+
+		// copies of the entity keep the item lazy
+		TestEntityA readback_copy = readback;
+		EXPECT_FALSE( readback_copy.LazyItemA().value().IsDecoded() );
+
+		// compare decodes the item
+		EXPECT_TRUE( TestEntityA::MF::Equals( &ent, &readback ) );
+		EXPECT_TRUE( readback.LazyItemA().value().IsDecoded() );
+		EXPECT_TRUE( TestItemA::MF::Equals( &readback_copy.LazyItemA().value().Item(), &ent.LazyItemA().value().Item() ) );
+
+		// a null lazy item reads back as null
+		TestEntityA null_ent;
+		MemoryWriteStream null_ws;
+		EntityWriter null_ew( null_ws, format_flags );
+		EXPECT_EQ( TestEntityA::MF::Write( null_ent, null_ew ), status::ok );
+		MemoryReadStream null_rs( null_ws.GetData(), null_ws.GetSize(), null_ws.GetFlipByteOrder() );
+		EntityReader null_er( null_rs, null_rs.GetSize(), format_flags );
+		EXPECT_EQ( TestEntityA::MF::Read( readback, null_er ), status::ok );
+		EXPECT_FALSE( readback.LazyItemA().has_value() );
+	}
+}
+
+TEST( EntityTests, EntityManagerMemoryMappedFilesTests )
+{
+	using TestPackA::TestEntityA;
+
+	setup_random_seed();
+	const std::string folder = setup_entity_folder( "EntityManagerMemoryMappedFilesTests" );
+
+	EntityManager::Options options;
+	options.MemoryMapEntityFiles = true;
+	options.StreamFormatFlags = sf_compact_keys | sf_compact_sizes;
+
+	// add entities, and read them back from the mapped files in a new manager
+	std::vector<std::shared_ptr<TestEntityA>> entities;
+	std::vector<entity_ref> refs;
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		for( size_t i = 0; i < 4; ++i )
+		{
+			entities.emplace_back( new_test_entity( "Mapped" + std::to_string( i ) ) );
+			const auto added = manager.AddEntity( entities.back() );
+			ASSERT_EQ( added.second, status::ok );
+			refs.emplace_back( added.first );
+		}
+	}
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		for( size_t i = 0; i < refs.size(); ++i )
+		{
+			EXPECT_EQ( manager.LoadEntity( refs[i] ), status::ok );
+			std::shared_ptr<const TestEntityA> loaded = TestEntityA::MF::EntitySafeCast( manager.GetLoadedEntity( refs[i] ) );
+			ASSERT_NE( loaded, nullptr );
+			EXPECT_TRUE( TestEntityA::MF::Equals( loaded.get(), entities[i].get() ) );
+		}
+	}
+
+	// an empty file, and a truncated file, are corrupted, also when the hash is not verified
+	const entity_ref empty_ref = entity_ref( hash_rand() );
+	write_entity_file( folder, empty_ref, nullptr, 0 );
+	const std::vector<u8> file_data = read_entity_file( folder, refs[0] );
+	ASSERT_GT( file_data.size(), size_t( 32 ) );
+	write_entity_file( folder, refs[0], file_data.data(), file_data.size() / 2 );
+	for( EntityManager::VerificationPolicy policy : { EntityManager::VerificationPolicy::Always, EntityManager::VerificationPolicy::Never } )
+	{
+		options.Verification = policy;
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( empty_ref ), status::corrupted );
+		EXPECT_EQ( manager.LoadEntity( refs[0] ), status::corrupted );
+		EXPECT_FALSE( manager.IsEntityLoaded( refs[0] ) );
+
+		// a missing file cant be read
+		EXPECT_EQ( manager.LoadEntity( entity_ref( hash_rand() ) ), status::cant_read );
+	}
+
+	// restore the file, for later runs
+	std::remove( entity_file_path( folder, empty_ref ).c_str() );
+	write_entity_file( folder, refs[0], file_data.data(), file_data.size() );
+}
+
+TEST( EntityTests, EntityManagerVerificationTests )
+{
+	using VerificationPolicy = EntityManager::VerificationPolicy;
+
+	setup_random_seed();
+	const std::string folder = setup_entity_folder( "EntityManagerVerificationTests" );
+
+	std::vector<entity_ref> refs;
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() } ), status::ok );
+		for( size_t i = 0; i < 4; ++i )
+		{
+			const auto added = manager.AddEntity( new_test_entity( "Verified" + std::to_string( i ) ) );
+			ASSERT_EQ( added.second, status::ok );
+			refs.emplace_back( added.first );
+		}
+	}
+
+	EntityManager::Options options;
+	EntityManager::LoadReport report;
+
+	// always verify, but not when the entity is already loaded
+	{
+		options.Verification = VerificationPolicy::Always;
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[0], &report ), status::ok );
+		EXPECT_EQ( report.Policy, VerificationPolicy::Always );
+		EXPECT_TRUE( report.HashVerified );
+		EXPECT_FALSE( report.Coalesced );
+		EXPECT_EQ( manager.LoadEntity( refs[0], &report ), status::ok );
+		EXPECT_FALSE( report.HashVerified );
+	}
+
+	// never verify
+	{
+		options.Verification = VerificationPolicy::Never;
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		for( const entity_ref &ref : refs )
+		{
+			EXPECT_EQ( manager.LoadEntity( ref, &report ), status::ok );
+			EXPECT_EQ( report.Policy, VerificationPolicy::Never );
+			EXPECT_FALSE( report.HashVerified );
+		}
+	}
+
+	// verify every second load
+	{
+		options.Verification = VerificationPolicy::Sampled;
+		options.VerificationSampleInterval = 2;
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		for( size_t i = 0; i < refs.size(); ++i )
+		{
+			EXPECT_EQ( manager.LoadEntity( refs[i], &report ), status::ok );
+			EXPECT_EQ( report.Policy, VerificationPolicy::Sampled );
+			EXPECT_EQ( report.HashVerified, ( i % 2 ) == 0 );
+		}
+	}
+
+	// verify once per file, the verified files are kept in the sidecar file between managers
+	options.Verification = VerificationPolicy::OncePerFile;
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[0], &report ), status::ok );
+		EXPECT_EQ( report.Policy, VerificationPolicy::OncePerFile );
+		EXPECT_TRUE( report.HashVerified );
+		EXPECT_EQ( manager.UnloadNonReferencedEntities(), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[0], &report ), status::ok );
+		EXPECT_FALSE( report.HashVerified );
+	}
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[0], &report ), status::ok );
+		EXPECT_FALSE( report.HashVerified );
+		EXPECT_EQ( manager.LoadEntity( refs[1], &report ), status::ok );
+		EXPECT_TRUE( report.HashVerified );
+	}
+
+	// a file which is rewritten with the same size after it was verified is verified again. the modification times are 
+	// set explicitly, as the clock of the file system may not have advanced since the file was verified
+	const std::string file_path = entity_file_path( folder, refs[1] );
+	const u64 verified_time = get_file_modified_time( file_path );
+	const std::vector<u8> file_data = read_entity_file( folder, refs[1] );
+	std::vector<u8> modified_data = file_data;
+	modified_data[modified_data.size() / 2] ^= 0xff;
+	write_entity_file( folder, refs[1], modified_data.data(), modified_data.size() );
+	set_file_modified_time( file_path, verified_time + file_time_second );
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[1], &report ), status::corrupted );
+		EXPECT_FALSE( manager.IsEntityLoaded( refs[1] ) );
+	}
+	write_entity_file( folder, refs[1], file_data.data(), file_data.size() );
+	set_file_modified_time( file_path, verified_time + 2 * file_time_second );
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[1], &report ), status::ok );
+		EXPECT_TRUE( report.HashVerified );
+	}
+}
+
+TEST( EntityTests, EntityManagerCacheBudgetTests )
+{
+	setup_random_seed();
+	const std::string folder = setup_entity_folder( "EntityManagerCacheBudgetTests" );
+
+	// every entity is over the budget on its own
+	EntityManager::Options options;
+	options.CacheMaxBytes = 1;
+
+	std::vector<entity_ref> refs;
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		for( size_t i = 0; i < 4; ++i )
+		{
+			// an added entity is resident when the add returns
+			const auto added = manager.AddEntity( new_test_entity( "Budget" + std::to_string( i ) ) );
+			ASSERT_EQ( added.second, status::ok );
+			EXPECT_NE( manager.GetLoadedEntity( added.first ), nullptr );
+			refs.emplace_back( added.first );
+		}
+	}
+
+	EntityManager manager;
+	ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+
+	// a loaded entity is resident when the load returns, and an entity which is referenced is never evicted
+	std::shared_ptr<const Entity> held;
+	for( size_t i = 0; i < refs.size(); ++i )
+	{
+		EXPECT_EQ( manager.LoadEntity( refs[i] ), status::ok );
+		std::shared_ptr<const Entity> loaded = manager.GetLoadedEntity( refs[i] );
+		EXPECT_NE( loaded, nullptr );
+		if( i == 0 )
+			held = loaded;
+	}
+	EXPECT_TRUE( manager.IsEntityLoaded( refs.front() ) );
+	EXPECT_TRUE( manager.IsEntityLoaded( refs.back() ) );
+
+	// each load is a miss, each lookup a hit, and all entities which are not resident are evicted
+	const EntityManager::CacheStatistics statistics = manager.GetCacheStatistics();
+	EXPECT_EQ( statistics.Misses, u64( refs.size() ) );
+	EXPECT_EQ( statistics.Hits, u64( refs.size() ) );
+	EXPECT_EQ( statistics.EntityCount + statistics.Evictions, u64( refs.size() ) );
+	u64 residentBytes = 0;
+	for( const entity_ref &ref : refs )
+	{
+		if( manager.IsEntityLoaded( ref ) )
+			residentBytes += read_entity_file( folder, ref ).size();
+	}
+	EXPECT_EQ( statistics.ResidentBytes, residentBytes );
+}
+
+TEST( EntityTests, EntityManagerCacheOrderTests )
+{
+	setup_random_seed();
+	const std::string folder = setup_entity_folder( "EntityManagerCacheOrderTests" );
+
+	std::vector<entity_ref> refs;
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() } ), status::ok );
+		for( size_t i = 0; i < 17; ++i )
+		{
+			const auto added = manager.AddEntity( new_test_entity( "Order" + std::to_string( i ) ) );
+			ASSERT_EQ( added.second, status::ok );
+			refs.emplace_back( added.first );
+		}
+	}
+
+	// the budget is for the whole cache, not per shard of the cache
+	{
+		EntityManager::Options options;
+		options.CacheMaxEntityCount = 1;
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		for( const entity_ref &ref : refs )
+		{
+			EXPECT_EQ( manager.LoadEntity( ref ), status::ok );
+		}
+		const EntityManager::CacheStatistics statistics = manager.GetCacheStatistics();
+		EXPECT_EQ( statistics.EntityCount, u64( 1 ) );
+		EXPECT_EQ( statistics.Evictions, u64( refs.size() - 1 ) );
+		EXPECT_EQ( statistics.ResidentBytes, u64( read_entity_file( folder, refs.back() ).size() ) );
+		EXPECT_TRUE( manager.IsEntityLoaded( refs.back() ) );
+	}
+
+	// the least recently used entity is evicted first, a lookup makes the entity the most recently used
+	{
+		EntityManager::Options options;
+		options.CacheMaxEntityCount = 3;
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[0] ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[1] ), status::ok );
+		EXPECT_EQ( manager.LoadEntity( refs[2] ), status::ok );
+		EXPECT_NE( manager.GetLoadedEntity( refs[0] ), nullptr );
+		EXPECT_EQ( manager.LoadEntity( refs[3] ), status::ok );
+		EXPECT_TRUE( manager.IsEntityLoaded( refs[0] ) );
+		EXPECT_FALSE( manager.IsEntityLoaded( refs[1] ) );
+		EXPECT_TRUE( manager.IsEntityLoaded( refs[2] ) );
+		EXPECT_TRUE( manager.IsEntityLoaded( refs[3] ) );
+		EXPECT_EQ( manager.GetCacheStatistics().Evictions, u64( 1 ) );
+	}
+
+	// when over budget, the cache is evicted in one batch down to 15/16 of the budget
+	{
+		EntityManager::Options options;
+		options.CacheMaxEntityCount = 16;
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		for( const entity_ref &ref : refs )
+		{
+			EXPECT_EQ( manager.LoadEntity( ref ), status::ok );
+		}
+		const EntityManager::CacheStatistics statistics = manager.GetCacheStatistics();
+		EXPECT_EQ( statistics.EntityCount, u64( 15 ) );
+		EXPECT_EQ( statistics.Evictions, u64( 2 ) );
+		EXPECT_FALSE( manager.IsEntityLoaded( refs[0] ) );
+		EXPECT_FALSE( manager.IsEntityLoaded( refs[1] ) );
+		EXPECT_TRUE( manager.IsEntityLoaded( refs[2] ) );
+		EXPECT_TRUE( manager.IsEntityLoaded( refs.back() ) );
+	}
+}
+
+TEST( EntityTests, EntityManagerConcurrentCacheTests )
+{
+	using TestPackA::TestEntityA;
+
+	setup_random_seed();
+	const std::string folder = setup_entity_folder( "EntityManagerConcurrentCacheTests" );
+
+	// the entities are spread over the shards of the cache
+	const size_t entity_count = 33;
+	std::vector<entity_ref> refs;
+	std::vector<std::string> names;
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() } ), status::ok );
+		for( size_t i = 0; i < entity_count; ++i )
+		{
+			names.emplace_back( "Concurrent" + std::to_string( i ) );
+			const auto added = manager.AddEntity( new_test_entity( names.back() ) );
+			ASSERT_EQ( added.second, status::ok );
+			refs.emplace_back( added.first );
+		}
+	}
+
+	EntityManager::Options options;
+	options.CacheMaxEntityCount = 8;
+	EntityManager manager;
+	ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+
+	// load and look up the entities from many threads, all but the last entity
+	std::atomic<u64> failures{ 0 };
+	std::vector<std::thread> threads;
+	for( size_t thread_index = 0; thread_index < 8; ++thread_index )
+	{
+		threads.emplace_back( [&, thread_index]()
+		{
+			for( size_t i = 0; i < 200; ++i )
+			{
+				const size_t entity_index = ( thread_index * 7 + i * 3 ) % ( entity_count - 1 );
+				if( manager.LoadEntity( refs[entity_index] ) != status::ok )
+					++failures;
+
+				// the entity may already be evicted by another thread, but if it is found, it must be the right entity
+				std::shared_ptr<const TestEntityA> loaded = TestEntityA::MF::EntitySafeCast( manager.GetLoadedEntity( refs[entity_index] ) );
+				if( loaded && loaded->Name() != names[entity_index] )
+					++failures;
+			}
+		} );
+	}
+	for( std::thread &thread : threads )
+	{
+		thread.join();
+	}
+	EXPECT_EQ( failures.load(), u64( 0 ) );
+
+	// with no references held, a new load brings the cache within budget
+	EXPECT_EQ( manager.LoadEntity( refs.back() ), status::ok );
+	EXPECT_TRUE( manager.IsEntityLoaded( refs.back() ) );
+	EXPECT_LE( manager.GetCacheStatistics().EntityCount, u64( 8 ) );
+
+	// all entities can be unloaded, and the resident size is kept in sync
+	EXPECT_EQ( manager.UnloadNonReferencedEntities(), status::ok );
+	const EntityManager::CacheStatistics statistics = manager.GetCacheStatistics();
+	EXPECT_EQ( statistics.EntityCount, u64( 0 ) );
+	EXPECT_EQ( statistics.ResidentBytes, u64( 0 ) );
+}
+
+TEST( EntityTests, EntityManagerCoalescedLoadsTests )
+{
+	setup_random_seed();
+	const std::string folder = setup_entity_folder( "EntityManagerCoalescedLoadsTests" );
+
+	entity_ref ref;
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() } ), status::ok );
+		const auto added = manager.AddEntity( new_test_entity( "Coalesced" ) );
+		ASSERT_EQ( added.second, status::ok );
+		ref = added.first;
+	}
+
+	// the single worker is blocked by a task until both loads are started, 
+	// so the second load is started while the first is still in flight
+	EntityManager::Options options;
+	options.WorkerThreadCount = 1;
+	EntityManager manager;
+	ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+	std::promise<void> gate;
+	const std::shared_future<void> gate_futr = gate.get_future().share();
+	std::future<status> blocker = manager.RunTaskAsync( [gate_futr]() { gate_futr.wait(); } );
+	EntityManager::LoadReport first_report;
+	EntityManager::LoadReport second_report;
+	std::future<status> first = manager.LoadEntityAsync( ref, &first_report );
+	std::future<status> second = manager.LoadEntityAsync( ref, &second_report );
+	gate.set_value();
+	EXPECT_EQ( blocker.get(), status::ok );
+
+	// both loads share the result of the first load, which read and verified the file
+	EXPECT_EQ( first.get(), status::ok );
+	EXPECT_EQ( second.get(), status::ok );
+	EXPECT_FALSE( first_report.Coalesced );
+	EXPECT_TRUE( first_report.HashVerified );
+	EXPECT_TRUE( second_report.Coalesced );
+	EXPECT_FALSE( second_report.HashVerified );
+	EXPECT_TRUE( manager.IsEntityLoaded( ref ) );
+
+	// the load is no longer in flight, so a new load finds the entity loaded
+	EntityManager::LoadReport report;
+	EXPECT_EQ( manager.LoadEntity( ref, &report ), status::ok );
+	EXPECT_FALSE( report.Coalesced );
+	EXPECT_FALSE( report.HashVerified );
+}
+
+TEST( EntityTests, EntityManagerBatchTests )
+{
+	using TestPackA::TestEntityA;
+
+	setup_random_seed();
+	const std::string folder = setup_entity_folder( "EntityManagerBatchTests" );
+
+	// a batch which is much larger than the queue of the worker pool
+	EntityManager::Options options;
+	options.WorkerThreadCount = 2;
+	options.WorkerQueueCapacity = 2;
+
+	// add a batch, with an invalid (null) entity in it
+	std::vector<std::shared_ptr<const Entity>> entities;
+	for( size_t i = 0; i < 16; ++i )
+	{
+		entities.emplace_back( new_test_entity( "Batch" + std::to_string( i ) ) );
+	}
+	const size_t null_index = 5;
+	entities[null_index] = nullptr;
+
+	std::vector<entity_ref> refs;
+	{
+		EntityManager manager;
+		ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+		const std::vector<std::pair<entity_ref, status>> added = manager.AddEntities( entities );
+		ASSERT_EQ( added.size(), entities.size() );
+		for( size_t i = 0; i < entities.size(); ++i )
+		{
+			if( i == null_index )
+			{
+				EXPECT_EQ( added[i].second, status::corrupted );
+				continue;
+			}
+
+			// the results are in the order of the entities
+			EXPECT_EQ( added[i].second, status::ok );
+			EXPECT_EQ( manager.GetLoadedEntity( added[i].first ), entities[i] );
+			refs.emplace_back( added[i].first );
+		}
+	}
+
+	// load a batch in a new manager, with a missing entity, and the same entity many times
+	const entity_ref missing_ref = entity_ref( hash_rand() );
+	std::vector<entity_ref> load_refs = refs;
+	load_refs.insert( load_refs.begin() + 3, missing_ref );
+	load_refs.insert( load_refs.end(), 4, refs.front() );
+
+	EntityManager manager;
+	ASSERT_EQ( manager.Initialize( folder, { TestPackA::GetPackageRecord() }, options ), status::ok );
+	const std::vector<status> loaded = manager.LoadEntities( load_refs );
+	ASSERT_EQ( loaded.size(), load_refs.size() );
+	for( size_t i = 0; i < load_refs.size(); ++i )
+	{
+		EXPECT_EQ( loaded[i], ( load_refs[i] == missing_ref ) ? status::cant_read : status::ok );
+	}
+
+	// the entities are loaded with the same data as added
+	for( size_t i = 0, ref_index = 0; i < entities.size(); ++i )
+	{
+		if( i == null_index )
+			continue;
+		std::shared_ptr<const TestEntityA> ent = TestEntityA::MF::EntitySafeCast( manager.GetLoadedEntity( refs[ref_index++] ) );
+		ASSERT_NE( ent, nullptr );
+		EXPECT_TRUE( TestEntityA::MF::Equals( ent.get(), TestEntityA::MF::EntitySafeCast( entities[i].get() ) ) );
+	}
+	EXPECT_FALSE( manager.IsEntityLoaded( missing_ref ) );
+	EXPECT_EQ( manager.GetCacheStatistics().EntityCount, u64( refs.size() ) );
+}
+
+TEST( EntityTests, EntityManagerNotInitializedTests )
+{
+	setup_random_seed();
+
+	// without a running worker pool, no tasks are run, and the loads and adds return not_initialized
+	EntityManager manager;
+	const entity_ref ref = entity_ref( hash_rand() );
+	EXPECT_EQ( manager.LoadEntity( ref ), status::not_initialized );
+	EXPECT_EQ( manager.LoadEntity( ref ), status::not_initialized );
+	const std::pair<entity_ref, status> added = manager.AddEntity( new_test_entity( "NotInitialized" ) );
+	EXPECT_EQ( added.first, entity_ref() );
+	EXPECT_EQ( added.second, status::not_initialized );
+	EXPECT_FALSE( manager.IsEntityLoaded( ref ) );
+	EXPECT_EQ( manager.RunTaskAsync( []() {} ).get(), status::not_initialized );
+}
@@ -126,3 +126,38 @@ TEST( ReadWriteTests, MemoryWriteReadStream )
 		rs = nullptr;
 	}
 }
+
+TEST( ReadWriteTests, MemoryWriteStreamPool )
+{
+	MemoryWriteStreamPool pool;
+	pool.SetAllocationSizes( 1024, 64 * 1024 );
+
+	// a returned stream is reused, with its allocation, and is reset to empty
+	const void *data = nullptr;
+	if( true )
+	{
+		MemoryWriteStreamPool::Handle ws = pool.Acquire();
+		ws->SetFlipByteOrder( true );
+		ws->Write( u64_rand() );
+		EXPECT_EQ( ws->GetSize(), u64( 8 ) );
+		data = ws->GetData();
+	}
+	if( true )
+	{
+		MemoryWriteStreamPool::Handle ws = pool.Acquire();
+		EXPECT_EQ( ws->GetData(), data );
+		EXPECT_EQ( ws->GetSize(), u64( 0 ) );
+		EXPECT_EQ( ws->GetPosition(), u64( 0 ) );
+		EXPECT_FALSE( ws->GetFlipByteOrder() );
+
+		// grow the stream beyond the high-water mark
+		std::vector<u8> values( 128 * 1024 );
+		ws->Write( values.data(), values.size() );
+		EXPECT_GT( ws->GetReservedSize(), u64( 64 * 1024 ) );
+	}
+
+	// the grown stream is freed when returned, so a new stream is allocated
+	MemoryWriteStreamPool::Handle ws = pool.Acquire();
+	EXPECT_EQ( ws->GetReservedSize(), u64( 1024 ) );
+	EXPECT_EQ( ws->GetSize(), u64( 0 ) );
+}
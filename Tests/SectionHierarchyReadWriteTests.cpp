@@ -289,14 +289,17 @@ TEST( SectionHierarchyReadWriteTests, TestEntitySectionWriterAndReadback )
 		section_object my_hierarchy;
 		my_hierarchy.SetupRandom( (int)capped_rand( 2, 5 ) );
 
+		// write with the original or compact sizes format
+		const u16 format_flags = random_value<bool>() ? u16( sf_compact_sizes ) : u16( sf_none );
+
 		MemoryWriteStream ws;
-		EntityWriter ew( ws );
+		EntityWriter ew( ws, format_flags );
 		ws.SetFlipByteOrder( random_value<bool>() );
 
 		EXPECT_TRUE( my_hierarchy.Write( ws, ew ) );
 
 		MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
-		EntityReader er( rs );
+		EntityReader er( rs, rs.GetSize(), format_flags );
 
 		section_object readback_hierarchy;
 		readback_hierarchy.Read( rs, er );
@@ -310,6 +313,44 @@ TEST( SectionHierarchyReadWriteTests, TestEntitySectionWriterAndReadback )
 	}
 }
 
+TEST( SectionHierarchyReadWriteTests, TestCompactSizesOfLargeValues )
+{
+	const std::string long_string( 200, 'x' );
+	const std::vector<u32> long_array( 100, 42 );
+
+	MemoryWriteStream ws;
+	EntityWriter ew( ws, sf_compact_sizes );
+
+	// a section with a string and an array which both need a 2 byte size
+	EntityWriter *section_writer = ew.BeginWriteSection( "sub", 3 );
+	ASSERT_NE( section_writer, nullptr );
+	EXPECT_TRUE( section_writer->Write( "str", 3, long_string ) );
+	EXPECT_TRUE( section_writer->Write( "arr", 3, long_array ) );
+	EXPECT_TRUE( ew.EndWriteSection( section_writer ) );
+
+	// the string and the array sizes are written with the minimal number of bytes, and the size of 
+	// the section is padded to the reserved 4 bytes
+	const u64 string_block_size = 1 + 2 + 1 + 3 + 2 + 200; // type, size, key size, key, character count, characters
+	const u64 array_block_size = 1 + 2 + 1 + 3 + 1 + 1 + 400; // type, size, key size, key, flags, item count, items
+	EXPECT_EQ( ws.GetSize(), u64( 1 + 4 + 1 + 3 ) + string_block_size + array_block_size );
+
+	MemoryReadStream rs( ws.GetData(), ws.GetSize(), ws.GetFlipByteOrder() );
+	EntityReader er( rs, rs.GetSize(), sf_compact_sizes );
+
+	EntityReader *section_reader = nullptr;
+	bool success = false;
+	std::tie( section_reader, success ) = er.BeginReadSection( "sub", 3, false );
+	ASSERT_TRUE( success );
+	ASSERT_NE( section_reader, nullptr );
+	std::string read_string;
+	std::vector<u32> read_array;
+	EXPECT_TRUE( section_reader->Read( "str", 3, read_string ) );
+	EXPECT_TRUE( section_reader->Read( "arr", 3, read_array ) );
+	EXPECT_TRUE( er.EndReadSection( section_reader ) );
+	EXPECT_EQ( read_string, long_string );
+	EXPECT_EQ( read_array, long_array );
+}
+
 // implement the random value function for std::unique_ptr<section_object>
 template<> std::unique_ptr<section_object> random_value< std::unique_ptr<section_object> >()
 {
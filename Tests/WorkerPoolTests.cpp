@@ -0,0 +1,37 @@
+// pds - Persistent data structure framework, Copyright (c) 2022 Ulrik Lindahl
+// Licensed under the MIT license https://github.com/Cooolrik/pds/blob/main/LICENSE
+
+#include "Tests.h"
+
+#include <atomic>
+#include <pds/WorkerPool.h>
+
+TEST( WorkerPoolTests, WorkerPoolBasicTests )
+{
+	WorkerPool pool;
+
+	// tasks cant be added before the pool is started
+	EXPECT_FALSE( pool.Enqueue( []() {} ) );
+	EXPECT_FALSE( pool.IsRunning() );
+
+	// the queue must fit at least one task
+	EXPECT_EQ( pool.Start( 2, 0 ), status::invalid_param );
+
+	EXPECT_EQ( pool.Start( 4, 8 ), status::ok );
+	EXPECT_TRUE( pool.IsRunning() );
+	EXPECT_EQ( pool.Start( 4, 8 ), status::already_initialized );
+
+	// add many more tasks than fit in the queue, all are run before Stop returns
+	std::atomic<u64> sum{ 0 };
+	const u64 task_count = 1000;
+	for( u64 i = 1; i <= task_count; ++i )
+	{
+		EXPECT_TRUE( pool.Enqueue( [&sum, i]() { sum += i; } ) );
+	}
+	pool.Stop();
+	EXPECT_EQ( sum.load(), task_count * ( task_count + 1 ) / 2 );
+
+	// no tasks are accepted after the pool is stopped
+	EXPECT_FALSE( pool.IsRunning() );
+	EXPECT_FALSE( pool.Enqueue( []() {} ) );
+}
@@ -25,6 +25,8 @@ set(
 	./Include/pds/IndexedVector_MF.h
 	./Include/pds/ItemTable.h
 	./Include/pds/ItemTable_MF.h
+	./Include/pds/LazyItem.h
+	./Include/pds/LazyItem_MF.h
 	./Include/pds/MemoryReadStream.h
 	./Include/pds/MemoryReadStream.inl
 	./Include/pds/MemoryWriteStream.h
@@ -36,6 +38,8 @@ set(
 	./Include/pds/Varying_MF.h
 	./Include/pds/Varying.inl
 	./Include/pds/Varying_MF.inl
+	./Include/pds/WorkerPool.h
+	./Include/pds/WorkerPool.inl
 
 	# compilation helper files
 	./Include/pds/_pds_macros.inl
@@ -56,6 +60,9 @@ if(BUILD_PERSISTENT_DS_TESTS)
 		RESULT_VARIABLE 	py_result
 	)
 	message(STATUS "Result of GenerateTestPacks.py: ${py_result}")
+
+	# the source files of the generated test package
+	include( ${CMAKE_CURRENT_LIST_DIR}/Tests/TestPackA/TestPackASources.cmake )
 	
 	set (CMAKE_CXX_STANDARD 14)
 
@@ -71,7 +78,7 @@ if(BUILD_PERSISTENT_DS_TESTS)
 	add_executable( 
 		systemtest
 		./Tests/SystemTest.cpp 
-		./Tests/TestPackA/TestPackA.cpp 
+		${TestPackA_source_files}
 		./Tests/HeaderLibraries.cpp 
 		
 		${pds_library_files}
@@ -108,8 +115,9 @@ if(BUILD_PERSISTENT_DS_TESTS)
 		./Tests/ReadWriteTests.cpp
 		./Tests/SectionHierarchyReadWriteTests.cpp
 		./Tests/TypeTests.cpp 
+		./Tests/WorkerPoolTests.cpp
 		./Tests/TestHelpers/random_vals.cpp 
-		./Tests/TestPackA/TestPackA.cpp 
+		${TestPackA_source_files}
 		
 		dependencies.cmake
 		pds.cmake